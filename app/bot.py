@@ -3,15 +3,52 @@ import asyncio
 from aiogram import Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from app.core import aiogram_bot
+from app.core import aiogram_bot, config_aiogram, sender
 from app.logger import logger
 from app.handlers import (start)
 from app.keyboards import set_commands_menu
-from app.database import initialize_database, engine
+from app.database import initialize_database, engine, AsyncSessionLocal, dialog_cache, log_cache_stats
+from app.middlewares import DbSessionMiddleware
+from app2.middlewares import UserSerialMiddleware, ThrottlingMiddleware, SEARCH, STOP
+from app2.utils.webhook import run_webhook, set_webhook, ensure_secret
 
-async def start_params() -> None:
+
+background: list[asyncio.Task] = []
+
+
+async def on_startup() -> None:
+    sender.start()
+    if dialog_cache.enabled:
+        background.append(asyncio.create_task(log_cache_stats()))
+
+
+async def on_shutdown() -> None:
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    background.clear()
+    await sender.stop(drain=5)
+
+
+def build_dispatcher() -> Dispatcher:
     dp = Dispatcher(storage=MemoryStorage())
     dp.include_router(start.router)
+    # Апдейты одного пользователя — по очереди, разных пользователей — параллельно
+    dp.update.outer_middleware(UserSerialMiddleware())
+    # Ленивая сессия БД: одна транзакция на апдейт, соединение — только при первом запросе
+    dp.update.outer_middleware(DbSessionMiddleware(AsyncSessionLocal))
+    # Флуд-контроль: лишние пересылки, поиски и выходы отбрасываются до хендлеров
+    throttling = ThrottlingMiddleware(actions={"🔍 Поиск собеседника": SEARCH, "❌ Завершить диалог": STOP},
+                                      notify=sender.send_message)
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def start_params() -> None:
+    dp = build_dispatcher()
     logger.info('Bot started')
 
     # # инициализация БД
@@ -24,10 +61,32 @@ async def start_params() -> None:
     await dp.start_polling(aiogram_bot)
 
 
+async def prepare_webhook() -> None:
+    """Однократная подготовка перед запуском webhook-воркеров"""
+    await initialize_database(engine)
+    await set_commands_menu(aiogram_bot)
+    webhook = config_aiogram.webhook
+    await set_webhook(aiogram_bot, f"{webhook.url}{webhook.path}", webhook.secret, webhook.drop_pending)
+    # Соединения пула не должны достаться дочерним процессам
+    await engine.dispose()
+
+
 async def main():
     task1 = asyncio.create_task(start_params())
     await asyncio.gather(task1)
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    webhook = config_aiogram.webhook
+    if webhook.mode == 'webhook':
+        logger.info('Bot started (webhook)')
+        webhook.secret = ensure_secret(webhook.secret)
+        if webhook.workers > 1:
+            # Кэш диалогов не знает о диалогах, закрытых в соседних воркерах
+            dialog_cache.enabled = False
+            logger.info('Active dialog cache disabled: several webhook workers')
+        asyncio.run(prepare_webhook())
+        run_webhook(lambda: (build_dispatcher(), aiogram_bot), webhook.path, webhook.secret,
+                    webhook.host, webhook.port, webhook.workers)
+    else:
+        asyncio.run(main())
@@ -1 +1 @@
-from .config_aiogram import aiogram_bot, config_aiogram
+from .config_aiogram import aiogram_bot, config_aiogram, sender
@@ -2,6 +2,8 @@ from environs import Env
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from app2.utils import SendScheduler
+from app2.utils.sender import GLOBAL_RATE
 
 
 class TgBot:
@@ -9,17 +11,42 @@ class TgBot:
         self.token = token
 
 
+class Webhook:
+    def __init__(self, mode: str, url: str, path: str, secret: str, host: str, port: int, workers: int,
+                 drop_pending: bool = False):
+        self.mode = mode  # polling или webhook
+        self.url = url
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.drop_pending = drop_pending  # выбросить апдейты, накопившиеся до запуска
+
+
 class Config:
-    def __init__(self, tg_bot: TgBot, admin_id: str):
+    def __init__(self, tg_bot: TgBot, admin_id: str, webhook: Webhook):
         self.tg_bot = tg_bot
         self.admin_id = admin_id.split(',') if len(admin_id) > 9 else admin_id
+        self.webhook = webhook
 
 
 def load_config(path: str | None = None) -> Config:
     env = Env()
     env.read_env(path)
-    return Config(tg_bot=TgBot(token=env('TOKEN')), admin_id=env('ADMIN_ID'))
+    webhook = Webhook(mode=env('BOT_MODE', 'polling'),
+                      url=env('WEBHOOK_URL', ''),
+                      path=env('WEBHOOK_PATH', '/webhook'),
+                      secret=env('WEBHOOK_SECRET', ''),
+                      host=env('WEBHOOK_HOST', '0.0.0.0'),
+                      port=env.int('WEBHOOK_PORT', 8080),
+                      workers=env.int('WEBHOOK_WORKERS', 1),
+                      drop_pending=env.bool('WEBHOOK_DROP_PENDING', False))
+    return Config(tg_bot=TgBot(token=env('TOKEN')), admin_id=env('ADMIN_ID'), webhook=webhook)
 
 
 config_aiogram = load_config()
 aiogram_bot = Bot(token=config_aiogram.tg_bot.token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# Очередь исходящих сообщений с учётом лимитов Telegram; лимит на бота делится между воркерами webhook
+_senders = config_aiogram.webhook.workers if config_aiogram.webhook.mode == 'webhook' else 1
+sender = SendScheduler(aiogram_bot, global_rate=GLOBAL_RATE / max(_senders, 1))
@@ -1,3 +1,5 @@
-from .models import User, Dialog
+from .models import User, Dialog, ActiveDialog
 from .db_session import AsyncSessionLocal, engine
-from .loader import initialize_database
\ No newline at end of file
+from .loader import initialize_database
+from .migrations import migrate, SCHEMA_VERSION
+from .dialog_cache import ActiveDialogCache, dialog_cache, log_cache_stats
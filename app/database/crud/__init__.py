@@ -1 +1,2 @@
-from .methods import add_user, set_user_state,  find_searching_user, create_dialog, get_companion_id, end_dialog
\ No newline at end of file
+from .methods import add_user, set_user_state, upsert_user, upsert_users, find_searching_user, claim_searching_user, create_dialog, get_companion_id, end_dialog
+from . import fast
@@ -0,0 +1,162 @@
+"""
+Быстрый путь для самых частых запросов на asyncpg.
+
+Запросы идут напрямую в соединение asyncpg, минуя компиляцию SQLAlchemy и
+гидрацию ORM-объектов: подготовленные выражения кэшируются на каждом
+соединении пула, результаты — простые значения и кортежи. Выполняются в
+текущей транзакции сессии и не коммитят: транзакцию завершает вызывающий
+(обычно DbSessionMiddleware); исключение — create_dialog, который, как и
+ORM-версия, коммитит, чтобы кэш диалогов не опережал базу. На других
+драйверах (SQLite) функции вызывают обычные ORM-версии из methods.py.
+"""
+from datetime import datetime
+
+from asyncpg.exceptions import InvalidCachedStatementError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import User, dialog_cache
+from app.database.crud import methods
+from app.logger import logger
+
+STATEMENTS_KEY = "fast_statements"  # ключ кэша подготовленных выражений в info соединения пула
+
+_COMPANION = "SELECT companion_id FROM active_dialogs WHERE user_id = $1"
+
+_SET_STATE = "UPDATE users SET user_state = $2 WHERE user_id = $1"
+
+# Тот же фильтр срока, порядок и блокировка, что в methods.claim_searching_user
+# без корзин, одним запросом
+_CLAIM = """
+    UPDATE users SET user_state = 'InDialog'
+    WHERE record_id = (SELECT record_id FROM users
+                       WHERE user_state = 'Searching' AND user_id <> $1
+                         AND (search_deadline IS NULL OR search_deadline > $2)
+                       ORDER BY search_deadline, record_id LIMIT 1
+                       FOR UPDATE SKIP LOCKED)
+    RETURNING user_id, username
+"""
+
+# methods.create_dialog одним запросом. Удаляются только строки прежних собеседников:
+# строки самой пары перезаписывает upsert, одна строка не меняется дважды за запрос.
+# Новый диалог UPDATE closed не видит: все части запроса работают с одним снимком
+_CREATE_DIALOG = """
+    WITH closed AS (
+        UPDATE dialogs SET dialog_status = 'Closed'
+        WHERE dialog_status = 'Open' AND (user_1_id IN ($3, $4) OR user_2_id IN ($3, $4))
+    ), released AS (
+        DELETE FROM active_dialogs
+        WHERE companion_id IN ($3, $4) AND user_id NOT IN ($3, $4)
+        RETURNING user_id
+    ), offline AS (
+        UPDATE users SET user_state = 'Offline' WHERE user_id IN (SELECT user_id FROM released)
+    ), dialog AS (
+        INSERT INTO dialogs (dialog_date, dialog_id, user_1_id, user_2_id, dialog_status)
+        VALUES ($1, $2, $3, $4, 'Open')
+        RETURNING record_id
+    ), active AS (
+        INSERT INTO active_dialogs (user_id, companion_id) VALUES ($3, $4), ($4, $3)
+        ON CONFLICT (user_id) DO UPDATE SET companion_id = EXCLUDED.companion_id
+    ), states AS (
+        UPDATE users SET user_state = 'InDialog' WHERE user_id IN ($3, $4)
+    )
+    SELECT (SELECT record_id FROM dialog), ARRAY(SELECT user_id FROM released)
+"""
+
+
+def is_fast(session: AsyncSession) -> bool:
+    return session.get_bind().dialect.driver == "asyncpg"
+
+
+async def _prepared(session: AsyncSession, query: str):
+    """Подготовленное выражение на соединении сессии; транзакция сессии начинается, если ещё не начата"""
+    connection = await session.connection()
+    fairy = await connection.get_raw_connection()
+    driver = fairy.driver_connection
+    # Адаптер SQLAlchemy открывает транзакцию asyncpg лениво, перед первым своим
+    # запросом; делаем такой запрос сами, чтобы commit/rollback сессии касались и наших
+    if not driver.is_in_transaction():
+        await connection.exec_driver_sql("SELECT 1")
+    # info живёт вместе с соединением пула и очищается при его пересоздании
+    statements = fairy.info.setdefault(STATEMENTS_KEY, {})
+    statement = statements.get(query)
+    if statement is None:
+        statement = statements[query] = await driver.prepare(query)
+    return statement, statements
+
+
+async def _fetchrow(session: AsyncSession, query: str, *args):
+    statement, statements = await _prepared(session, query)
+    try:
+        return await statement.fetchrow(*args)
+    except InvalidCachedStatementError:
+        # Схема поменялась (миграция): выражение подготовим заново при следующем вызове
+        statements.pop(query, None)
+        raise
+
+
+async def get_companion_id(session: AsyncSession, user_id: int) -> int | None:
+    """ID собеседника или None; как methods.get_companion_id, сначала кэш процесса"""
+    if not is_fast(session):
+        return await methods.get_companion_id(session, user_id)
+    companion_id = dialog_cache.get(user_id)
+    if companion_id is not None:
+        return companion_id
+    try:
+        generation = dialog_cache.generation
+        row = await _fetchrow(session, _COMPANION, user_id)
+        if row is None:
+            return None
+        dialog_cache.put(user_id, row[0], generation)
+        return row[0]
+
+    except Exception as e:
+        logger.error(f"Ошибка получения companion_id для user_id={user_id}: {e}")
+        return None
+
+
+async def set_user_state(session: AsyncSession, user_id: int, state: str) -> bool:
+    """Меняет состояние пользователя. Возвращает False, если пользователя нет"""
+    if not is_fast(session):
+        return await methods.set_user_state(session, user_id, state) is not None
+    statement, _ = await _prepared(session, _SET_STATE)
+    await statement.fetch(user_id, state)
+    # Число изменённых строк — из статуса последнего выполнения ("UPDATE 1")
+    return statement.get_statusmsg() != "UPDATE 0"
+
+
+async def claim_searching_user(session: AsyncSession, exclude_user_id: int) -> tuple[int, str | None] | None:
+    """
+    Забирает самого раннего ищущего, как methods.claim_searching_user.
+
+    Returns:
+        tuple | None: (user_id, username) или None, если ищущих нет
+    """
+    if not is_fast(session):
+        user = await methods.claim_searching_user(session, exclude_user_id)
+        return (user.user_id, user.username) if user else None
+    row = await _fetchrow(session, _CLAIM, exclude_user_id, datetime.now())
+    return (row[0], row[1]) if row else None
+
+
+async def create_dialog(session: AsyncSession, user_id: int, companion_id: int) -> tuple[int, int]:
+    """
+    Создаёт диалог, как methods.create_dialog, но по id пользователей.
+
+    Returns:
+        tuple: (record_id, dialog_id) нового диалога
+    """
+    if not is_fast(session):
+        users = {user.user_id: user for user in
+                 await session.scalars(select(User).where(User.user_id.in_([user_id, companion_id])))}
+        dialog = await methods.create_dialog(session, users[user_id], users[companion_id])
+        return dialog.record_id, dialog.dialog_id
+
+    dialog_id = int(f"{min(user_id, companion_id)}{max(user_id, companion_id)}"[:18])
+    record_id, released = await _fetchrow(session, _CREATE_DIALOG,
+                                          datetime.now(), dialog_id, user_id, companion_id)
+    await session.commit()
+    dialog_cache.invalidate(*released)
+    dialog_cache.put(user_id, companion_id)
+    dialog_cache.put(companion_id, user_id)
+    return record_id, dialog_id
@@ -1,8 +1,9 @@
 from datetime import datetime
-from sqlalchemy import update, Select
+from sqlalchemy import update, delete, Select, and_, or_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from sqlalchemy.future import select
-from app.database import User, Dialog
+from app.database import User, Dialog, ActiveDialog, dialog_cache
 from app.logger import logger
 
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -82,11 +83,115 @@ async def set_user_state(session: AsyncSession, user_id: int, state: str):
         return None
 
 
+UPSERT_BATCH = 1000  # строк в одном INSERT пакетной загрузки
+
+
+def _insert(session: AsyncSession):
+    """INSERT с ON CONFLICT для диалекта сессии (Postgres или SQLite); None — диалект его не умеет"""
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    return None
+
+
+async def _merge_users(session: AsyncSession, users: dict[int, str | None],
+                       state: str | None = None) -> dict[int, User]:
+    """Запасной путь без ON CONFLICT: SELECT ... FOR UPDATE, затем обновление или добавление"""
+    result = await session.execute(select(User).where(User.user_id.in_(users)).with_for_update())
+    existing = {user.user_id: user for user in result.scalars()}
+    for user_id, username in users.items():
+        user = existing.get(user_id)
+        if user is None:
+            user = existing[user_id] = User(user_id=user_id, username=username, user_state=state or "Offline")
+            session.add(user)
+            continue
+        user.username = username
+        if state is not None:
+            user.user_state = state
+    await session.flush()
+    return existing
+
+
+async def upsert_user(session: AsyncSession, user_id: int, username: str | None = None,
+                      state: str | None = None, commit: bool = True) -> User | None:
+    """
+    Добавляет пользователя или обновляет username и, если задано, состояние —
+    одним INSERT ... ON CONFLICT DO UPDATE ... RETURNING вместо SELECT и commit
+    в add_user и set_user_state.
+
+    Args:
+        session: Асинхронная сессия SQLAlchemy
+        user_id: Telegram user_id
+        username: Telegram username
+        state: новое состояние; None — новому 'Offline', существующему не меняем
+        commit: False — оставить транзакцию открытой (строка пользователя остаётся заблокированной)
+
+    Returns:
+        User: Объект пользователя или None в случае ошибки
+    """
+    try:
+        insert = _insert(session)
+        if insert is None:
+            user = (await _merge_users(session, {user_id: username}, state))[user_id]
+            if commit:
+                await session.commit()
+            return user
+        stmt = insert(User).values(user_id=user_id, username=username, user_state=state or "Offline")
+        changes = {"username": stmt.excluded.username}
+        if state is not None:
+            changes["user_state"] = stmt.excluded.user_state
+        stmt = stmt.on_conflict_do_update(index_elements=[User.user_id], set_=changes).returning(User)
+        result = await session.execute(stmt, execution_options={"populate_existing": True})
+        user = result.scalar_one()
+        if commit:
+            await session.commit()
+        return user
+
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка SQLAlchemy при upsert пользователя {user_id}: {e}")
+        return None
+
+
+async def upsert_users(session: AsyncSession, users: list[tuple[int, str | None]]) -> int:
+    """
+    Пакетная загрузка пользователей (user_id, username): существующим обновляется
+    username, состояние не трогается. По UPSERT_BATCH строк на запрос.
+
+    Returns:
+        int: сколько строк обработано
+    """
+    insert = _insert(session)
+    # В одном INSERT ... ON CONFLICT user_id не должен повторяться
+    rows = list({user_id: {"user_id": user_id, "username": username} for user_id, username in users}.values())
+    try:
+        for start in range(0, len(rows), UPSERT_BATCH):
+            batch = rows[start:start + UPSERT_BATCH]
+            if insert is None:
+                await _merge_users(session, {row["user_id"]: row["username"] for row in batch})
+                continue
+            stmt = insert(User).values(batch)
+            stmt = stmt.on_conflict_do_update(index_elements=[User.user_id],
+                                              set_={"username": stmt.excluded.username})
+            await session.execute(stmt)
+        await session.commit()
+        return len(rows)
+
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка SQLAlchemy при пакетной загрузке пользователей: {e}")
+        return 0
+
+
 async def find_searching_user(session: AsyncSession, exclude_user_id: int) -> User | None:
-    """Ищет другого пользователя, который в поиске"""
+    """Ищет другого пользователя, который в поиске (без блокировки, см. claim_searching_user)"""
     try:
-        stmt = select(User).where(User.user_id != exclude_user_id,
-                                  User.user_state == "Searching")
+        stmt = (select(User)
+                .where(User.user_id != exclude_user_id, User.user_state == "Searching")
+                .order_by(User.record_id)
+                .limit(1))
         result = await session.execute(stmt)
         return result.scalar_one_or_none()
     except SQLAlchemyError as e:
@@ -98,12 +203,70 @@ async def find_searching_user(session: AsyncSession, exclude_user_id: int) -> Us
         return None
 
 
+async def claim_searching_user(session: AsyncSession, exclude_user_id: int,
+                               buckets: list[tuple[str, str]] | None = None) -> User | None:
+    """
+    Атомарно забирает самого давнего ищущего пользователя с неистёкшим сроком поиска.
+
+    Строка блокируется до конца транзакции (SELECT ... FOR UPDATE SKIP LOCKED):
+    параллельные поиски на Postgres забирают разных собеседников, а не
+    сталкиваются на одном. В SQLite запись и так идёт в одну очередь.
+    Пользователь сразу переводится в "InDialog"; транзакцию завершает вызывающий
+    (обычно create_dialog).
+
+    Args:
+        buckets: подходящие корзины (пол, кого ищет) — см. app2.matchmaking.compatible_buckets;
+            None — любой ищущий
+
+    Returns:
+        User | None: забранный пользователь или None, если ищущих нет
+    """
+    try:
+        stmt = (select(User)
+                .where(User.user_id != exclude_user_id, User.user_state == "Searching",
+                       User.search_deadline.is_(None) | (User.search_deadline > datetime.now())))
+        if buckets is not None:
+            stmt = stmt.where(or_(*(and_(User.sex == sex, User.search_want == want) for sex, want in buckets)))
+        stmt = (stmt.order_by(User.search_deadline, User.record_id)
+                .limit(1)
+                .with_for_update(skip_locked=True))
+        result = await session.execute(stmt)
+        user = result.scalar_one_or_none()
+        if user:
+            user.user_state = "InDialog"
+        return user
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(e)
+        return None
+
+
 async def create_dialog(session: AsyncSession, user1: User, user2: User) -> Dialog:
     """
-    Создаёт диалог между двумя пользователями и обновляет их состояния.
+    Создаёт диалог между двумя пользователями, обновляет их состояния
+    и индекс активных диалогов (таблица active_dialogs и кэш процесса).
+    Прежние диалоги обоих закрываются, их бывшие собеседники переходят в "Offline".
     """
     # генерируем уникальный dialog_id
     dialog_id = int(f"{min(user1.user_id, user2.user_id)}{max(user1.user_id, user2.user_id)}"[:18])
+    pair = [user1.user_id, user2.user_id]
+
+    # Закрываем прежние диалоги до добавления нового: autoflush закрыл бы и его
+    await session.execute(
+        update(Dialog)
+        .where(Dialog.dialog_status == "Open", Dialog.user_1_id.in_(pair) | Dialog.user_2_id.in_(pair))
+        .values(dialog_status="Closed")
+    )
+    # Прежние собеседники обоих больше не в паре с ними
+    result = await session.execute(
+        delete(ActiveDialog)
+        .where(ActiveDialog.user_id.in_(pair) | ActiveDialog.companion_id.in_(pair))
+        .returning(ActiveDialog.user_id)
+    )
+    released = result.scalars().all()
+    former = [user_id for user_id in released if user_id not in pair]
+    if former:
+        await session.execute(update(User).where(User.user_id.in_(former)).values(user_state="Offline"))
 
     dialog = Dialog(
         dialog_date=datetime.now(),
@@ -112,20 +275,27 @@ async def create_dialog(session: AsyncSession, user1: User, user2: User) -> Dial
         user_2_id=user2.user_id
     )
     session.add(dialog)
-    await session.commit()
-    await session.refresh(dialog)
+    session.add_all([
+        ActiveDialog(user_id=user1.user_id, companion_id=user2.user_id),
+        ActiveDialog(user_id=user2.user_id, companion_id=user1.user_id),
+    ])
 
     # обновляем состояния пользователей
     user1.user_state = "InDialog"
     user2.user_state = "InDialog"
     await session.commit()
+    await session.refresh(dialog)
 
+    dialog_cache.invalidate(*released)
+    dialog_cache.put(user1.user_id, user2.user_id)
+    dialog_cache.put(user2.user_id, user1.user_id)
     return dialog
 
 
 async def get_companion_id(session: AsyncSession, user_id: int) -> int | None:
     """
     Возвращает ID собеседника для пользователя, если есть активный диалог.
+    Сначала кэш процесса, затем поиск по первичному ключу active_dialogs.
 
     Args:
         session: асинхронная сессия SQLAlchemy
@@ -134,32 +304,28 @@ async def get_companion_id(session: AsyncSession, user_id: int) -> int | None:
     Returns:
         int | None: ID собеседника или None, если диалога нет
     """
+    companion_id = dialog_cache.get(user_id)
+    if companion_id is not None:
+        return companion_id
     try:
-        # Ищем активный диалог, где участвует пользователь
-        stmt = select(Dialog).where(
-            ((Dialog.user_1_id == user_id) | (Dialog.user_2_id == user_id))
+        generation = dialog_cache.generation
+        companion_id = await session.scalar(
+            select(ActiveDialog.companion_id).where(ActiveDialog.user_id == user_id)
         )
-        result = await session.execute(stmt)
-        dialog = result.scalar_one_or_none()
-
-        if not dialog:
-            return None
-
-        # Определяем собеседника
-        if dialog.user_1_id == user_id:
-            return dialog.user_2_id
-        else:
-            return dialog.user_1_id
+        if companion_id is not None:
+            dialog_cache.put(user_id, companion_id, generation)
+        return companion_id
 
     except Exception as e:
         logger.error(f"Ошибка получения companion_id для user_id={user_id}: {e}")
         return None
 
 
-
 async def end_dialog(session: AsyncSession, user_id: int) -> bool:
     """
     Завершает активный диалог пользователя, меняя его статус на 'Closed'.
+    Собеседник берётся из active_dialogs; закрываются все открытые диалоги
+    пользователя, поэтому дубли от старых версий не мешают выйти.
 
     Args:
         session: асинхронная сессия SQLAlchemy
@@ -169,29 +335,31 @@ async def end_dialog(session: AsyncSession, user_id: int) -> bool:
         bool: True, если диалог успешно завершён, False если диалога нет
     """
     try:
-        # Находим активный диалог
-        stmt = select(Dialog).where(
-            ((Dialog.user_1_id == user_id) | (Dialog.user_2_id == user_id)) &
-            (Dialog.dialog_status == "Open")
+        companion_id = await session.scalar(
+            select(ActiveDialog.companion_id).where(ActiveDialog.user_id == user_id)
         )
-        result = await session.execute(stmt)
-        dialog = result.scalar_one_or_none()
-
-        if not dialog:
+        if companion_id is None:
             return False
 
-        # Меняем статус диалога на 'Closed'
-        dialog.dialog_status = "Closed"
+        # Меняем статус диалогов на 'Closed'
+        await session.execute(
+            update(Dialog)
+            .where(Dialog.dialog_status == "Open", (Dialog.user_1_id == user_id) | (Dialog.user_2_id == user_id))
+            .values(dialog_status="Closed")
+        )
 
         # Возвращаем пользователей в состояние "Offline"
-        stmt_users = select(User).where(User.user_id.in_([dialog.user_1_id, dialog.user_2_id]))
-        result_users = await session.execute(stmt_users)
-        users = result_users.scalars().all()
+        pair = [user_id, companion_id]
+        await session.execute(update(User).where(User.user_id.in_(pair)).values(user_state="Offline"))
 
-        for u in users:
-            u.user_state = "Offline"
+        # Строку собеседника удаляем, только если он всё ещё в паре с пользователем
+        await session.execute(delete(ActiveDialog).where(
+            (ActiveDialog.user_id == user_id) |
+            ((ActiveDialog.user_id == companion_id) & (ActiveDialog.companion_id == user_id))
+        ))
 
         await session.commit()
+        dialog_cache.invalidate(*pair)
         return True
 
     except Exception as e:
@@ -12,7 +12,15 @@ DATABASE_URL = env('DB_PATH')
 # database = Database(DATABASE_URL)
 Base = declarative_base()
 
-engine = create_async_engine(DATABASE_URL, future=True)
+# Размер пула подбирается по метрикам DbSessionMiddleware (ожидание и загрузка пула);
+# in-memory SQLite работает на одном соединении без пула
+POOL_OPTIONS = {} if ":memory:" in DATABASE_URL else dict(
+    pool_size=env.int('DB_POOL_SIZE', 5),
+    max_overflow=env.int('DB_MAX_OVERFLOW', 10),
+    pool_timeout=env.float('DB_POOL_TIMEOUT', 30),
+)
+
+engine = create_async_engine(DATABASE_URL, future=True, **POOL_OPTIONS)
 
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from app.logger import logger
+
+CACHE_SIZE = 50_000  # сколько собеседников держим в памяти процесса
+CACHE_TTL = 30  # страховка от ошибок инвалидации, секунд
+STATS_INTERVAL = 60  # как часто пишем статистику кэша в лог, секунд
+
+
+class ActiveDialogCache:
+    """
+    LRU-кэш user_id -> собеседник перед таблицей active_dialogs.
+    Кэшируются только открытые диалоги; create_dialog и end_dialog обновляют
+    кэш сами, поэтому в одном процессе он всегда точен. Изменения из других
+    процессов сюда не доходят: с несколькими webhook-воркерами кэш выключается
+    (enabled = False), иначе сообщения уходили бы бывшему собеседнику.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Растёт при каждой инвалидации: значение, прочитанное из базы
+        # до инвалидации, в кэш уже не попадёт
+        self.generation = 0
+        self.enabled = True
+        self._data: OrderedDict[int, tuple[int, float]] = OrderedDict()
+
+    def get(self, user_id: int) -> int | None:
+        if not self.enabled:
+            return None
+        entry = self._data.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, user_id: int, companion_id: int, generation: int | None = None):
+        if not self.enabled or generation is not None and generation != self.generation:
+            return
+        self._data[user_id] = (companion_id, time.monotonic() + self.ttl)
+        self._data.move_to_end(user_id)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, *user_ids: int):
+        self.generation += 1
+        for user_id in user_ids:
+            self._data.pop(user_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+dialog_cache = ActiveDialogCache()
+
+
+async def log_cache_stats(cache: ActiveDialogCache = dialog_cache, interval: float = STATS_INTERVAL):
+    """Фоновая задача: периодически пишет в лог размер кэша и долю попаданий"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Active dialog cache: {cache.stats()}")
@@ -1,7 +1,7 @@
 from app.logger import logger
-from app.database.db_session import Base
+from app.database.migrations import migrate
+
 
 async def initialize_database(engine):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        logger.info("Database initialized")
\ No newline at end of file
+    version = await migrate(engine)
+    logger.info(f"Database initialized, schema version {version}")
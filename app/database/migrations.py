@@ -0,0 +1,155 @@
+"""
+Версионные миграции схемы без alembic.
+
+Каждая миграция — номер, описание и функция над соединением. Применённые
+записываются в таблицу schema_version; при старте выполняются только новые,
+каждая в своей транзакции. Таблицы и индексы в миграциях описаны отдельно от
+моделей и больше не меняются: последующие изменения — новыми миграциями.
+"""
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from sqlalchemy import (MetaData, Table, Column, Integer, String, BigInteger, DateTime, Index, text, select,
+                        insert)
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateColumn
+
+from app.logger import logger
+
+_versions = MetaData()
+schema_version = Table(
+    'schema_version', _versions,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# ---------- 1: исходная схема ----------
+
+_v1 = MetaData()
+_v1_users = Table(
+    'users', _v1,
+    Column('record_id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', BigInteger, nullable=False),
+    Column('username', String, nullable=True),
+    Column('user_state', String, default='Offline'),
+)
+_v1_dialogs = Table(
+    'dialogs', _v1,
+    Column('record_id', Integer, primary_key=True, autoincrement=True),
+    Column('dialog_date', DateTime),
+    Column('dialog_id', BigInteger),
+    Column('user_1_id', BigInteger, nullable=False),
+    Column('user_2_id', BigInteger, nullable=False),
+    Column('media_path', String, nullable=True),
+    Column('dialog_status', String, default='Open'),
+)
+
+
+async def _initial_schema(conn: AsyncConnection):
+    # Базы, созданные до миграций через create_all, уже содержат эти таблицы
+    await conn.run_sync(_v1.create_all, checkfirst=True)
+
+
+# ---------- 2: индексы ----------
+
+def _where(condition) -> dict:
+    return {"postgresql_where": condition, "sqlite_where": condition}
+
+
+_v2_indexes = [
+    Index('ix_users_user_id', _v1_users.c.user_id, unique=True),
+    Index('ix_users_searching', _v1_users.c.record_id, **_where(_v1_users.c.user_state == 'Searching')),
+    Index('ix_dialogs_open_user_1', _v1_dialogs.c.user_1_id, **_where(_v1_dialogs.c.dialog_status == 'Open')),
+    Index('ix_dialogs_open_user_2', _v1_dialogs.c.user_2_id, **_where(_v1_dialogs.c.dialog_status == 'Open')),
+]
+
+
+async def _indexes(conn: AsyncConnection):
+    # Дубли user_id мешают уникальному индексу: оставляем самую раннюю запись
+    deleted = await conn.execute(text(
+        "DELETE FROM users WHERE record_id NOT IN (SELECT MIN(record_id) FROM users GROUP BY user_id)"
+    ))
+    if deleted.rowcount:
+        logger.warning(f"Removed {deleted.rowcount} duplicate users")
+
+    def create(sync_conn):
+        for index in _v2_indexes:
+            index.create(sync_conn, checkfirst=True)
+
+    await conn.run_sync(create)
+
+
+# ---------- 3: индекс активных диалогов ----------
+
+_v3 = MetaData()
+_v3_active_dialogs = Table(
+    'active_dialogs', _v3,
+    Column('user_id', BigInteger, primary_key=True, autoincrement=False),
+    Column('companion_id', BigInteger, nullable=False),
+)
+
+
+async def _active_dialogs(conn: AsyncConnection):
+    await conn.run_sync(_v3.create_all, checkfirst=True)
+    # Заполняем из открытых диалогов; если у пользователя их несколько, берём последний
+    for user, companion in (("user_1_id", "user_2_id"), ("user_2_id", "user_1_id")):
+        await conn.execute(text(f"""
+            INSERT INTO active_dialogs (user_id, companion_id)
+            SELECT d.{user}, d.{companion} FROM dialogs d
+            WHERE d.dialog_status = 'Open'
+              AND d.record_id = (SELECT MAX(x.record_id) FROM dialogs x
+                                 WHERE x.dialog_status = 'Open'
+                                   AND (x.user_1_id = d.{user} OR x.user_2_id = d.{user}))
+              AND d.{user} NOT IN (SELECT user_id FROM active_dialogs)
+        """))
+
+
+# ---------- 4: профиль и срок поиска ----------
+
+_v4_users = Table(
+    'users', MetaData(),
+    Column('sex', String, nullable=False, server_default='u'),
+    Column('want', String, nullable=False, server_default='any'),
+    Column('search_deadline', DateTime, nullable=True),
+    Column('search_want', String, nullable=True),
+)
+
+
+async def _search_profile(conn: AsyncConnection):
+    for column in _v4_users.columns:
+        ddl = CreateColumn(column).compile(dialect=conn.dialect)
+        await conn.execute(text(f"ALTER TABLE users ADD COLUMN {ddl}"))
+
+
+# (версия, описание, функция); новые миграции — только в конец
+MIGRATIONS: list[tuple[int, str, Callable[[AsyncConnection], Awaitable[None]]]] = [
+    (1, "initial schema", _initial_schema),
+    (2, "unique user_id, partial indexes on searching users and open dialogs", _indexes),
+    (3, "active_dialogs: current companion per user", _active_dialogs),
+    (4, "users: match profile and search deadline", _search_profile),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def current_version(conn: AsyncConnection) -> int:
+    await conn.run_sync(_versions.create_all, checkfirst=True)
+    version = await conn.scalar(select(schema_version.c.version).order_by(schema_version.c.version.desc()))
+    return version or 0
+
+
+async def migrate(engine: AsyncEngine) -> int:
+    """Применяет недостающие миграции. Возвращает версию схемы"""
+    async with engine.begin() as conn:
+        version = await current_version(conn)
+    for number, description, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        async with engine.begin() as conn:
+            await apply(conn)
+            await conn.execute(insert(schema_version).values(
+                version=number, description=description, applied_at=datetime.now()
+            ))
+        logger.info(f"Migration {number} applied: {description}")
+        version = number
+    return version
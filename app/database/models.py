@@ -1,10 +1,14 @@
 import json
 from datetime import datetime
 from app.database.db_session import Base
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Text, DECIMAL, ForeignKey, JSON, Boolean
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Text, DECIMAL, ForeignKey, JSON, Boolean, Index
 from sqlalchemy.orm import relationship
 
 
+# Схемой управляют миграции (app/database/migrations.py); индексы здесь
+# повторяют созданные ими, чтобы модели описывали базу как есть
+
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -12,6 +16,20 @@ class User(Base):
     user_id = Column(BigInteger, nullable=False)
     username = Column(String, nullable=True)
     user_state = Column(String, default='Offline')
+    # Профиль для подбора (app2.matchmaking): свой пол и пол собеседника
+    sex = Column(String, nullable=False, default='u', server_default='u')
+    want = Column(String, nullable=False, default='any', server_default='any')
+    # Пока user_state == 'Searching': до какого времени ждёт и в какой корзине;
+    # NULL — без срока (поиск из app)
+    search_deadline = Column(DateTime, nullable=True)
+    search_want = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index('ix_users_user_id', 'user_id', unique=True),
+        # Частичный индекс: в нём только ищущие, поиск не сканирует всю таблицу
+        Index('ix_users_searching', 'record_id',
+              postgresql_where=user_state == 'Searching', sqlite_where=user_state == 'Searching'),
+    )
 
 
 class Dialog(Base):
@@ -25,8 +43,18 @@ class Dialog(Base):
     media_path = Column(String, nullable=True)
     dialog_status = Column(String, default='Open')
 
+    __table_args__ = (
+        # Открытые диалоги по каждому из участников; закрытая история в индексы не попадает
+        Index('ix_dialogs_open_user_1', 'user_1_id',
+              postgresql_where=dialog_status == 'Open', sqlite_where=dialog_status == 'Open'),
+        Index('ix_dialogs_open_user_2', 'user_2_id',
+              postgresql_where=dialog_status == 'Open', sqlite_where=dialog_status == 'Open'),
+    )
 
 
+class ActiveDialog(Base):
+    """Текущий собеседник пользователя: по строке на каждого участника открытого диалога"""
+    __tablename__ = 'active_dialogs'
 
-
-
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    companion_id = Column(BigInteger, nullable=False)
@@ -4,50 +4,54 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, FSInputFile, CallbackQuery, InputMediaPhoto
+from app.core import sender
+from app2.utils import PRIORITY_RELAY
 from app.keyboards import main_kb
-from app.utils import with_session
-from app.database import crud
+from app.database import crud, dialog_cache
 from app.states import user_states
+from app.logger import logger
 
 router = Router()
 
 
 @router.message(Command(commands='start'))
-@with_session
 async def start(message: Message, session):
     uid = message.from_user.id
     username = message.from_user.username
     await crud.add_user(session, user_id=uid, username=username)
-    await message.answer('Добро пожаловать!',
-                         reply_markup=main_kb.main_menu())
+    sender.send_message(message.chat.id, 'Добро пожаловать!',
+                        reply_markup=main_kb.main_menu())
 
 
 # Поиск собеседника
 @router.callback_query(F.text == '🔍 Поиск собеседника')
-@with_session
 async def search_companion(call: CallbackQuery, state, session):
     uid = call.from_user.id
     uname = call.from_user.username
 
-    # Обновляем или добавляем пользователя
-    user = await crud.add_user(session, uid, uname)
-
-    # Ставим пользователя в состояние поиска
-    await crud.set_user_state(session, uid, "Searching")
+    # Добавляем или обновляем пользователя и ставим в поиск — один запрос;
+    # транзакция остаётся открытой до создания диалога или конца апдейта
+    user = await crud.upsert_user(session, uid, uname, state="Searching", commit=False)
+    if user is None:
+        sender.send_message(call.message.chat.id, "⚠ Не удалось начать поиск, попробуйте ещё раз.")
+        return
 
-    # Ищем свободного пользователя
-    partner = await crud.find_searching_user(session, exclude_user_id=uid)
+    # Забираем ждущего собеседника: строка заблокирована до создания диалога,
+    # параллельный поиск его пропустит
+    partner = await crud.fast.claim_searching_user(session, exclude_user_id=uid)
 
     if partner:
+        partner_id, _ = partner
         # Создаём диалог
-        dialog = await crud.create_dialog(session, user, partner)
+        await crud.fast.create_dialog(session, uid, partner_id)
 
         # Сообщаем обоим
-        await call.message.answer("🎉 Собеседник найден! Можете начинать общение.")
-        await call.bot.send_message(partner.user_id, "🎉 Вам найден собеседник! Можете начинать общение.")
+        sender.send_message(call.message.chat.id, "🎉 Собеседник найден! Можете начинать общение.")
+        sender.send_message(partner_id, "🎉 Вам найден собеседник! Можете начинать общение.")
 
     else:
-        await call.message.answer("⏳ Собеседник не найден, ждём подключения...")
+        # Свободных нет — пользователь остаётся в поиске; транзакцию фиксирует DbSessionMiddleware
+        sender.send_message(call.message.chat.id, "⏳ Собеседник не найден, ждём подключения...")
 
     # FSM для кнопок
     await state.set_state(user_states.StartDialog.dialog_data)
@@ -55,45 +59,39 @@ async def search_companion(call: CallbackQuery, state, session):
 
 # Переписка через БД
 @router.message(F.text)
-@with_session
 async def relay_message(message: Message, state, session):
     uid = message.from_user.id
 
-    # Узнаем, есть ли у пользователя активный диалог
-    companion_id = await crud.get_companion_id(session, uid)
+    # Собеседник из кэша активных диалогов; сессия ленивая, соединение берётся только при промахе
+    companion_id = dialog_cache.get(uid)
+    if companion_id is None:
+        companion_id = await crud.fast.get_companion_id(session, uid)
 
     if not companion_id:
-        await message.answer("❗ Сейчас вы не находитесь в диалоге. Нажмите «🔍 Поиск собеседника».")
+        sender.send_message(message.chat.id, "❗ Сейчас вы не находитесь в диалоге. Нажмите «🔍 Поиск собеседника».")
         return
 
-    try:
-        await message.bot.send_message(
-            chat_id=companion_id,
-            text=message.text
-        )
-    except Exception as e:
-        await message.answer("⚠ Не удалось отправить сообщение собеседнику.")
-        print(f"Ошибка отправки: {e}")
+    def on_error(e: Exception):
+        sender.send_message(message.chat.id, "⚠ Не удалось отправить сообщение собеседнику.")
+        logger.error(f"Ошибка отправки сообщения от user_id={uid} собеседнику {companion_id}: {e}")
+
+    sender.send_message(companion_id, message.text, priority=PRIORITY_RELAY, on_error=on_error)
 
 
 
 @router.callback_query(F.text == "❌ Завершить диалог")
-@with_session
 async def finish_dialog(call: CallbackQuery, session):
     uid = call.from_user.id
 
-    companion_id = await crud.get_companion_id(session, uid)
+    companion_id = await crud.fast.get_companion_id(session, uid)
     if not companion_id:
-        await call.message.answer("❗ У вас нет активного диалога.")
+        sender.send_message(call.message.chat.id, "❗ У вас нет активного диалога.")
         return
 
     success = await crud.end_dialog(session, uid)
     if success:
         # Уведомляем обоих участников
-        await call.message.answer("✅ Диалог завершён.")
-        try:
-            await call.bot.send_message(companion_id, "✅ Ваш собеседник завершил диалог.")
-        except Exception:
-            pass
+        sender.send_message(call.message.chat.id, "✅ Диалог завершён.")
+        sender.send_message(companion_id, "✅ Ваш собеседник завершил диалог.", on_error=lambda e: None)
     else:
-        await call.message.answer("⚠ Не удалось завершить диалог.")
+        sender.send_message(call.message.chat.id, "⚠ Не удалось завершить диалог.")
@@ -0,0 +1,174 @@
+import inspect
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.pool import Pool
+
+from app.logger import logger
+
+METRICS_INTERVAL = 60  # как часто пишем метрики сессий в лог, секунд
+WAIT_SAMPLES = 1000  # сколько последних ожиданий пула храним для перцентилей
+# Методы, которым соединение не нужно: на ещё не подключённой сессии они ничего не делают
+_NO_CHECKOUT = {"commit", "rollback", "close", "in_transaction", "add", "add_all", "expunge", "expunge_all"}
+
+
+class SessionMetrics:
+    """
+    Метрики пула за интервал: ожидание соединения (от первого запроса
+    хендлера до выдачи соединения) и загрузка пула в момент выдачи.
+    По ним подбираются pool_size / max_overflow в create_async_engine.
+    """
+
+    def __init__(self, pool: Pool):
+        self.pool = pool
+        self.updates = 0  # апдейтов прошло через middleware
+        self.lazy = 0  # из них обошлись без соединения
+        self.checkouts = 0
+        self.timeouts = 0  # соединение не дождались за pool_timeout
+        self.rollbacks = 0
+        self.waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.saturation_max = 0.0
+
+    def capacity(self) -> int | None:
+        """Сколько соединений пул может выдать одновременно; None — без ограничения"""
+        size = getattr(self.pool, "size", None)
+        if size is None:
+            return None
+        return size() + max(getattr(self.pool, "_max_overflow", 0), 0)
+
+    def saturation(self) -> float | None:
+        capacity = self.capacity()
+        if not capacity:
+            return None
+        return self.pool.checkedout() / capacity
+
+    def checkout(self, wait: float):
+        self.checkouts += 1
+        self.waits.append(wait)
+        saturation = self.saturation()
+        if saturation is not None:
+            self.saturation_max = max(self.saturation_max, saturation)
+
+    def report(self) -> dict:
+        """Снимок метрик; счётчики интервала обнуляются"""
+        waits = sorted(self.waits)
+        saturation = self.saturation()
+        stats = {
+            "updates": self.updates,
+            "lazy": self.lazy,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "rollbacks": self.rollbacks,
+            "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 2) if waits else 0,
+            "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000, 2) if waits else 0,
+            "wait_max_ms": round(waits[-1] * 1000, 2) if waits else 0,
+            "pool_capacity": self.capacity(),
+            "saturation": round(saturation, 2) if saturation is not None else None,
+            "saturation_max": round(self.saturation_max, 2),
+        }
+        self.updates = self.lazy = self.checkouts = self.timeouts = self.rollbacks = 0
+        self.waits.clear()
+        self.saturation_max = 0.0
+        return stats
+
+
+class LazySession:
+    """
+    Обёртка над AsyncSession для одного апдейта. Сессия создаётся при первом
+    обращении, соединение берётся из пула при первом запросе — хендлер,
+    который вернулся раньше (или нашёл всё в кэше), пул не трогает.
+    """
+
+    def __init__(self, factory: async_sessionmaker[AsyncSession], metrics: SessionMetrics):
+        self._factory = factory
+        self._metrics = metrics
+        self._session: AsyncSession | None = None
+        self._connected = False
+
+    @property
+    def used(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = self._factory()
+        attr = getattr(self._session, name)
+        if self._connected or name in _NO_CHECKOUT or not inspect.iscoroutinefunction(attr):
+            return attr
+
+        async def first_call(*args, **kwargs):
+            await self._checkout()
+            return await attr(*args, **kwargs)
+        return first_call
+
+    async def _checkout(self):
+        if self._connected:
+            return
+        started = time.perf_counter()
+        try:
+            await self._session.connection()
+        except PoolTimeoutError:
+            self._metrics.timeouts += 1
+            raise
+        self._connected = True
+        self._metrics.checkout(time.perf_counter() - started)
+
+    async def finish(self, commit: bool):
+        """Фиксирует или откатывает транзакцию апдейта и возвращает соединение в пул"""
+        session = self._session
+        if session is None:
+            return
+        try:
+            if commit and session.in_transaction():
+                await session.commit()
+            elif session.in_transaction():
+                self._metrics.rollbacks += 1
+                await session.rollback()
+        except Exception:
+            self._metrics.rollbacks += 1
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update: кладёт в data["session"] ленивую сессию —
+    одна транзакция на апдейт. Если хендлер завершился без ошибки, незакрытая
+    транзакция фиксируется, при исключении откатывается. crud-функции, которые
+    коммитят сами, просто закрывают транзакцию раньше; следующий запрос
+    откроет новую на том же соединении.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession], interval: float = METRICS_INTERVAL):
+        self.session_factory = session_factory
+        self.metrics = SessionMetrics(session_factory.kw["bind"].pool)
+        self.interval = interval
+        self._reported = time.monotonic()
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: dict[str, Any]) -> Any:
+        session = data["session"] = LazySession(self.session_factory, self.metrics)
+        self.metrics.updates += 1
+        try:
+            result = await handler(event, data)
+        except Exception:
+            await session.finish(commit=False)
+            raise
+        else:
+            await session.finish(commit=True)
+            return result
+        finally:
+            if not session.used:
+                self.metrics.lazy += 1
+            if time.monotonic() - self._reported >= self.interval:
+                self._reported = time.monotonic()
+                logger.info(f"DB sessions: {self.metrics.report()}")
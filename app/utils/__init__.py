@@ -1 +0,0 @@
-from .decorators import with_session
\ No newline at end of file
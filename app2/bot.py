@@ -1,14 +1,22 @@
 import asyncio
 import os
-import redis.asyncio as redis
 from aiogram import Bot, Dispatcher, F
+from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import Message, CallbackQuery
 from sqlalchemy.util import await_only
 
 from app2.logger import logger
+from app2.database import redis_conn, listen_invalidations, log_cache_stats, unreachable_users, Lease
 from environs import Env
-from app2.keyboards import set_commands_menu
+from app2.keyboards import set_commands_menu, choose_sex, choose_partner_sex
+from app2.matchmaking import create_store, FEMALE, MALE, ANY, UNKNOWN
+from app2.middlewares import UserSerialMiddleware, ReachabilityMiddleware, ThrottlingMiddleware, SEARCH
+from app2.tasks import sweep_queue, reap_idle_pairs, AdminDigest, MediaArchiver, MediaRetention
+from app2.utils import SendScheduler, AlbumCollector, PRIORITY_RELAY, classify_failure
+from app2.utils.sender import GLOBAL_RATE
+from app2.utils.webhook import run_webhook, set_webhook, ensure_secret
+from app2.utils.sharding import run_cluster, run_worker, ingest
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
 # Клавиатура
@@ -24,15 +32,65 @@ main_kb = ReplyKeyboardMarkup(
 env = Env()
 env.read_env()
 API_TOKEN = env('TOKEN')
+ADMIN_CHAT_ID = env.int('ADMIN_CHAT_ID', 462813109)  # куда уходят сводки для администратора
+ADMIN_DIGEST_INTERVAL = env.int('ADMIN_DIGEST_INTERVAL', 60)  # секунд между сводками
+ADMIN_DIGEST_MAX_EVENTS = env.int('ADMIN_DIGEST_MAX_EVENTS', 200)  # событий до досрочной сводки
+
+# Режим запуска: polling, webhook, cluster (приём + SHARDS воркеров),
+# ingest или worker (по отдельности, например на разных машинах)
+BOT_MODE = env('BOT_MODE', 'polling')
+SHARDS = env.int('SHARDS', 4)  # процессов-воркеров в режиме cluster
+SHARD_INDEX = env.int('SHARD_INDEX', 0)  # номер шарда в режиме worker
+# Где хранятся очередь и пары: redis (по умолчанию), memory (один процесс) или sql
+MATCH_BACKEND = env('MATCH_BACKEND', 'redis')
+WEBHOOK_URL = env('WEBHOOK_URL', '')  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = env('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = env('WEBHOOK_SECRET', '')  # сверяется с X-Telegram-Bot-Api-Secret-Token; пустой — случайный на запуск
+WEBHOOK_HOST = env('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = env.int('WEBHOOK_PORT', 8080)
+WEBHOOK_WORKERS = env.int('WEBHOOK_WORKERS', 1)  # процессов на одном порту
+WEBHOOK_DROP_PENDING = env.bool('WEBHOOK_DROP_PENDING', False)  # выбросить апдейты, накопившиеся до запуска
+# Общие счётчики флуд-контроля через Redis; нужны, когда процессов несколько
+FLOOD_SYNC = env.bool('FLOOD_SYNC', BOT_MODE != 'polling')
+# Сколько процессов обрабатывают апдейты
+PROCESSES = {'webhook': WEBHOOK_WORKERS, 'cluster': SHARDS, 'worker': SHARDS}.get(BOT_MODE, 1)
+# Сколько процессов отправляют сообщения: лимит Telegram на бота делится между ними
+SEND_PROCESSES = env.int('SEND_PROCESSES', PROCESSES)
 bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
-
-# Подключение к Redis
-redis_conn = redis.from_url("redis://localhost", decode_responses=True)
-
-QUEUE_KEY = "chat:queue"      # очередь пользователей
-PAIR_KEY_PREFIX = "chat:pair:"  # пары пользователей
-QUEUE_TTL = 300  # время жизни очереди = 5 минут
+# FSM хранится в Redis, чтобы любой процесс мог обслужить любого пользователя
+dp = Dispatcher(storage=RedisStorage(redis_conn))
+# Апдейты одного пользователя — по очереди, разных пользователей — параллельно
+dp.update.outer_middleware(UserSerialMiddleware())
+# Апдейт от пользователя снимает с него отметку о недоступности
+dp.update.outer_middleware(ReachabilityMiddleware(unreachable_users))
+
+
+async def on_send_failure(chat_id: int, error: Exception):
+    """Недоставленное сообщение: заблокировавшего бота или удалённого пользователя отмечаем и убираем из очереди"""
+    reason = classify_failure(error)
+    # mark отмечает только BLOCKED и DEACTIVATED; 429 и сетевые ошибки — не про получателя
+    if not await unreachable_users.mark(chat_id, reason):
+        return
+    logger.info(f"User {chat_id} is unreachable: {reason}")
+    await match_store.leave_queue(chat_id)
+
+
+# Все исходящие сообщения идут через очередь с учётом лимитов Telegram;
+# недоступным пользователям ничего не отправляем
+sender = SendScheduler(bot, global_rate=GLOBAL_RATE / max(SEND_PROCESSES, 1),
+                       skip=unreachable_users.is_unreachable, on_failure=on_send_failure)
+# Флуд-контроль: лишние пересылки, поиски и выходы отбрасываются до хендлеров
+throttling = ThrottlingMiddleware(actions={"🔍 Найти собеседника": SEARCH}, notify=sender.send_message,
+                                  redis_conn=redis_conn if FLOOD_SYNC else None)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+match_store = create_store(MATCH_BACKEND, single_process=PROCESSES == 1)
+# Фоновые задачи, которые должны идти в одном процессе на всех (чистка очереди,
+# reaper, хранение медиа, отправка сводки), выполняет держатель аренды
+singletons = Lease("background")
+# События для администратора собираются в периодические сводки
+admin_digest = AdminDigest(sender, ADMIN_CHAT_ID, ADMIN_DIGEST_INTERVAL, ADMIN_DIGEST_MAX_EVENTS,
+                           redis_conn=redis_conn, lease=singletons)
 
 # Папки для медиа
 MEDIA_DIR = "media"
@@ -46,256 +104,291 @@ MEDIA_FOLDERS = {
 for folder in MEDIA_FOLDERS.values():
     os.makedirs(os.path.join(MEDIA_DIR, folder), exist_ok=True)
 
-
-async def add_to_queue(user_id: int):
-    """Добавляем пользователя в очередь с TTL"""
-    await redis_conn.rpush(QUEUE_KEY, user_id)
-    await redis_conn.expire(QUEUE_KEY, QUEUE_TTL)
+# Загрузка медиа в архив идёт в фоне, после пересылки собеседнику
+media_archiver = MediaArchiver(bot, MEDIA_DIR)
+# Квоты, срок хранения и упаковка старых файлов в архивные сегменты
+media_retention = MediaRetention(media_archiver.store)
 
 
-async def get_from_queue() -> int | None:
-    """Берём первого пользователя из очереди"""
-    return await redis_conn.lpop(QUEUE_KEY)
-
-
-async def set_pair(user1: int, user2: int):
-    """Запоминаем пару (без TTL)"""
-    await redis_conn.set(f"{PAIR_KEY_PREFIX}{user1}", user2)
-    await redis_conn.set(f"{PAIR_KEY_PREFIX}{user2}", user1)
+# ======================= ХЕНДЛЕРЫ =======================
 
+@dp.message(Command("start"))
+async def cmd_start(message: Message):
+    logger.info(f"User {message.from_user.id} used /start")
+    admin_digest.record("start", message.from_user.id, message.from_user.username)
+    sender.send_message(message.chat.id, "Привет!"
+                                         "\nПросто нажми /search, чтобы найти собеседника"
+                                         "\n\nПриятного общения!⭐️", reply_markup=main_kb)
+    sex, _ = await match_store.get_profile(message.from_user.id)
+    if sex == UNKNOWN:
+        sender.send_message(message.chat.id, "Кто ты? Так мы подберём подходящего собеседника",
+                            reply_markup=choose_sex())
 
-async def get_pair(user_id: int) -> int | None:
-    """Получаем собеседника"""
-    return await redis_conn.get(f"{PAIR_KEY_PREFIX}{user_id}")
 
+# Значения кнопок выбора пола -> профиль подбора
+SEX_CHOICES = {"female": FEMALE, "male": MALE, "any": ANY}
 
-async def remove_pair(user_id: int):
-    """Удаляем пару при выходе"""
-    partner = await get_pair(user_id)
-    if partner:
-        await redis_conn.delete(f"{PAIR_KEY_PREFIX}{partner}")
-    await redis_conn.delete(f"{PAIR_KEY_PREFIX}{user_id}")
 
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message):
+    sender.send_message(message.chat.id, "Кто ты?", reply_markup=choose_sex())
 
-async def is_in_queue(user_id: int) -> bool:
-    queue = await redis_conn.lrange(QUEUE_KEY, 0, -1)
-    return str(user_id).encode() in queue
 
+@dp.callback_query(F.data.startswith("sex_"))
+async def choose_own_sex(call: CallbackQuery):
+    sex = SEX_CHOICES.get(call.data.removeprefix("sex_"))
+    if sex in (FEMALE, MALE):
+        await match_store.set_profile(call.from_user.id, sex=sex)
+        await call.message.edit_text("Кого ищешь?", reply_markup=choose_partner_sex())
+    await call.answer()
 
-# ======================= ХЕНДЛЕРЫ =======================
 
-@dp.message(Command("start"))
-async def cmd_start(message: Message):
-    logger.info(f"User {message.from_user.id} used /start")
-    inf_me = (
-        f'@{message.from_user.username}({message.from_user.id}) подключился'
-    )
-    await bot.send_message(chat_id=462813109, text=inf_me)
-    await message.answer("Привет!"
-                         "\nПросто нажми /search, чтобы найти собеседника"
-                         "\n\nПриятного общения!⭐️", reply_markup=main_kb)
+@dp.callback_query(F.data.startswith("want_"))
+async def choose_partner(call: CallbackQuery):
+    want = SEX_CHOICES.get(call.data.removeprefix("want_"))
+    if want:
+        await match_store.set_profile(call.from_user.id, want=want)
+        logger.info(f"User {call.from_user.id} set partner preference {want}")
+        await call.message.edit_text("✅ Готово! Нажми /search, чтобы найти собеседника")
+    await call.answer()
 
 
 @dp.message(Command("search"))
+@dp.message(F.text == "🔍 Найти собеседника")
 async def cmd_search(message: Message):
     user_id = message.from_user.id
     logger.info(f"User {user_id} used /search")
-    await bot.send_message(chat_id=462813109,
-                           text=f'@{message.from_user.username}({user_id}) нажал поиск 🔎')
+    admin_digest.record("search", user_id, message.from_user.username)
 
-    # Проверяем, есть ли текущий собеседник
-    partner = await get_pair(user_id)
+    # Завершение текущего диалога, поиск и постановка в очередь — один вызов Redis
+    try:
+        status, other_user, partner = await match_store.match(user_id)
+    except Exception as e:
+        logger.error(e)
+        return
 
-    if await is_in_queue(user_id):
-        await message.answer("⚠️ Вы уже находитесь в очереди. Пожалуйста, дождитесь собеседника.")
+    if status == "queued":
+        sender.send_message(message.chat.id, "⚠️ Вы уже находитесь в очереди. Пожалуйста, дождитесь собеседника.")
         logger.info(f"User {user_id} tried to join queue again")
         return
 
     if partner:
-        try:
-            # Уведомляем обоих, что чат завершён
-            await bot.send_message(partner, "❌ Ваш собеседник завершил диалог."
-                                            "\n /search для поиска нового собеседника")
-            await message.answer("❌ Диалог завершён")
-            await remove_pair(user_id)
-            logger.info(f"Chat closed: {user_id} <-> {partner}")
-        except Exception as e:
-            logger.error(e)
-
-    # Берём следующего из очереди (и проверяем, что это не сам пользователь)
-    other_user = None
-    while True:
-        candidate = await get_from_queue()
-        if candidate is None:
-            break
-        if int(candidate) != user_id:
-            other_user = candidate
-            break
-
-    if other_user:
-
-        try:
-
-            await set_pair(user_id, int(other_user))
-            await message.answer("✅ Собеседник найден! Можете начать общение.")
-            await bot.send_message(int(other_user), "✅ Собеседник найден! Можете начать общение.")
-            logger.info(f"Pair created: {user_id} <-> {other_user}")
-        except Exception as e:
-            logger.error(e)
+        # Уведомляем обоих, что чат завершён
+        sender.send_message(partner, "❌ Ваш собеседник завершил диалог."
+                                     "\n /search для поиска нового собеседника")
+        sender.send_message(message.chat.id, "❌ Диалог завершён")
+        logger.info(f"Chat closed: {user_id} <-> {partner}")
+
+    if status == "matched":
+        sender.send_message(message.chat.id, "✅ Собеседник найден! Можете начать общение.")
+        # Если собеседник успел заблокировать бота, пара сразу распадается
+        sender.send_message(other_user, "✅ Собеседник найден! Можете начать общение.",
+                            on_error=relay_error_handler(message))
+        logger.info(f"Pair created: {user_id} <-> {other_user}")
     else:
-        try:
-            # Чтобы не было дублей в очереди — сначала очистим себя
-            await redis_conn.lrem(QUEUE_KEY, 0, user_id)
-            await add_to_queue(user_id)
-            await message.answer("⏳ Ожидание собеседника...")
-            logger.info(f"User {user_id} added to queue")
-        except Exception as e:
-            logger.error(e)
+        sender.send_message(message.chat.id, "⏳ Ожидание собеседника...")
+        logger.info(f"User {user_id} added to queue")
 
 
-@dp.message(F.text == "🔍 Найти собеседника")
-async def cmd_search(message: Message):
+@dp.message(Command("stop"))
+async def cmd_stop(message: Message):
     user_id = message.from_user.id
-    logger.info(f"User {user_id} used /search")
+    # Разрываем пару одним вызовом и узнаём, кого уведомить
+    partner = await match_store.unpair(user_id)
 
-    await bot.send_message(chat_id=462813109,
-                           text=f'@{message.from_user.username}({user_id}) нажал поиск 🔎')
+    if partner:
+        sender.send_message(
+            partner,
+            "❌ Ваш собеседник завершил диалог"
+            "\nНажмите /search, чтобы найти нового", reply_markup=main_kb
+        )
+
+    sender.send_message(message.chat.id, "❌ Вы вышли из чата."
+                                         "\nЖми /search для поиска нового собеседника",
+                        reply_markup=main_kb)
+    logger.info(f"User {user_id} left chat")
 
-    # Проверяем, есть ли текущий собеседник
-    partner = await get_pair(user_id)
 
-    if await is_in_queue(user_id):
-        await message.answer("⚠️ Вы уже находитесь в очереди. Пожалуйста, дождитесь собеседника.")
-        logger.info(f"User {user_id} tried to join queue again")
-        return
+# ========== ХЕНДЛЕР ДЛЯ ПЕРЕСЫЛКИ ЛЮБЫХ СООБЩЕНИЙ ==========
+def media_item(message: Message) -> dict | None:
+    """Описание медиа сообщения для архива или None"""
+    if message.content_type not in ["photo", "video", "voice", "document", "audio"]:
+        return None
+    if message.photo:  # фото — берём самое качественное
+        media = message.photo[-1]
+        folder = MEDIA_FOLDERS["photo"]
+    elif message.video:
+        media = message.video
+        folder = MEDIA_FOLDERS["video"]
+    elif message.voice:
+        media = message.voice
+        folder = MEDIA_FOLDERS["voice"]
+    elif message.audio:
+        media = message.audio
+        folder = MEDIA_FOLDERS["audio"]
+    else:  # документ
+        media = message.document
+        folder = MEDIA_FOLDERS["document"]
+    return {
+        "message_id": message.message_id,
+        "content_type": message.content_type,
+        "file_id": media.file_id,
+        "file_unique_id": media.file_unique_id,
+        "folder": folder,
+    }
+
+
+def relay_error_handler(message: Message):
+    async def on_relay_error(e: Exception):
+        logger.error(e)
+        await match_store.unpair(message.from_user.id)
+        sender.send_message(message.chat.id, '❌ Соединение разорвано'
+                                             '\n /search для поиска нового собеседника')
+    return on_relay_error
 
 
-    if partner:
-        try:
-            # Уведомляем обоих, что чат завершён
-            await bot.send_message(partner, "❌ Ваш собеседник завершил диалог."
-                                            "\n /search для поиска нового собеседника")
-            await message.answer("❌ Диалог завершён")
-            await remove_pair(user_id)
-            logger.info(f"Chat closed: {user_id} <-> {partner}")
-        except Exception as e:
-            logger.error(e)
-
-    # Берём следующего из очереди (и проверяем, что это не сам пользователь)
-    other_user = None
-    while True:
-        candidate = await get_from_queue()
-        if candidate is None:
-            break
-        if int(candidate) != user_id:
-            other_user = candidate
-            break
-
-    if other_user:
-        try:
-            await set_pair(user_id, int(other_user))
-            await message.answer("✅ Собеседник найден! Можете начать общение.")
-            await bot.send_message(int(other_user), "✅ Собеседник найден! Можете начать общение.")
-            logger.info(f"Pair created: {user_id} <-> {other_user}")
-        except Exception as e:
-            logger.error(e)
-    else:
-        try:
-            # Чтобы не было дублей в очереди — сначала очистим себя
-            await redis_conn.lrem(QUEUE_KEY, 0, user_id)
-            await add_to_queue(user_id)
-            await message.answer("⏳ Ожидание собеседника...")
-            logger.info(f"User {user_id} added to queue")
-        except Exception as e:
-            logger.error(e)
-
+async def relay_album(messages: list[Message], partner: int):
+    """Пересылает альбом одним copyMessages и архивирует его одним заданием"""
+    first = messages[0]
+    message_ids = [m.message_id for m in messages]
+    sender.submit(partner,
+                  lambda: bot.copy_messages(chat_id=partner, from_chat_id=first.chat.id, message_ids=message_ids),
+                  priority=PRIORITY_RELAY, on_error=relay_error_handler(first))
+    logger.info(f"User {first.from_user.id} -> {partner}: sent album of {len(messages)}")
 
+    items = [item for item in map(media_item, messages) if item]
+    if items:
+        await media_archiver.submit({
+            "user_id": first.from_user.id,
+            "partner": partner,
+            "message_id": first.message_id,
+            "items": items,
+        })
 
-@dp.message(Command("stop"))
-async def cmd_stop(message: Message):
-    user_id = message.from_user.id
-    partner = await get_pair(user_id)
 
-    if partner:
-        try:
-            await bot.send_message(
-                partner,
-                "❌ Ваш собеседник завершил диалог"
-                "\nНажмите /search, чтобы найти нового", reply_markup=main_kb
-            )
-        except Exception as e:
-            logger.error(e)
-
-    await remove_pair(user_id)
-
-    await message.answer("❌ Вы вышли из чата."
-                         "\nЖми /search для поиска нового собеседника",
-                         reply_markup=main_kb)
-    logger.info(f"User {user_id} left chat")
+# Части альбома копятся ALBUM_WINDOW и пересылаются одним вызовом
+albums = AlbumCollector(relay_album)
 
 
-# ========== ХЕНДЛЕР ДЛЯ ПЕРЕСЫЛКИ ЛЮБЫХ СООБЩЕНИЙ ==========
 @dp.message(F.content_type.in_({"text", "photo", "video", "voice", "document", "audio", "sticker"}))
 async def chat_handler(message: Message):
     try:
         user_id = message.from_user.id
-        partner = await get_pair(user_id)
+        # Собеседник из локального кэша; жизнь пары заодно продлевается
+        partner = await match_store.get_partner(user_id)
 
         if not partner:
-            await message.answer("⚠️ У вас сейчас нет собеседника. Введите /search")
+            sender.send_message(message.chat.id, "⚠️ У вас сейчас нет собеседника. Введите /search")
             logger.info(f"User {user_id} tried to send message without partner")
             return
 
+        # Собеседник заблокировал бота — не тратим на него вызовы API
+        if unreachable_users.is_unreachable(int(partner)):
+            await match_store.unpair(user_id)
+            sender.send_message(message.chat.id, '❌ Собеседник недоступен'
+                                                 '\n /search для поиска нового собеседника')
+            return
+
+        if message.media_group_id:
+            albums.add(message, int(partner))
+            return
+        # Альбом, который ещё копится, уходит первым — иначе это сообщение его обгонит
+        await albums.flush_chat(message.chat.id)
+
         # Логируем
         if message.text:
             logger.info(f"User {user_id} -> {partner}: {message.text}")
         else:
             logger.info(f"User {user_id} -> {partner}: sent {message.content_type}")
 
-        # Сохраняем медиа по папкам
-        if message.content_type in ["photo", "video", "voice", "document", "audio"]:
-            if message.photo:  # фото — берём самое качественное
-                file_id = message.photo[-1].file_id
-                folder = MEDIA_FOLDERS["photo"]
-            elif message.video:
-                file_id = message.video.file_id
-                folder = MEDIA_FOLDERS["video"]
-            elif message.voice:
-                file_id = message.voice.file_id
-                folder = MEDIA_FOLDERS["voice"]
-            elif message.audio:
-                file_id = message.audio.file_id
-                folder = MEDIA_FOLDERS["audio"]
-            else:  # документ
-                file_id = message.document.file_id
-                folder = MEDIA_FOLDERS["document"]
-
-            file = await bot.get_file(file_id)
-            file_path = file.file_path
-            filename = f"{user_id}_{message.message_id}_{os.path.basename(file_path)}"
-
-            save_path = os.path.join(MEDIA_DIR, folder, filename)
-            await bot.download_file(file_path, save_path)
-            logger.info(f"Media saved: {save_path}")
-
         # Пересылаем собеседнику
-        try:
-            await bot.copy_message(chat_id=int(partner), from_chat_id=message.chat.id, message_id=message.message_id)
-        except Exception as e:
-            logger.error(e)
-            await remove_pair(user_id)
-            await message.answer('❌ Соединение разорвано'
-                                 '\n /search для поиска нового собеседника')
+        sender.copy_message(int(partner), message.chat.id, message.message_id,
+                            priority=PRIORITY_RELAY, on_error=relay_error_handler(message))
+
+        # Частым пропускающим держим следующего собеседника заранее (в фоне, без ожидания)
+        match_store.reserve_next(user_id)
+
+        # Медиа архивируем в фоне — собеседник не ждёт загрузки
+        item = media_item(message)
+        if item:
+            await media_archiver.submit({
+                "user_id": user_id,
+                "partner": int(partner),
+                "message_id": message.message_id,
+                "items": [item],
+            })
     except Exception as e:
         logger.error(e)
 
 
 # ======================= MAIN =======================
 
+# Фоновые задачи процесса (ссылки держим, чтобы задачи не собрал GC)
+background: list[asyncio.Task] = []
+
+
+@dp.startup()
+async def on_startup():
+    sender.start()
+    # Архиватор — в каждом процессе: задания из общего спула забираются атомарно
+    await media_archiver.start()
+    jobs = [lambda: sweep_queue(match_store, sender), media_retention.run]
+    if match_store.name == "redis":
+        jobs.append(lambda: reap_idle_pairs(sender))
+        background.extend([
+            asyncio.create_task(listen_invalidations()),
+            asyncio.create_task(log_cache_stats()),
+        ])
+    background.extend([
+        asyncio.create_task(singletons.run(*jobs)),
+        asyncio.create_task(unreachable_users.listen()),
+        asyncio.create_task(admin_digest.run()),
+    ])
+    if throttling.redis is not None:
+        background.append(asyncio.create_task(throttling.sync()))
+
+
+@dp.shutdown()
+async def on_shutdown():
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    background.clear()
+    await media_archiver.stop()
+    # Даём очереди отправить последнюю сводку администратору
+    await sender.stop(drain=5)
+
+
 async def main():
     await set_commands_menu(bot)
     await dp.start_polling(bot)
 
+
+async def prepare_webhook(secret: str):
+    await set_commands_menu(bot)
+    await set_webhook(bot, f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret, WEBHOOK_DROP_PENDING)
+
+
+async def prepare_cluster():
+    await set_commands_menu(bot)
+    await bot.delete_webhook()
+    # Сессия и соединения не должны достаться дочерним процессам
+    await bot.session.close()
+
+
 if __name__ == "__main__":
     logger.info('Bot started')
-    asyncio.run(main())
+    if BOT_MODE == "webhook":
+        secret = ensure_secret(WEBHOOK_SECRET)
+        asyncio.run(prepare_webhook(secret))
+        run_webhook(lambda: (dp, bot), WEBHOOK_PATH, secret, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_WORKERS)
+    elif BOT_MODE == "cluster":
+        asyncio.run(prepare_cluster())
+        run_cluster(lambda: (dp, bot, redis_conn), SHARDS)
+    elif BOT_MODE == "ingest":
+        asyncio.run(prepare_cluster())
+        asyncio.run(ingest(bot, redis_conn, SHARDS, dp.resolve_used_update_types()))
+    elif BOT_MODE == "worker":
+        asyncio.run(run_worker(dp, bot, redis_conn, SHARD_INDEX))
+    else:
+        asyncio.run(main())
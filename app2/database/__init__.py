@@ -0,0 +1,12 @@
+from .redis_session import (redis_conn, QUEUE_KEY, PAIR_KEY_PREFIX, INVALIDATE_CHANNEL, QUEUE_TTL, PAIR_TTL,
+                            PAIR_IDLE, PROFILE_KEY_PREFIX, QUEUE_FALLBACK, QUEUE_BUCKETS, RESERVE_KEY_PREFIX,
+                            HOLDER_KEY_PREFIX, SKIPS_KEY_PREFIX, RESERVE_TTL, RESERVE_MIN_SKIPS,
+                            UNREACHABLE_KEY_PREFIX, UNREACHABLE_CHANNEL)
+from .cache import partner_cache, listen_invalidations, log_cache_stats
+from .unreachable import UnreachableUsers, unreachable_users, UNREACHABLE_TTL
+from .methods import (add_to_queue, get_from_queue, remove_from_queue, pop_expired, apply_fallback, set_profile,
+                      get_profile, set_pair, get_pair, touch_pair, get_partner, scan_pairs, reap_pair, remove_pair,
+                      is_in_queue, match_user, reserve_next)
+from .media_store import (MediaStore, MEDIA_BLOBS_KEY, MEDIA_INDEX_KEY, MEDIA_USAGE_KEY, MEDIA_AGE_PREFIX,
+                          MEDIA_SEGMENT_OF_KEY, MEDIA_REFS_PREFIX)
+from .lease import Lease, LEASE_TTL
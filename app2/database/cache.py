@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from app2.database.redis_session import redis_conn, INVALIDATE_CHANNEL
+from app2.logger import logger
+
+CACHE_SIZE = 50_000  # сколько пар держим в памяти процесса
+CACHE_TTL = 60  # страховка на случай потерянной инвалидации, секунд
+STATS_INTERVAL = 60  # как часто пишем статистику кэша в лог, секунд
+
+
+class PartnerCache:
+    """
+    LRU-кэш user_id -> собеседник перед Redis.
+    Кэшируются только найденные пары; инвалидация — по каналу INVALIDATE_CHANNEL.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Растёт при каждой инвалидации: значение, прочитанное из Redis
+        # до инвалидации, в кэш уже не попадёт
+        self.generation = 0
+        self._data: OrderedDict[int, tuple[int, float]] = OrderedDict()
+
+    def get(self, user_id: int) -> int | None:
+        entry = self._data.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, user_id: int, partner: int, generation: int):
+        if generation != self.generation:
+            return
+        self._data[user_id] = (partner, time.monotonic() + self.ttl)
+        self._data.move_to_end(user_id)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, *user_ids: int):
+        self.generation += 1
+        for user_id in user_ids:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+partner_cache = PartnerCache()
+
+
+async def listen_invalidations(cache: PartnerCache = partner_cache):
+    """Фоновая задача: сбрасывает записи кэша, когда пары меняет любой процесс бота"""
+    while True:
+        try:
+            async with redis_conn.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                # Пока не были подписаны, могли пропустить сообщения
+                cache.clear()
+                async for msg in pubsub.listen():
+                    if msg["type"] != "message":
+                        continue
+                    cache.invalidate(*(int(user_id) for user_id in msg["data"].split(",")))
+        except Exception as e:
+            logger.error(e)
+            await asyncio.sleep(1)
+
+
+async def log_cache_stats(cache: PartnerCache = partner_cache, interval: float = STATS_INTERVAL):
+    """Фоновая задача: периодически пишет в лог размер кэша и долю попаданий"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Partner cache: {cache.stats()}")
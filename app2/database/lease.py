@@ -0,0 +1,77 @@
+import asyncio
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable
+
+from app2.database import scripts
+from app2.database.redis_session import redis_conn
+from app2.logger import logger
+
+LEASE_KEY_PREFIX = "lease:"
+LEASE_TTL = 30  # срок аренды, секунд; держатель продлевает её каждую треть срока
+
+_renew_lease = redis_conn.register_script(scripts.RENEW_LEASE)
+_release_lease = redis_conn.register_script(scripts.RELEASE_LEASE)
+
+
+class Lease:
+    """
+    Аренда в Redis: из всех процессов бота (воркеры webhook, шарды кластера,
+    отдельные машины) фоновые задачи-синглтоны выполняет только держатель.
+    Упавший держатель теряет аренду через LEASE_TTL, и её забирает другой процесс.
+    """
+
+    def __init__(self, name: str, ttl: float = LEASE_TTL):
+        self.key = f"{LEASE_KEY_PREFIX}{name}"
+        self.ttl = ttl
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.held = False
+
+    async def acquire(self) -> bool:
+        self.held = bool(await redis_conn.set(self.key, self.token, nx=True, px=int(self.ttl * 1000)))
+        return self.held
+
+    async def renew(self) -> bool:
+        self.held = bool(await _renew_lease(keys=[self.key], args=[self.token, int(self.ttl * 1000)]))
+        return self.held
+
+    async def release(self):
+        self.held = False
+        await _release_lease(keys=[self.key], args=[self.token])
+
+    async def run(self, *jobs: Callable[[], Awaitable]):
+        """
+        Фоновая задача: пока аренда у этого процесса, выполняет jobs
+        (фабрики корутин), при потере аренды останавливает их.
+        """
+        tasks: list[asyncio.Task] = []
+        try:
+            while True:
+                try:
+                    held = await (self.renew() if self.held else self.acquire())
+                except Exception as e:
+                    # Без связи с Redis аренду могли уже отдать другому — останавливаемся
+                    logger.error(e)
+                    held = self.held = False
+                if held and not tasks:
+                    logger.info(f"Lease {self.key} acquired, starting {len(jobs)} jobs")
+                    tasks = [asyncio.create_task(job()) for job in jobs]
+                elif not held and tasks:
+                    logger.warning(f"Lease {self.key} lost, stopping jobs")
+                    await _cancel(tasks)
+                    tasks = []
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            await _cancel(tasks)
+            if self.held:
+                try:
+                    await self.release()
+                except Exception as e:
+                    logger.error(e)
+
+
+async def _cancel(tasks: list[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
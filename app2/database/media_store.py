@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+import time
+import zipfile
+
+import aiofiles
+import aiofiles.os
+
+from app2.database import scripts
+from app2.database.redis_session import redis_conn
+
+MEDIA_BLOBS_KEY = "media:blobs"  # hash: file_unique_id -> путь блоба относительно MEDIA_DIR
+MEDIA_INDEX_KEY = "media:index"  # hash: "{user_id}:{message_id}" -> описание сообщения и блоба
+MEDIA_USAGE_KEY = "media:usage"  # hash: папка -> байт на диске (файлы + сегменты)
+MEDIA_AGE_PREFIX = "media:age:"  # zset на папку: непакованный блоб -> время сохранения
+MEDIA_SEGMENT_OF_KEY = "media:segment_of"  # hash: блоб -> сегмент, в который он упакован
+MEDIA_REFS_PREFIX = "media:refs:"  # set на блоб: поля MEDIA_INDEX_KEY, которые на него ссылаются
+
+_register_blob = redis_conn.register_script(scripts.REGISTER_BLOB)
+
+
+class MediaStore:
+    """
+    Контентно-адресуемое хранилище медиа.
+
+    Файл хранится один раз под своим file_unique_id (одинаков для одного и того же
+    файла у всех пользователей) в шардированных подпапках:
+    <media_dir>/<тип>/<ab>/<cd>/<file_unique_id><расширение>.
+    Сообщения ссылаются на блоб через индекс в Redis.
+    """
+
+    def __init__(self, media_dir: str):
+        self.media_dir = media_dir
+
+    @staticmethod
+    def blob_path(folder: str, unique_id: str, ext: str) -> str:
+        """Путь блоба относительно media_dir"""
+        return os.path.join(folder, unique_id[:2], unique_id[2:4], f"{unique_id}{ext}")
+
+    def abspath(self, blob: str) -> str:
+        return os.path.join(self.media_dir, blob)
+
+    async def lookup(self, unique_id: str) -> str | None:
+        """Возвращает путь уже сохранённого блоба (файлом или в сегменте) или None"""
+        blob = await redis_conn.hget(MEDIA_BLOBS_KEY, unique_id)
+        if blob and await self.exists(blob):
+            return blob
+        return None
+
+    async def exists(self, blob: str) -> bool:
+        """Блоб ещё хранится — файлом или в сегменте"""
+        return await aiofiles.os.path.exists(self.abspath(blob)) or await redis_conn.hexists(MEDIA_SEGMENT_OF_KEY, blob)
+
+    async def register(self, unique_id: str, blob: str, size: int):
+        """
+        Запоминает новый блоб и сразу учитывает его размер — без обхода папок.
+        Повторная регистрация того же блоба (другим процессом) размер не удваивает.
+        """
+        folder = blob.split(os.sep, 1)[0]
+        await _register_blob(keys=[MEDIA_BLOBS_KEY, MEDIA_USAGE_KEY, f"{MEDIA_AGE_PREFIX}{folder}"],
+                             args=[unique_id, blob, folder, size, time.time()])
+
+    async def link(self, user_id: int, message_id: int, partner: int, blob: str, content_type: str):
+        """
+        Привязывает сообщение (пользователь, сообщение, диалог) к блобу.
+        Ссылка запоминается и у блоба: при его удалении запись индекса удаляется тоже
+        """
+        dialog = f"{min(user_id, partner)}:{max(user_id, partner)}"
+        key = f"{user_id}:{message_id}"
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            pipe.hset(MEDIA_INDEX_KEY, key, json.dumps({"blob": blob, "dialog": dialog, "type": content_type}))
+            pipe.sadd(f"{MEDIA_REFS_PREFIX}{blob}", key)
+            await pipe.execute()
+
+    async def get(self, user_id: int, message_id: int) -> dict | None:
+        """Описание медиа из сообщения: blob, dialog, type. None, если блоб уже удалён"""
+        entry = await redis_conn.hget(MEDIA_INDEX_KEY, f"{user_id}:{message_id}")
+        if not entry:
+            return None
+        entry = json.loads(entry)
+        return entry if await self.exists(entry["blob"]) else None
+
+    async def read(self, user_id: int, message_id: int) -> bytes | None:
+        """Содержимое медиа из сообщения — из файла или из архивного сегмента"""
+        entry = await self.get(user_id, message_id)
+        if not entry:
+            return None
+        blob = entry["blob"]
+        path = self.abspath(blob)
+        if await aiofiles.os.path.exists(path):
+            async with aiofiles.open(path, "rb") as f:
+                return await f.read()
+        segment = await redis_conn.hget(MEDIA_SEGMENT_OF_KEY, blob)
+        if not segment:
+            return None  # блоб удалён политикой хранения
+        return await asyncio.to_thread(self._read_segment, self.abspath(segment), blob)
+
+    @staticmethod
+    def _read_segment(path: str, blob: str) -> bytes | None:
+        try:
+            with zipfile.ZipFile(path) as archive:
+                return archive.read(blob)
+        except (FileNotFoundError, KeyError):
+            return None
@@ -0,0 +1,256 @@
+import asyncio
+import time
+
+from app2.database import scripts
+from app2.database.cache import partner_cache
+from app2.database.redis_session import (redis_conn, QUEUE_KEY, PAIR_KEY_PREFIX, INVALIDATE_CHANNEL, QUEUE_TTL,
+                                         PAIR_TTL, PAIR_IDLE, PROFILE_KEY_PREFIX, QUEUE_FALLBACK, QUEUE_BUCKETS,
+                                         RESERVE_KEY_PREFIX, HOLDER_KEY_PREFIX, SKIPS_KEY_PREFIX, RESERVE_TTL,
+                                         RESERVE_MIN_SKIPS, SKIPS_WINDOW, RESERVE_SCAN, UNREACHABLE_KEY_PREFIX)
+from app2.logger import logger
+
+TOUCH_INTERVAL = 30  # чаще этого TTL пары из кэшированного пути не продлеваем, секунд
+
+_background: set[asyncio.Task] = set()
+
+_match_user = redis_conn.register_script(scripts.MATCH_USER)
+_reserve_next = redis_conn.register_script(scripts.RESERVE_NEXT)
+_sweep_queue = redis_conn.register_script(scripts.SWEEP_QUEUE)
+_fallback_queue = redis_conn.register_script(scripts.FALLBACK_QUEUE)
+_set_profile = redis_conn.register_script(scripts.SET_PROFILE)
+_touch_pair = redis_conn.register_script(scripts.TOUCH_PAIR)
+_reap_pair = redis_conn.register_script(scripts.REAP_PAIR)
+_set_pair = redis_conn.register_script(scripts.SET_PAIR)
+_unpair = redis_conn.register_script(scripts.UNPAIR)
+
+
+async def set_profile(user_id: int, sex: str | None = None, want: str | None = None) -> tuple[str, str]:
+    """Меняем свой пол и/или пол собеседника. Ждущий переезжает в новую корзину"""
+    sex, want = await _set_profile(args=[user_id, PROFILE_KEY_PREFIX, f"{QUEUE_KEY}:", sex or "", want or ""])
+    return sex, want
+
+
+async def get_profile(user_id: int) -> tuple[str, str]:
+    """Профиль пользователя: (свой пол, пол собеседника)"""
+    sex, want = await redis_conn.hmget(f"{PROFILE_KEY_PREFIX}{user_id}", "sex", "want")
+    return sex or "u", want or "any"
+
+
+async def add_to_queue(user_id: int):
+    """Добавляем пользователя в корзину его профиля со своим дедлайном ожидания"""
+    sex, want = await get_profile(user_id)
+    await redis_conn.zadd(f"{QUEUE_KEY}:{sex}:{want}", {user_id: time.time() + QUEUE_TTL})
+
+
+async def get_from_queue() -> int | None:
+    """Берём из всех корзин того, кто ждёт дольше всех и у кого не истекло ожидание"""
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        for key in QUEUE_BUCKETS:
+            pipe.zrangebyscore(key, f"({time.time()}", "+inf", start=0, num=1, withscores=True)
+        heads = await pipe.execute()
+    heads = [(head[0][1], key, head[0][0]) for key, head in zip(QUEUE_BUCKETS, heads) if head]
+    if not heads:
+        return None
+    _, key, user_id = min(heads)
+    if await redis_conn.zrem(key, user_id):
+        return int(user_id)
+    return None
+
+
+async def pop_expired(batch: int) -> list[int]:
+    """Забираем из очереди пачку пользователей с истёкшим ожиданием"""
+    expired = await _sweep_queue(keys=QUEUE_BUCKETS, args=[time.time(), batch])
+    return [int(user_id) for user_id in expired]
+
+
+async def apply_fallback(batch: int, queue_ttl: float = QUEUE_TTL, fallback: float = QUEUE_FALLBACK) -> list[int]:
+    """Переносим ждущих дольше fallback в общие корзины. Возвращает перенесённых"""
+    now = time.time()
+    moved = await _fallback_queue(
+        keys=[key for key in QUEUE_BUCKETS if not key.endswith(":any")],
+        args=[now, now + queue_ttl - fallback, batch]
+    )
+    return [int(user_id) for user_id in moved]
+
+
+async def remove_from_queue(user_id: int):
+    """Убираем пользователя из очереди: ZREM по всем корзинам одним pipeline"""
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        for key in QUEUE_BUCKETS:
+            pipe.zrem(key, user_id)
+        await pipe.execute()
+
+
+async def set_pair(user1: int, user2: int) -> tuple[int | None, int | None]:
+    """Атомарно запоминаем пару с TTL. Возвращает прежних собеседников обоих"""
+    former = await _set_pair(args=[user1, user2, PAIR_KEY_PREFIX, PAIR_TTL, INVALIDATE_CHANNEL])
+    former = tuple(int(uid) if uid else None for uid in former)
+    partner_cache.invalidate(user1, user2, *(uid for uid in former if uid))
+    return former
+
+
+async def get_pair(user_id: int) -> int | None:
+    """Получаем собеседника"""
+    return await redis_conn.get(f"{PAIR_KEY_PREFIX}{user_id}")
+
+
+async def touch_pair(user_id: int) -> int | None:
+    """Получаем собеседника и продлеваем жизнь пары (один вызов Redis)"""
+    return await _touch_pair(keys=[f"{PAIR_KEY_PREFIX}{user_id}"], args=[PAIR_KEY_PREFIX, PAIR_TTL])
+
+
+_last_touch: dict[int, float] = {}
+
+
+async def refresh_pair(user_id: int, partner: int):
+    """Продлеваем TTL обоих ключей пары одним pipeline"""
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        pipe.expire(f"{PAIR_KEY_PREFIX}{user_id}", PAIR_TTL)
+        pipe.expire(f"{PAIR_KEY_PREFIX}{partner}", PAIR_TTL)
+        await pipe.execute()
+
+
+async def get_partner(user_id: int) -> int | None:
+    """
+    Собеседник для пересылки сообщений: сначала локальный кэш, затем Redis.
+    При попадании в кэш TTL пары продлевается в фоне не чаще TOUCH_INTERVAL.
+    """
+    partner = partner_cache.get(user_id)
+    now = time.monotonic()
+    if partner is None:
+        generation = partner_cache.generation
+        partner = await touch_pair(user_id)
+        if partner is None:
+            return None
+        partner = int(partner)
+        partner_cache.put(user_id, partner, generation)
+        _last_touch[user_id] = now
+    elif now - _last_touch.get(user_id, 0) > TOUCH_INTERVAL:
+        _last_touch[user_id] = now
+        task = asyncio.create_task(refresh_pair(user_id, partner))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    if len(_last_touch) > partner_cache.maxsize:
+        _last_touch.clear()
+    return partner
+
+
+async def scan_pairs(cursor: int, count: int) -> tuple[int, list[int]]:
+    """
+    Один шаг SCAN по ключам пар. Возвращает новый курсор и пользователей,
+    у которых пара простаивает дольше PAIR_IDLE.
+    """
+    cursor, keys = await redis_conn.scan(cursor, match=f"{PAIR_KEY_PREFIX}*", count=count)
+    if not keys:
+        return cursor, []
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.ttl(key)
+        ttls = await pipe.execute()
+    # TTL -1 — пара создана до появления TTL, -2 — ключ уже удалён
+    idle = [key for key, ttl in zip(keys, ttls) if ttl == -1 or 0 <= ttl <= PAIR_TTL - PAIR_IDLE]
+    return cursor, [int(key[len(PAIR_KEY_PREFIX):]) for key in idle]
+
+
+async def reap_pair(user_id: int) -> tuple[int, int] | None:
+    """Закрываем простаивающую пару. Возвращает (собеседник, освобождено байт)"""
+    result = await _reap_pair(
+        keys=[f"{PAIR_KEY_PREFIX}{user_id}"],
+        args=[PAIR_KEY_PREFIX, user_id, PAIR_TTL - PAIR_IDLE, INVALIDATE_CHANNEL]
+    )
+    if not result:
+        return None
+    partner, freed = result
+    partner_cache.invalidate(user_id, int(partner))
+    return int(partner), int(freed)
+
+
+async def remove_pair(user_id: int) -> int | None:
+    """Атомарно удаляем пару при выходе. Возвращает бывшего собеседника"""
+    partner = await _unpair(
+        keys=[f"{PAIR_KEY_PREFIX}{user_id}"],
+        args=[PAIR_KEY_PREFIX, user_id, INVALIDATE_CHANNEL]
+    )
+    partner = int(partner) if partner else None
+    partner_cache.invalidate(user_id, *([partner] if partner else []))
+    return partner
+
+
+async def is_in_queue(user_id: int) -> bool:
+    """Проверяем, ждёт ли пользователь в очереди: ZSCORE по корзинам одним pipeline"""
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        for key in QUEUE_BUCKETS:
+            pipe.zscore(key, user_id)
+        deadlines = await pipe.execute()
+    now = time.time()
+    return any(deadline is not None and deadline > now for deadline in deadlines)
+
+
+def _match_args(user_id: int, queue_ttl: float = QUEUE_TTL) -> list:
+    """Аргументы MATCH_USER и RESERVE_NEXT, см. scripts._MATCH_PRELUDE"""
+    return [user_id, PAIR_KEY_PREFIX, queue_ttl, time.time(), PAIR_TTL, INVALIDATE_CHANNEL, f"{QUEUE_KEY}:",
+            PROFILE_KEY_PREFIX, RESERVE_KEY_PREFIX, HOLDER_KEY_PREFIX, SKIPS_KEY_PREFIX, RESERVE_TTL,
+            RESERVE_MIN_SKIPS, SKIPS_WINDOW, RESERVE_SCAN, UNREACHABLE_KEY_PREFIX]
+
+
+_last_reserve: dict[int, float] = {}
+# Частые пропускающие по ответам MATCH_USER: user_id -> до какого момента (monotonic)
+_skippers: dict[int, float] = {}
+
+
+def reserve_next(user_id: int, queue_ttl: float = QUEUE_TTL) -> bool:
+    """
+    Держим следующего собеседника для частого пропускающего, чтобы следующий
+    поиск был одним обменом. Вызывается на каждое сообщение, поэтому сначала
+    смотрим локальный счётчик пропусков (его обновляет match_user) и в Redis
+    идём не чаще раза за половину RESERVE_TTL — в фоне, пересылка не ждёт.
+    Поиск, обработанный другим процессом, сюда не попадает: тогда резерва нет
+    до следующего поиска в этом процессе. Возвращает True, если резерв запрошен.
+    """
+    now = time.monotonic()
+    until = _skippers.get(user_id)
+    if until is None or until < now:
+        return False
+    if now - _last_reserve.get(user_id, 0) < RESERVE_TTL / 2:
+        return False
+    if len(_last_reserve) > partner_cache.maxsize:
+        _last_reserve.clear()
+    _last_reserve[user_id] = now
+    task = asyncio.create_task(_reserve_next(args=_match_args(user_id, queue_ttl)))
+    _background.add(task)
+    task.add_done_callback(_reserve_done)
+    return True
+
+
+def _reserve_done(task: asyncio.Task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Reserve failed: {task.exception()}")
+
+
+def _remember_skips(user_id: int, skips: int):
+    if skips < RESERVE_MIN_SKIPS:
+        _skippers.pop(user_id, None)
+        return
+    if len(_skippers) > partner_cache.maxsize:
+        _skippers.clear()
+    # Ключ счётчика в Redis живёт не дольше окна; точную проверку всё равно делает скрипт
+    _skippers[user_id] = time.monotonic() + SKIPS_WINDOW
+
+
+async def match_user(user_id: int, queue_ttl: float = QUEUE_TTL) -> tuple[str, int | None, int | None]:
+    """
+    Атомарный поиск собеседника: завершает текущий диалог, забирает
+    зарезервированного или самого давнего подходящего по профилю из очереди
+    и создаёт пару, либо ставит в корзину своего профиля.
+
+    Returns:
+        (статус, собеседник, прошлый собеседник) — см. scripts.MATCH_USER
+    """
+    status, partner, old_partner, skips = await _match_user(args=_match_args(user_id, queue_ttl))
+    if status != "queued":
+        _remember_skips(user_id, int(skips))
+    partner = int(partner) if partner else None
+    old_partner = int(old_partner) if old_partner else None
+    partner_cache.invalidate(*(uid for uid in (user_id, partner, old_partner) if uid))
+    return status, partner, old_partner
@@ -0,0 +1,29 @@
+import redis.asyncio as redis
+from environs import Env
+
+env = Env()
+env.read_env()
+
+# Подключение к Redis
+REDIS_URL = env('REDIS_URL', 'redis://localhost')
+redis_conn = redis.from_url(REDIS_URL, decode_responses=True)
+
+QUEUE_KEY = "chat:waiting"      # очередь пользователей (sorted set, score — дедлайн ожидания)
+PROFILE_KEY_PREFIX = "chat:profile:"  # профили: свой пол и пол собеседника (hash)
+RESERVE_KEY_PREFIX = "chat:reserve:"  # следующий собеседник, которого держим для пользователя
+HOLDER_KEY_PREFIX = "chat:reserved:"  # кто держит ждущего в резерве
+SKIPS_KEY_PREFIX = "chat:skips:"  # сколько раз пользователь пропустил собеседника за окно
+UNREACHABLE_KEY_PREFIX = "chat:unreachable:"  # недоступные пользователи: причина с TTL
+UNREACHABLE_CHANNEL = "chat:unreachable"  # pub/sub: изменения списка недоступных
+PAIR_KEY_PREFIX = "chat:pair:"  # пары пользователей
+INVALIDATE_CHANNEL = "chat:invalidate"  # pub/sub: id пользователей, чьи пары изменились
+PAIR_TTL = 3600  # жёсткий предел жизни пары без активности = 1 час
+PAIR_IDLE = 600  # после стольких секунд без сообщений диалог закрывает reaper = 10 минут
+QUEUE_TTL = 300  # сколько пользователь ждёт в очереди = 5 минут
+QUEUE_FALLBACK = env.int('QUEUE_FALLBACK', 60)  # после стольких секунд ожидания подходит собеседник любого пола
+RESERVE_TTL = env.int('RESERVE_TTL', 20)  # сколько держим резерв, секунд
+RESERVE_MIN_SKIPS = env.int('RESERVE_MIN_SKIPS', 3)  # пропусков за окно, после которых резервируем
+SKIPS_WINDOW = 600  # окно счётчика пропусков = 10 минут
+RESERVE_SCAN = 8  # сколько голов корзины смотрим в поисках не удержанного
+# Очередь разбита на корзины {QUEUE_KEY}:{пол}:{кого ищет}, значения — см. app2.matchmaking.base
+QUEUE_BUCKETS = [f"{QUEUE_KEY}:{sex}:{want}" for sex in ("f", "m", "u") for want in ("f", "m", "any")]
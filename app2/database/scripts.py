@@ -0,0 +1,431 @@
+# Lua-скрипты Redis. Каждый выполняется атомарно и за один round-trip.
+# Ключи пар вычисляются внутри скрипта, поэтому скрипты рассчитаны на
+# одиночный Redis (не Cluster).
+
+# Общее начало MATCH_USER и RESERVE_NEXT.
+# ARGV[1] — user_id, ARGV[2] — префикс ключей пар, ARGV[3] — время ожидания,
+# ARGV[4] — текущее время, ARGV[5] — TTL пары, ARGV[6] — канал инвалидации,
+# ARGV[7] — префикс корзин очереди, ARGV[8] — префикс профилей,
+# ARGV[9] — префикс резерва («кого держу»), ARGV[10] — префикс «кем удержан»,
+# ARGV[11] — префикс счётчиков пропусков, ARGV[12] — TTL резерва,
+# ARGV[13] — пропусков до резервирования, ARGV[14] — окно счётчика пропусков,
+# ARGV[15] — сколько голов корзины просматривать,
+# ARGV[16] — префикс отметок недоступных пользователей
+# Очередь разбита на корзины {пол}:{кого ищет}. Подходящих корзин для
+# пользователя не больше трёх, и в каждой смотрим только несколько голов,
+# поэтому поиск не зависит ни от длины очереди, ни от числа корзин.
+# Score в корзине — дедлайн ожидания. Просроченные записи матчинг пропускает
+# (их удаляет и уведомляет SWEEP_QUEUE), поэтому лишних pop'ов нет.
+_MATCH_PRELUDE = """
+local user = ARGV[1]
+local prefix = ARGV[2]
+local queue = ARGV[7]
+local holder_prefix = ARGV[10]
+
+local now = tonumber(ARGV[4])
+
+local profile = redis.call('HMGET', ARGV[8] .. user, 'sex', 'want')
+local sex = profile[1] or 'u'
+local want = profile[2] or 'any'
+
+-- Корзины тех, кто подходит нам и кому подходим мы
+local owns = {want}
+if want == 'any' then
+    owns = {'f', 'm', 'u'}
+end
+local wants = {'any'}
+if sex ~= 'u' then
+    wants = {sex, 'any'}
+end
+local buckets = {}
+for _, o in ipairs(owns) do
+    for _, w in ipairs(wants) do
+        table.insert(buckets, queue .. o .. ':' .. w)
+    end
+end
+
+-- Самый давний живой ждущий, которого не держит резерв другого пользователя.
+-- С allow_held, если свободных нет, берём удержанного: резерв меняет только
+-- порядок, но никого не заставляет ждать. Возвращает {ждущий, корзина}.
+local function pick(allow_held)
+    while true do
+        local best, best_key, best_score
+        local held, held_key, held_score
+        local stale = false
+        for _, key in ipairs(buckets) do
+            local heads = redis.call('ZRANGEBYSCORE', key, '(' .. ARGV[4], '+inf', 'WITHSCORES',
+                'LIMIT', 0, tonumber(ARGV[15]))
+            for i = 1, #heads, 2 do
+                local candidate, deadline = heads[i], tonumber(heads[i + 1])
+                if candidate == user or redis.call('EXISTS', prefix .. candidate) == 1
+                        or redis.call('EXISTS', ARGV[16] .. candidate) == 1 then
+                    -- Уже в паре или заблокировал бота — из очереди убираем
+                    redis.call('ZREM', key, candidate)
+                    stale = true
+                else
+                    local holder = redis.call('GET', holder_prefix .. candidate)
+                    if not holder or holder == user then
+                        if not best or deadline < best_score then
+                            best, best_key, best_score = candidate, key, deadline
+                        end
+                        break
+                    elseif not held or deadline < held_score then
+                        held, held_key, held_score = candidate, key, deadline
+                    end
+                end
+            end
+        end
+        if best then
+            return {best, best_key}
+        end
+        if held and allow_held then
+            return {held, held_key}
+        end
+        if not stale then
+            return nil
+        end
+    end
+end
+
+-- Ждёт ли удержанный в подходящей корзине; возвращает корзину
+local function waiting_in(candidate)
+    for _, key in ipairs(buckets) do
+        local deadline = redis.call('ZSCORE', key, candidate)
+        if deadline and tonumber(deadline) > now then
+            return key
+        end
+    end
+    return nil
+end
+
+-- Держим следующего собеседника для того, кто часто пропускает
+local function reserve()
+    if tonumber(redis.call('GET', ARGV[11] .. user) or 0) < tonumber(ARGV[13]) then
+        return false
+    end
+    local current = redis.call('GET', ARGV[9] .. user)
+    if current and redis.call('GET', holder_prefix .. current) == user and waiting_in(current) then
+        return current
+    end
+    local found = pick(false)
+    if not found then
+        return false
+    end
+    redis.call('SET', ARGV[9] .. user, found[1], 'EX', ARGV[12])
+    redis.call('SET', holder_prefix .. found[1], user, 'EX', ARGV[12])
+    return found[1]
+end
+"""
+
+# Аргументы — см. _MATCH_PRELUDE.
+# Если у пользователя есть живой резерв, собеседник берётся из него одним
+# обменом, иначе — из голов подходящих корзин. После поиска частым
+# пропускающим сразу резервируется следующий.
+# Возвращает {статус, собеседник, прошлый собеседник, пропусков за окно}, где статус:
+#   queued  — пользователь уже в очереди, ничего не меняем
+#   matched — пара создана
+#   waiting — свободных нет, пользователь поставлен в очередь
+MATCH_USER = _MATCH_PRELUDE + """
+local changed = {}
+local skips
+
+-- Сообщаем процессам бота, чьи пары изменились (локальный кэш собеседников)
+local function notify()
+    if #changed > 0 then
+        redis.call('PUBLISH', ARGV[6], table.concat(changed, ','))
+    end
+end
+
+local own = queue .. sex .. ':' .. want
+
+-- Ждущий мог уже перейти в общую корзину своего пола (FALLBACK_QUEUE)
+for _, key in ipairs({own, queue .. sex .. ':any'}) do
+    local deadline = redis.call('ZSCORE', key, user)
+    if deadline and tonumber(deadline) > now then
+        return {'queued', '', '', ''}
+    end
+end
+
+-- Завершаем текущий диалог, если он есть, и считаем пропуск
+local old = redis.call('GET', prefix .. user)
+if old then
+    redis.call('DEL', prefix .. user)
+    if redis.call('GET', prefix .. old) == user then
+        redis.call('DEL', prefix .. old)
+    end
+    changed = {user, old}
+    skips = redis.call('INCR', ARGV[11] .. user)
+    if skips == 1 then
+        redis.call('EXPIRE', ARGV[11] .. user, ARGV[14])
+    end
+else
+    old = ''
+    skips = tonumber(redis.call('GET', ARGV[11] .. user) or 0)
+end
+
+-- Резерв: забираем удержанного, если он всё ещё ждёт в подходящей корзине
+local candidate
+local reserved = redis.call('GET', ARGV[9] .. user)
+if reserved then
+    redis.call('DEL', ARGV[9] .. user)
+    if redis.call('GET', holder_prefix .. reserved) == user and redis.call('EXISTS', prefix .. reserved) == 0
+            and redis.call('EXISTS', ARGV[16] .. reserved) == 0 then
+        local key = waiting_in(reserved)
+        if key then
+            redis.call('ZREM', key, reserved)
+            candidate = reserved
+        end
+    end
+end
+
+if not candidate then
+    local found = pick(true)
+    if found then
+        candidate = found[1]
+        redis.call('ZREM', found[2], candidate)
+    end
+end
+
+if candidate then
+    redis.call('DEL', holder_prefix .. candidate)
+    redis.call('SET', prefix .. user, candidate, 'EX', ARGV[5])
+    redis.call('SET', prefix .. candidate, user, 'EX', ARGV[5])
+    table.insert(changed, user)
+    table.insert(changed, candidate)
+    reserve()
+    notify()
+    return {'matched', candidate, old, skips}
+end
+
+redis.call('ZADD', own, now + tonumber(ARGV[3]), user)
+notify()
+return {'waiting', '', old, skips}
+"""
+
+# Аргументы — см. _MATCH_PRELUDE.
+# Держит следующего собеседника для частого пропускающего, пока тот в диалоге.
+# Возвращает удержанного или пустой ответ.
+RESERVE_NEXT = _MATCH_PRELUDE + """
+return reserve()
+"""
+
+# KEYS — все корзины очереди
+# ARGV[1] — текущее время, ARGV[2] — размер пачки
+# Забирает из корзин не больше ARGV[2] просроченных пользователей.
+SWEEP_QUEUE = """
+local left = tonumber(ARGV[2])
+local result = {}
+for _, key in ipairs(KEYS) do
+    if left == 0 then
+        break
+    end
+    local expired = redis.call('ZRANGEBYSCORE', key, '-inf', ARGV[1], 'LIMIT', 0, left)
+    if #expired > 0 then
+        redis.call('ZREM', key, unpack(expired))
+        for _, user in ipairs(expired) do
+            table.insert(result, user)
+        end
+        left = left - #expired
+    end
+end
+return result
+"""
+
+# KEYS — корзины с конкретным пожеланием ({пол}:f, {пол}:m)
+# ARGV[1] — текущее время, ARGV[2] — дедлайн, до которого ожидание считается
+# долгим (сейчас + время ожидания - порог), ARGV[3] — размер пачки
+# Переносит долго ждущих в общую корзину своего пола {пол}:any с тем же
+# дедлайном: дальше им подходит собеседник любого пола.
+# Возвращает перенесённых пользователей.
+FALLBACK_QUEUE = """
+local left = tonumber(ARGV[3])
+local result = {}
+for _, key in ipairs(KEYS) do
+    if left == 0 then
+        break
+    end
+    local target = string.gsub(key, '[^:]+$', 'any')
+    local waiting = redis.call('ZRANGEBYSCORE', key, '(' .. ARGV[1], ARGV[2], 'WITHSCORES', 'LIMIT', 0, left)
+    for i = 1, #waiting, 2 do
+        redis.call('ZREM', key, waiting[i])
+        redis.call('ZADD', target, waiting[i + 1], waiting[i])
+        table.insert(result, waiting[i])
+    end
+    left = left - #waiting / 2
+end
+return result
+"""
+
+# ARGV[1] — user_id, ARGV[2] — префикс профилей, ARGV[3] — префикс корзин,
+# ARGV[4] — свой пол, ARGV[5] — пол собеседника (пустая строка — не менять)
+# Обновляет профиль. Если пользователь ждёт в очереди, переносит его
+# в корзину нового профиля, сохраняя дедлайн.
+SET_PROFILE = """
+local key = ARGV[2] .. ARGV[1]
+local profile = redis.call('HMGET', key, 'sex', 'want')
+local sex = profile[1] or 'u'
+local want = profile[2] or 'any'
+local deadline
+for _, bucket in ipairs({ARGV[3] .. sex .. ':' .. want, ARGV[3] .. sex .. ':any'}) do
+    deadline = deadline or redis.call('ZSCORE', bucket, ARGV[1])
+    redis.call('ZREM', bucket, ARGV[1])
+end
+if ARGV[4] ~= '' then
+    sex = ARGV[4]
+end
+if ARGV[5] ~= '' then
+    want = ARGV[5]
+end
+redis.call('HSET', key, 'sex', sex, 'want', want)
+if deadline then
+    redis.call('ZADD', ARGV[3] .. sex .. ':' .. want, deadline, ARGV[1])
+end
+return {sex, want}
+"""
+
+# KEYS[1] — ключ пары пользователя
+# ARGV[1] — префикс ключей пар, ARGV[2] — TTL пары
+# Возвращает собеседника и продлевает TTL обоих ключей пары.
+TOUCH_PAIR = """
+local partner = redis.call('GETEX', KEYS[1], 'EX', ARGV[2])
+if partner then
+    redis.call('EXPIRE', ARGV[1] .. partner, ARGV[2])
+end
+return partner
+"""
+
+# KEYS[1] — ключ пары пользователя
+# ARGV[1] — префикс ключей пар, ARGV[2] — user_id,
+# ARGV[3] — остаток TTL, ниже которого пара считается простаивающей,
+# ARGV[4] — канал инвалидации
+# Закрывает пару, если в ней так и не было активности.
+# Возвращает {собеседник, байт освобождено} или пустой ответ.
+REAP_PAIR = """
+local partner = redis.call('GET', KEYS[1])
+if not partner then
+    return false
+end
+local ttl = redis.call('TTL', KEYS[1])
+if ttl > tonumber(ARGV[3]) then
+    return false
+end
+local freed = redis.call('MEMORY', 'USAGE', KEYS[1]) or 0
+local partner_key = ARGV[1] .. partner
+if redis.call('GET', partner_key) == ARGV[2] then
+    freed = freed + (redis.call('MEMORY', 'USAGE', partner_key) or 0)
+    redis.call('DEL', partner_key)
+end
+redis.call('DEL', KEYS[1])
+redis.call('PUBLISH', ARGV[4], ARGV[2] .. ',' .. partner)
+return {partner, freed}
+"""
+
+# ARGV[1], ARGV[2] — пользователи, ARGV[3] — префикс ключей пар,
+# ARGV[4] — TTL пары, ARGV[5] — канал инвалидации
+# Создаёт пару, разрывая прежние пары обоих пользователей.
+# Возвращает {прежний собеседник ARGV[1], прежний собеседник ARGV[2]}.
+SET_PAIR = """
+local prefix = ARGV[3]
+local changed = {ARGV[1], ARGV[2]}
+local former = {}
+for i = 1, 2 do
+    local user = ARGV[i]
+    local old = redis.call('GET', prefix .. user)
+    if old and old ~= ARGV[3 - i] then
+        if redis.call('GET', prefix .. old) == user then
+            redis.call('DEL', prefix .. old)
+        end
+        table.insert(changed, old)
+    end
+    former[i] = old or ''
+end
+redis.call('SET', prefix .. ARGV[1], ARGV[2], 'EX', ARGV[4])
+redis.call('SET', prefix .. ARGV[2], ARGV[1], 'EX', ARGV[4])
+redis.call('PUBLISH', ARGV[5], table.concat(changed, ','))
+return former
+"""
+
+# KEYS[1] — ключ пары пользователя
+# ARGV[1] — префикс ключей пар, ARGV[2] — user_id, ARGV[3] — канал инвалидации
+# Удаляет пару целиком. Возвращает бывшего собеседника или пустой ответ.
+UNPAIR = """
+local partner = redis.call('GET', KEYS[1])
+redis.call('DEL', KEYS[1])
+if not partner then
+    return false
+end
+if redis.call('GET', ARGV[1] .. partner) == ARGV[2] then
+    redis.call('DEL', ARGV[1] .. partner)
+end
+redis.call('PUBLISH', ARGV[3], ARGV[2] .. ',' .. partner)
+return partner
+"""
+
+# KEYS[1] — ключ аренды, ARGV[1] — токен держателя, ARGV[2] — TTL, мс
+# Продлевает аренду, только если она всё ещё у этого держателя. Возвращает 1/0.
+RENEW_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1] — ключ аренды, ARGV[1] — токен держателя
+# Снимает аренду, только если она у этого держателя.
+RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS[1] — hash блобов, KEYS[2] — hash занятого места, KEYS[3] — zset возраста блобов папки
+# ARGV[1] — file_unique_id, ARGV[2] — блоб, ARGV[3] — папка, ARGV[4] — размер, ARGV[5] — время
+# Регистрирует блоб; размер учитывается один раз, даже если файл сохранили два процесса.
+# Возвращает 1, если блоб учтён впервые.
+REGISTER_BLOB = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if redis.call('ZADD', KEYS[3], 'NX', ARGV[5], ARGV[2]) == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[3], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+# KEYS[1] — hash занятого места, KEYS[2] — zset возраста блобов папки
+# ARGV[1] — папка, дальше тройки: блоб, размер, время
+# Учитывает найденные на диске блобы; уже учтённые (register или прерванный обход) пропускает.
+# Возвращает число добавленных байт.
+BOOTSTRAP_BLOBS = """
+local added = 0
+for i = 2, #ARGV, 3 do
+    if redis.call('ZADD', KEYS[2], 'NX', ARGV[i + 2], ARGV[i]) == 1 then
+        added = added + tonumber(ARGV[i + 1])
+    end
+end
+if added > 0 then
+    redis.call('HINCRBY', KEYS[1], ARGV[1], added)
+end
+return added
+"""
+
+# KEYS[1] — zset возраста блобов папки, KEYS[2] — hash блобов, KEYS[3] — hash занятого места,
+# KEYS[4] — индекс сообщений, KEYS[5] — hash «блоб -> сегмент»
+# ARGV[1] — папка, ARGV[2] — освобождено байт, ARGV[3] — префикс ссылок на блоб,
+# дальше пары: блоб, file_unique_id
+# Забывает удалённые блобы вместе с записями индекса, которые на них ссылаются.
+DROP_BLOBS = """
+for i = 4, #ARGV, 2 do
+    local blob = ARGV[i]
+    local refs_key = ARGV[3] .. blob
+    redis.call('ZREM', KEYS[1], blob)
+    redis.call('HDEL', KEYS[5], blob)
+    redis.call('HDEL', KEYS[2], ARGV[i + 1])
+    local refs = redis.call('SMEMBERS', refs_key)
+    for start = 1, #refs, 1000 do
+        redis.call('HDEL', KEYS[4], unpack(refs, start, math.min(start + 999, #refs)))
+    end
+    redis.call('DEL', refs_key)
+end
+redis.call('HINCRBY', KEYS[3], ARGV[1], -tonumber(ARGV[2]))
+"""
@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from app2.database.redis_session import redis_conn, UNREACHABLE_KEY_PREFIX, UNREACHABLE_CHANNEL
+from app2.logger import logger
+from app2.utils.failures import BLOCKED, DEACTIVATED, RATE_LIMITED, TRANSIENT
+
+# Сколько считаем пользователя недоступным, секунд. Раньше срока отметка
+# снимается, как только от пользователя приходит апдейт
+UNREACHABLE_TTL = {
+    BLOCKED: 7 * 24 * 3600,
+    DEACTIVATED: 30 * 24 * 3600,
+    RATE_LIMITED: 0,  # 429 — лимит всего бота, получатель тут ни при чём
+    TRANSIENT: 0,  # не отмечаем
+}
+LOAD_BATCH = 1000  # ключей за один SCAN при загрузке зеркала
+
+
+class UnreachableUsers:
+    """
+    Недоступные пользователи: ключи с TTL в Redis и их зеркало в памяти процесса.
+    Проверка идёт только по зеркалу, изменения расходятся по UNREACHABLE_CHANNEL.
+    """
+
+    def __init__(self):
+        self._local: dict[int, tuple[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._local)
+
+    def reason(self, user_id: int) -> str | None:
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] < time.time():
+            del self._local[user_id]
+            return None
+        return entry[0]
+
+    def is_unreachable(self, user_id: int) -> bool:
+        return self.reason(user_id) is not None
+
+    async def mark(self, user_id: int, reason: str) -> bool:
+        """Отмечаем пользователя недоступным. False — причина не стоит отметки"""
+        ttl = UNREACHABLE_TTL.get(reason, 0)
+        if not ttl:
+            return False
+        self._local[user_id] = (reason, time.time() + ttl)
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.set(f"{UNREACHABLE_KEY_PREFIX}{user_id}", reason, ex=ttl)
+            pipe.publish(UNREACHABLE_CHANNEL, f"{user_id}:{reason}:{ttl}")
+            await pipe.execute()
+        return True
+
+    async def clear(self, user_id: int):
+        """Снимаем отметку. Redis трогаем, только если пользователь есть в зеркале"""
+        if self._local.pop(user_id, None) is None:
+            return
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.delete(f"{UNREACHABLE_KEY_PREFIX}{user_id}")
+            pipe.publish(UNREACHABLE_CHANNEL, f"{user_id}::0")
+            await pipe.execute()
+
+    async def load(self):
+        """Заполняем зеркало из Redis целиком"""
+        local = {}
+        async for keys in _scan_batches(f"{UNREACHABLE_KEY_PREFIX}*"):
+            async with redis_conn.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.get(key)
+                    pipe.ttl(key)
+                values = await pipe.execute()
+            now = time.time()
+            for key, reason, ttl in zip(keys, values[::2], values[1::2]):
+                if reason and ttl > 0:
+                    local[int(key[len(UNREACHABLE_KEY_PREFIX):])] = (reason, now + ttl)
+        self._local = local
+
+    async def listen(self):
+        """Фоновая задача: держит зеркало в согласии с остальными процессами бота"""
+        while True:
+            try:
+                async with redis_conn.pubsub() as pubsub:
+                    await pubsub.subscribe(UNREACHABLE_CHANNEL)
+                    # Пока не были подписаны, могли пропустить изменения
+                    await self.load()
+                    logger.info(f"Unreachable users loaded: {len(self._local)}")
+                    async for msg in pubsub.listen():
+                        if msg["type"] != "message":
+                            continue
+                        user_id, reason, ttl = msg["data"].split(":")
+                        if reason:
+                            self._local[int(user_id)] = (reason, time.time() + int(ttl))
+                        else:
+                            self._local.pop(int(user_id), None)
+            except Exception as e:
+                logger.error(e)
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        reasons: dict[str, int] = {}
+        for reason, _ in self._local.values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+        return {"size": len(self._local), **reasons}
+
+
+async def _scan_batches(pattern: str):
+    cursor = 0
+    while True:
+        cursor, keys = await redis_conn.scan(cursor, match=pattern, count=LOAD_BATCH)
+        if keys:
+            yield keys
+        if not cursor:
+            return
+
+
+unreachable_users = UnreachableUsers()
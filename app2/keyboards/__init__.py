@@ -1 +1,2 @@
-from .pop_up_menu import set_commands_menu
\ No newline at end of file
+from .pop_up_menu import set_commands_menu
+from .main_kb import choose_sex, choose_partner_sex
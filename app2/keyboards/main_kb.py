@@ -1,6 +1,5 @@
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from app.core import config_aiogram
 
 
 def choose_sex():
@@ -8,4 +7,12 @@ def choose_sex():
     kb_builder.button(text='Девушка', callback_data='sex_female')
     kb_builder.button(text='Парень', callback_data='sex_male')
     kb_builder.adjust(2)
-    return kb_builder.as_markup(resize_keyboard=True)
\ No newline at end of file
+    return kb_builder.as_markup(resize_keyboard=True)
+
+def choose_partner_sex():
+    kb_builder = InlineKeyboardBuilder()
+    kb_builder.button(text='Девушку', callback_data='want_female')
+    kb_builder.button(text='Парня', callback_data='want_male')
+    kb_builder.button(text='Неважно', callback_data='want_any')
+    kb_builder.adjust(2, 1)
+    return kb_builder.as_markup(resize_keyboard=True)
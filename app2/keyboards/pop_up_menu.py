@@ -8,7 +8,9 @@ async def set_commands_menu(bot):
         BotCommand(command='/search',
                    description='🔎 Поиск собеседника'),
         BotCommand(command='/stop',
-                   description='❌ Остановить диалог')
+                   description='❌ Остановить диалог'),
+        BotCommand(command='/profile',
+                   description='⚙️ Кого искать')
         ]
 
     await bot.set_my_commands(main_menu_commands)
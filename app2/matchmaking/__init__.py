@@ -0,0 +1,18 @@
+from .base import (MatchStore, MATCHED, WAITING, QUEUED, FEMALE, MALE, UNKNOWN, ANY, SEXES, WANTS,
+                   compatible_buckets)
+from .memory import InMemoryMatchStore
+
+
+def create_store(backend: str, single_process: bool = False, **options) -> MatchStore:
+    """
+    Хранилище по имени бэкенда: memory, redis или sql. options — queue_ttl, fallback.
+    single_process — бот работает в одном процессе (SQL-бэкенду можно держать кэш диалогов)
+    """
+    if backend == "memory":
+        return InMemoryMatchStore(**options)
+    if backend == "sql":
+        # SQL-бэкенд тянет за собой app.database (нужен DB_PATH)
+        from .sql_store import SqlMatchStore
+        return SqlMatchStore(single_process=single_process, **options)
+    from .redis_store import RedisMatchStore
+    return RedisMatchStore(**options)
@@ -0,0 +1,94 @@
+from abc import ABC, abstractmethod
+
+# Результат MatchStore.match
+MATCHED = "matched"  # пара создана
+WAITING = "waiting"  # свободных нет, пользователь поставлен в очередь
+QUEUED = "queued"  # пользователь уже ждёт в очереди, ничего не изменилось
+
+# Профиль: свой пол и пол собеседника
+FEMALE = "f"
+MALE = "m"
+UNKNOWN = "u"  # пол не указан
+ANY = "any"  # собеседник любого пола
+SEXES = (FEMALE, MALE, UNKNOWN)
+WANTS = (FEMALE, MALE, ANY)
+
+
+def compatible_buckets(sex: str, want: str) -> list[tuple[str, str]]:
+    """
+    Корзины очереди (пол, кого ищет), где ждут подходящие собеседники:
+    их пол подходит нам, а наш — им. Всегда не больше трёх корзин.
+    """
+    owns = SEXES if want == ANY else (want,)
+    wants = (ANY,) if sex == UNKNOWN else (sex, ANY)
+    return [(own, wanted) for own in owns for wanted in wants]
+
+
+class MatchStore(ABC):
+    """
+    Хранилище очереди ожидания и пар собеседников.
+
+    Все реализации ведут себя одинаково (см. app2.matchmaking.conformance),
+    поэтому бэкенд выбирается под размер развёртывания.
+    """
+
+    name = "base"
+    queue_ttl: float  # сколько пользователь ждёт в очереди, секунд
+    fallback: float  # после стольких секунд ожидания подходит собеседник любого пола
+
+    @abstractmethod
+    async def match(self, user_id: int) -> tuple[str, int | None, int | None]:
+        """
+        Завершает текущий диалог пользователя, ищет ему собеседника,
+        а если свободных нет — ставит в очередь.
+
+        Returns:
+            (статус, собеседник, прошлый собеседник)
+        """
+
+    @abstractmethod
+    async def get_partner(self, user_id: int) -> int | None:
+        """Текущий собеседник или None"""
+
+    @abstractmethod
+    async def set_pair(self, user1: int, user2: int) -> tuple[int | None, int | None]:
+        """Создаёт пару, разрывая прежние. Возвращает прежних собеседников обоих"""
+
+    @abstractmethod
+    async def unpair(self, user_id: int) -> int | None:
+        """Разрывает пару. Возвращает бывшего собеседника"""
+
+    @abstractmethod
+    async def is_waiting(self, user_id: int) -> bool:
+        """Ждёт ли пользователь в очереди"""
+
+    @abstractmethod
+    async def leave_queue(self, user_id: int):
+        """Убирает пользователя из очереди"""
+
+    async def pop_expired(self, batch: int) -> list[int]:
+        """Забирает из очереди пользователей с истёкшим ожиданием"""
+        return []
+
+    async def set_profile(self, user_id: int, sex: str | None = None, want: str | None = None):
+        """Меняет профиль для подбора. Бэкенды без профилей его игнорируют"""
+
+    async def get_profile(self, user_id: int) -> tuple[str, str]:
+        """Профиль пользователя: (свой пол, пол собеседника)"""
+        return UNKNOWN, ANY
+
+    def reserve_next(self, user_id: int) -> bool:
+        """
+        Держит следующего собеседника для того, кто часто пропускает.
+        Вызывается на каждое сообщение в диалоге, поэтому не ждёт сети: решает
+        по локальным данным и резервирует в фоне. Возвращает True, если резерв
+        запрошен; бэкенды без резерва ничего не делают
+        """
+        return False
+
+    async def apply_fallback(self, batch: int) -> list[int]:
+        """Переводит долго ждущих в общий пул своего пола. Возвращает переведённых"""
+        return []
+
+    async def close(self):
+        pass
@@ -0,0 +1,124 @@
+"""
+Общий набор проверок поведения MatchStore. Каждая реализация должна его
+проходить; запускается из benchmarks/bench_match_store.py.
+"""
+import asyncio
+import random
+
+from app2.matchmaking.base import MatchStore, MATCHED, WAITING, QUEUED, FEMALE, MALE, ANY
+
+CHECK_TTL = 1.0  # ожидание в очереди на время проверки сроков, секунд
+CHECK_FALLBACK = 0.5
+
+
+async def check_store(store: MatchStore):
+    """Прогоняет сценарии поиска и разрыва пар. AssertionError при расхождении"""
+    # Берём id вне диапазона реальных пользователей Telegram
+    base = random.randrange(10 ** 12, 10 ** 13)
+    a, b, c = base, base + 1, base + 2
+
+    # Очередь
+    assert await store.match(a) == (WAITING, None, None)
+    assert await store.is_waiting(a)
+    assert (await store.match(a))[0] == QUEUED
+
+    # Второй пользователь забирает ждущего
+    assert await store.match(b) == (MATCHED, a, None)
+    assert await store.get_partner(a) == b
+    assert await store.get_partner(b) == a
+    assert not await store.is_waiting(a)
+    assert not await store.is_waiting(b)
+
+    # Повторный поиск завершает текущий диалог и возвращает прошлого собеседника
+    assert await store.match(a) == (WAITING, None, b)
+    assert await store.get_partner(b) is None
+    assert await store.match(b) == (MATCHED, a, None)
+
+    # Разрыв пары возвращает бывшего собеседника один раз
+    assert await store.unpair(a) == b
+    assert await store.get_partner(a) is None
+    assert await store.get_partner(b) is None
+    assert await store.unpair(a) is None
+
+    # Прямое создание пары разрывает прежнюю
+    await store.set_pair(a, b)
+    assert await store.set_pair(a, c) == (b, None)
+    assert await store.get_partner(b) is None
+    assert await store.get_partner(c) == a
+    assert await store.unpair(c) == a
+
+    # Выход из очереди
+    assert (await store.match(c))[0] == WAITING
+    await store.leave_queue(c)
+    assert not await store.is_waiting(c)
+
+    # Подбор по профилю — для бэкендов, которые его поддерживают
+    if type(store).set_profile is not MatchStore.set_profile:
+        await check_profiles(store, base + 10)
+
+    # Сроки ожидания проверяем с короткими queue_ttl и fallback
+    queue_ttl, fallback = store.queue_ttl, store.fallback
+    store.queue_ttl, store.fallback = CHECK_TTL, CHECK_FALLBACK
+    try:
+        await check_timeouts(store, base + 20)
+    finally:
+        store.queue_ttl, store.fallback = queue_ttl, fallback
+
+
+async def check_profiles(store: MatchStore, base: int):
+    """Сценарии корзин: несовместимые не встречаются, смена профиля переносит ждущего"""
+    d, e, f, g = base, base + 1, base + 2, base + 3
+    await store.set_profile(d, FEMALE, MALE)
+    await store.set_profile(e, MALE, MALE)
+    await store.set_profile(f, MALE, ANY)
+    await store.set_profile(g, FEMALE, ANY)
+    assert await store.get_profile(d) == (FEMALE, MALE)
+
+    assert await store.match(d) == (WAITING, None, None)
+    # e ищет парня, а d — девушка
+    assert await store.match(e) == (WAITING, None, None)
+    assert await store.match(f) == (MATCHED, d, None)
+
+    # Ждущий переезжает в корзину нового профиля
+    await store.set_profile(e, want=ANY)
+    assert await store.is_waiting(e)
+    assert await store.match(g) == (MATCHED, e, None)
+
+    for user in (d, e):
+        await store.unpair(user)
+
+
+async def check_timeouts(store: MatchStore, base: int):
+    """Сценарии сроков: истёкший не ждёт и не подбирается, повторный поиск снова ставит в очередь"""
+    a, b, c, d, e = base, base + 1, base + 2, base + 3, base + 4
+    margin = 0.2
+
+    # Повторный поиск после истечения — снова в очередь, а не QUEUED
+    assert await store.match(a) == (WAITING, None, None)
+    await asyncio.sleep(store.queue_ttl + margin)
+    assert not await store.is_waiting(a)
+    assert await store.match(a) == (WAITING, None, None)
+    assert await store.is_waiting(a)
+    await store.leave_queue(a)
+
+    # Истёкшего не подбирают; sweep забирает его один раз
+    assert await store.match(b) == (WAITING, None, None)
+    await asyncio.sleep(store.queue_ttl + margin)
+    assert await store.match(c) == (WAITING, None, None)
+    expired = await store.pop_expired(100)
+    assert b in expired and c not in expired
+    assert b not in await store.pop_expired(100)
+    await store.leave_queue(c)
+
+    # Долго ждущий переходит в общий пул своего пола
+    if type(store).set_profile is MatchStore.set_profile:
+        return
+    await store.set_profile(d, FEMALE, MALE)
+    await store.set_profile(e, FEMALE, ANY)
+    assert await store.match(d) == (WAITING, None, None)
+    assert d not in await store.apply_fallback(100)
+    await asyncio.sleep(store.fallback + margin)
+    assert d in await store.apply_fallback(100)
+    assert await store.get_profile(d) == (FEMALE, MALE)
+    assert await store.match(e) == (MATCHED, d, None)
+    await store.unpair(d)
@@ -0,0 +1,154 @@
+import time
+from collections import OrderedDict
+
+from app2.matchmaking.base import (MatchStore, MATCHED, WAITING, QUEUED, UNKNOWN, ANY, compatible_buckets)
+
+QUEUE_TTL = 300  # сколько пользователь ждёт в очереди, секунд
+QUEUE_FALLBACK = 60  # после стольких секунд ожидания подходит собеседник любого пола
+
+
+class InMemoryMatchStore(MatchStore):
+    """
+    Очередь и пары в памяти процесса: без сетевых вызовов.
+    Подходит для развёртывания в один процесс и для проверок.
+    """
+
+    name = "memory"
+
+    def __init__(self, queue_ttl: float = QUEUE_TTL, fallback: float = QUEUE_FALLBACK):
+        self.queue_ttl = queue_ttl
+        self.fallback = fallback
+        # (пол, кого ищет) -> {user_id: дедлайн ожидания}; порядок вставки = порядок очереди
+        self._buckets: dict[tuple[str, str], OrderedDict[int, float]] = {}
+        # user_id -> корзина, в которой он ждёт
+        self._waiting: dict[int, tuple[str, str]] = {}
+        self._profiles: dict[int, tuple[str, str]] = {}
+        self._pairs: dict[int, int] = {}
+
+    async def match(self, user_id: int) -> tuple[str, int | None, int | None]:
+        now = time.time()
+        if self._deadline(user_id) > now:
+            return QUEUED, None, None
+        self._dequeue(user_id)
+
+        old = self._drop_pair(user_id)
+
+        # Самый давний живой из голов подходящих корзин
+        best = None
+        for bucket in compatible_buckets(*self._profile(user_id)):
+            head = self._head(bucket, now)
+            if head is not None and (best is None or head[1] < best[1]):
+                best = head
+        if best is None:
+            self._enqueue(user_id, self._profile(user_id), now + self.queue_ttl)
+            return WAITING, None, old
+        partner = best[0]
+        self._dequeue(partner)
+        self._pairs[user_id] = partner
+        self._pairs[partner] = user_id
+        return MATCHED, partner, old
+
+    async def get_partner(self, user_id: int) -> int | None:
+        return self._pairs.get(user_id)
+
+    async def set_pair(self, user1: int, user2: int) -> tuple[int | None, int | None]:
+        former = (self._pairs.get(user1), self._pairs.get(user2))
+        for user, other in ((user1, user2), (user2, user1)):
+            old = self._pairs.get(user)
+            if old is not None and old != other and self._pairs.get(old) == user:
+                del self._pairs[old]
+        self._pairs[user1] = user2
+        self._pairs[user2] = user1
+        return former
+
+    async def unpair(self, user_id: int) -> int | None:
+        return self._drop_pair(user_id)
+
+    async def is_waiting(self, user_id: int) -> bool:
+        return self._deadline(user_id) > time.time()
+
+    async def leave_queue(self, user_id: int):
+        self._dequeue(user_id)
+
+    async def pop_expired(self, batch: int) -> list[int]:
+        now = time.time()
+        expired = []
+        for queue in self._buckets.values():
+            for user_id, deadline in queue.items():
+                if len(expired) >= batch:
+                    break
+                if deadline <= now:
+                    expired.append(user_id)
+        for user_id in expired:
+            self._dequeue(user_id)
+        return expired
+
+    async def set_profile(self, user_id: int, sex: str | None = None, want: str | None = None):
+        old_sex, old_want = self._profile(user_id)
+        self._profiles[user_id] = (sex or old_sex, want or old_want)
+        deadline = self._deadline(user_id)
+        if deadline:
+            # Ждущий переезжает в корзину нового профиля со своим дедлайном
+            self._dequeue(user_id)
+            self._enqueue(user_id, self._profiles[user_id], deadline)
+
+    async def get_profile(self, user_id: int) -> tuple[str, str]:
+        return self._profile(user_id)
+
+    async def apply_fallback(self, batch: int) -> list[int]:
+        now = time.time()
+        threshold = now + self.queue_ttl - self.fallback
+        moved = []
+        for (sex, want), queue in list(self._buckets.items()):
+            if want == ANY:
+                continue
+            for user_id, deadline in list(queue.items()):
+                if len(moved) >= batch or deadline > threshold:
+                    break
+                if deadline <= now:
+                    continue  # просроченных уберёт pop_expired
+                self._dequeue(user_id)
+                self._enqueue(user_id, (sex, ANY), deadline)
+                moved.append(user_id)
+        return moved
+
+    def _profile(self, user_id: int) -> tuple[str, str]:
+        return self._profiles.get(user_id, (UNKNOWN, ANY))
+
+    def _deadline(self, user_id: int) -> float:
+        bucket = self._waiting.get(user_id)
+        return self._buckets[bucket][user_id] if bucket else 0
+
+    def _enqueue(self, user_id: int, bucket: tuple[str, str], deadline: float):
+        self._buckets.setdefault(bucket, OrderedDict())[user_id] = deadline
+        self._waiting[user_id] = bucket
+
+    def _dequeue(self, user_id: int):
+        bucket = self._waiting.pop(user_id, None)
+        if bucket:
+            del self._buckets[bucket][user_id]
+
+    def _head(self, bucket: tuple[str, str], now: float) -> tuple[int, float] | None:
+        """Первый живой в корзине; попутно убирает тех, кто уже в паре"""
+        queue = self._buckets.get(bucket)
+        if not queue:
+            return None
+        stale = []
+        head = None
+        for candidate, deadline in queue.items():
+            if deadline <= now:
+                continue  # просроченных уберёт pop_expired
+            if candidate in self._pairs:
+                stale.append(candidate)
+                continue
+            head = candidate, deadline
+            break
+        for candidate in stale:
+            self._dequeue(candidate)
+        return head
+
+    def _drop_pair(self, user_id: int) -> int | None:
+        partner = self._pairs.pop(user_id, None)
+        if partner is not None and self._pairs.get(partner) == user_id:
+            del self._pairs[partner]
+        return partner
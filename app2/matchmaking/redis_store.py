@@ -0,0 +1,52 @@
+from app2 import database
+from app2.database import QUEUE_TTL, QUEUE_FALLBACK
+from app2.matchmaking.base import MatchStore
+
+
+class RedisMatchStore(MatchStore):
+    """
+    Очередь и пары в Redis (app2.database): атомарные Lua-скрипты,
+    общие для всех процессов бота, с локальным кэшем собеседников.
+    """
+
+    name = "redis"
+
+    def __init__(self, queue_ttl: float = QUEUE_TTL, fallback: float = QUEUE_FALLBACK):
+        self.queue_ttl = queue_ttl
+        self.fallback = fallback
+
+    async def match(self, user_id: int) -> tuple[str, int | None, int | None]:
+        return await database.match_user(user_id, self.queue_ttl)
+
+    async def get_partner(self, user_id: int) -> int | None:
+        return await database.get_partner(user_id)
+
+    async def set_pair(self, user1: int, user2: int) -> tuple[int | None, int | None]:
+        return await database.set_pair(user1, user2)
+
+    async def unpair(self, user_id: int) -> int | None:
+        return await database.remove_pair(user_id)
+
+    async def is_waiting(self, user_id: int) -> bool:
+        return await database.is_in_queue(user_id)
+
+    async def leave_queue(self, user_id: int):
+        await database.remove_from_queue(user_id)
+
+    async def pop_expired(self, batch: int) -> list[int]:
+        return await database.pop_expired(batch)
+
+    async def set_profile(self, user_id: int, sex: str | None = None, want: str | None = None):
+        await database.set_profile(user_id, sex, want)
+
+    async def get_profile(self, user_id: int) -> tuple[str, str]:
+        return await database.get_profile(user_id)
+
+    def reserve_next(self, user_id: int) -> bool:
+        return database.reserve_next(user_id, self.queue_ttl)
+
+    async def apply_fallback(self, batch: int) -> list[int]:
+        return await database.apply_fallback(batch, self.queue_ttl, self.fallback)
+
+    async def close(self):
+        await database.redis_conn.aclose()
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database import AsyncSessionLocal, User, crud, dialog_cache
+from app2.logger import logger
+from app2.matchmaking.base import MatchStore, MATCHED, WAITING, QUEUED, UNKNOWN, ANY, compatible_buckets
+from app2.matchmaking.memory import QUEUE_TTL, QUEUE_FALLBACK
+
+
+class SqlMatchStore(MatchStore):
+    """
+    Очередь и пары в SQL-базе app (таблицы users и dialogs, методы crud):
+    «в очереди» — user_state == "Searching" с неистёкшим search_deadline,
+    корзина — (sex, search_want), пара — открытый диалог.
+
+    crud пишет в кэш диалогов процесса (app.database.dialog_cache), который не
+    знает об изменениях в других процессах, поэтому кэш выключается, если
+    single_process не указан явно.
+    """
+
+    name = "sql"
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+                 queue_ttl: float = QUEUE_TTL, fallback: float = QUEUE_FALLBACK, single_process: bool = False):
+        self.session_factory = session_factory
+        self.queue_ttl = queue_ttl
+        self.fallback = fallback
+        if not single_process and dialog_cache.enabled:
+            dialog_cache.enabled = False
+            logger.info("Active dialog cache disabled: SQL match store may run in several processes")
+
+    async def match(self, user_id: int) -> tuple[str, int | None, int | None]:
+        async with self.session_factory() as session:
+            user = await self._ensure_user(session, user_id)
+            now = datetime.now()
+            if self._waiting(user, now):
+                return QUEUED, None, None
+
+            old = await crud.get_companion_id(session, user_id)
+            if old:
+                await crud.end_dialog(session, user_id)
+
+            partner = await crud.claim_searching_user(session, exclude_user_id=user_id,
+                                                      buckets=compatible_buckets(user.sex, user.want))
+            if partner is None:
+                user.user_state = "Searching"
+                user.search_want = user.want
+                user.search_deadline = now + timedelta(seconds=self.queue_ttl)
+                await session.commit()
+                return WAITING, None, old
+            await crud.create_dialog(session, user, partner)
+            return MATCHED, partner.user_id, old
+
+    async def get_partner(self, user_id: int) -> int | None:
+        async with self.session_factory() as session:
+            return await crud.get_companion_id(session, user_id)
+
+    async def set_pair(self, user1: int, user2: int) -> tuple[int | None, int | None]:
+        async with self.session_factory() as session:
+            former = []
+            for user_id in (user1, user2):
+                old = await crud.get_companion_id(session, user_id)
+                if old:
+                    await crud.end_dialog(session, user_id)
+                former.append(old)
+            await crud.create_dialog(session, await self._ensure_user(session, user1),
+                                     await self._ensure_user(session, user2))
+            return former[0], former[1]
+
+    async def unpair(self, user_id: int) -> int | None:
+        async with self.session_factory() as session:
+            partner = await crud.get_companion_id(session, user_id)
+            if partner:
+                await crud.end_dialog(session, user_id)
+            return partner
+
+    async def is_waiting(self, user_id: int) -> bool:
+        async with self.session_factory() as session:
+            user = await session.scalar(select(User).where(User.user_id == user_id))
+            return user is not None and self._waiting(user, datetime.now())
+
+    async def leave_queue(self, user_id: int):
+        async with self.session_factory() as session:
+            await session.execute(
+                update(User)
+                .where(User.user_id == user_id, User.user_state == "Searching")
+                .values(user_state="Offline", search_deadline=None, search_want=None)
+            )
+            await session.commit()
+
+    async def pop_expired(self, batch: int) -> list[int]:
+        now = datetime.now()
+        expired = (User.user_state == "Searching", User.search_deadline <= now)
+        heads = select(User.record_id).where(*expired).order_by(User.search_deadline).limit(batch)
+        async with self.session_factory() as session:
+            # Условия повторяются снаружи: строку, которую успели забрать, не трогаем
+            result = await session.execute(
+                update(User)
+                .where(User.record_id.in_(heads), *expired)
+                .values(user_state="Offline", search_deadline=None, search_want=None)
+                .returning(User.user_id)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return list(result.scalars())
+
+    async def set_profile(self, user_id: int, sex: str | None = None, want: str | None = None):
+        async with self.session_factory() as session:
+            user = await self._ensure_user(session, user_id)
+            user.sex = sex or user.sex
+            user.want = want or user.want
+            if user.user_state == "Searching":
+                # Ждущий переезжает в корзину нового профиля со своим дедлайном
+                user.search_want = user.want
+            await session.commit()
+
+    async def get_profile(self, user_id: int) -> tuple[str, str]:
+        async with self.session_factory() as session:
+            row = (await session.execute(select(User.sex, User.want).where(User.user_id == user_id))).first()
+            return (row.sex, row.want) if row else (UNKNOWN, ANY)
+
+    async def apply_fallback(self, batch: int) -> list[int]:
+        now = datetime.now()
+        threshold = now + timedelta(seconds=self.queue_ttl - self.fallback)
+        waiting = (User.user_state == "Searching", User.search_want != ANY,
+                   User.search_deadline > now, User.search_deadline <= threshold)
+        heads = select(User.record_id).where(*waiting).order_by(User.search_deadline).limit(batch)
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(User)
+                .where(User.record_id.in_(heads), *waiting)
+                .values(search_want=ANY)
+                .returning(User.user_id)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return list(result.scalars())
+
+    @staticmethod
+    def _waiting(user: User, now: datetime) -> bool:
+        """Ищет ли пользователь; поиск из app (без срока) не истекает"""
+        return user.user_state == "Searching" and (user.search_deadline is None or user.search_deadline > now)
+
+    @staticmethod
+    async def _ensure_user(session: AsyncSession, user_id: int) -> User:
+        """Пользователь по user_id; создаётся без username, существующий username не трогаем"""
+        user = await session.scalar(select(User).where(User.user_id == user_id))
+        if user is None:
+            user = User(user_id=user_id)
+            session.add(user)
+            await session.commit()
+            await session.refresh(user)
+        return user
@@ -0,0 +1,3 @@
+from .user_serial import UserSerialMiddleware
+from .reachability import ReachabilityMiddleware
+from .throttling import ThrottlingMiddleware, FloodLimit, FLOOD_LIMITS, RELAY, SEARCH, STOP
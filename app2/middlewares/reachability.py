@@ -0,0 +1,30 @@
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from app2.utils.sharding import user_of
+
+if TYPE_CHECKING:
+    # app импортирует app2.middlewares, а app2.database настраивает логи app2
+    from app2.database.unreachable import UnreachableUsers
+
+
+class ReachabilityMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update: пользователь, от которого пришёл апдейт,
+    снова доступен — снимаем отметку о блокировке. Для остальных апдейтов
+    это одна проверка словаря без обращения к Redis.
+    """
+
+    def __init__(self, unreachable: "UnreachableUsers"):
+        self.unreachable = unreachable
+
+    async def __call__(self,
+                       handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+                       event: Update,
+                       data: dict[str, Any]) -> Any:
+        user_id = user_of(event)
+        if user_id and self.unreachable.is_unreachable(user_id):
+            await self.unreachable.clear(user_id)
+        return await handler(event, data)
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+import redis.asyncio as redis
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+# Модуль используется и в app, поэтому берём общий логгер loguru
+from loguru import logger
+
+# Действия, на которые считаются отдельные лимиты
+RELAY = "relay"  # сообщения собеседнику и всё остальное
+SEARCH = "search"
+STOP = "stop"
+
+
+@dataclass(frozen=True)
+class FloodLimit:
+    soft: int  # после стольких событий за окно предупреждаем
+    hard: int  # после стольких — молча отбрасываем
+    window: float  # длина окна, секунд
+
+
+FLOOD_LIMITS = {
+    RELAY: FloodLimit(soft=20, hard=30, window=10),
+    SEARCH: FloodLimit(soft=6, hard=10, window=60),
+    STOP: FloodLimit(soft=6, hard=10, window=60),
+}
+# Текст сообщения или data кнопки -> действие; остальное считается RELAY
+FLOOD_ACTIONS = {"/search": SEARCH, "/stop": STOP}
+FLOOD_WARNING = "⚠️ Слишком часто. Подождите немного, иначе сообщения перестанут доходить."
+FLOOD_KEY_PREFIX = "flood:"  # общие счётчики процессов в Redis: flood:{действие}:{user_id}:{номер окна}
+SYNC_INTERVAL = 1  # как часто сверяем счётчики с Redis, секунд
+MAX_KEYS = 100_000  # сколько счётчиков держим в памяти
+
+
+class _Window:
+    """Скользящее окно по двум соседним фиксированным: O(1) памяти на пользователя и действие"""
+    __slots__ = ("index", "current", "previous", "remote", "pending", "warned", "dropped")
+
+    def __init__(self):
+        self.index = 0
+        self.current = 0  # событий в текущем фиксированном окне (этот процесс)
+        self.previous = 0  # событий в предыдущем окне
+        self.remote = 0  # счётчик текущего окна в Redis (все процессы)
+        self.pending = 0  # событий, ещё не отправленных в Redis
+        self.warned = -1  # номер окна, в котором уже предупредили
+        self.dropped = -1  # номер окна, в котором уже записали отбрасывание в лог
+
+    def roll(self, index: int):
+        self.previous = max(self.current, self.remote) if index == self.index + 1 else 0
+        self.index = index
+        self.current = self.remote = self.pending = 0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на message и callback_query: ограничивает частоту
+    действий пользователя (пересылка, поиск, выход). Выше мягкого порога
+    пользователь получает одно предупреждение за окно, выше жёсткого событие
+    отбрасывается до хендлеров — без обращений к Redis и Telegram.
+
+    С redis счётчики раз в SYNC_INTERVAL суммируются между процессами
+    (задача sync()); решение всё равно принимается по памяти процесса.
+    """
+
+    def __init__(self, limits: dict[str, FloodLimit] | None = None, actions: dict[str, str] | None = None,
+                 notify: Callable[[int, str], Any] | None = None, redis_conn: redis.Redis | None = None):
+        self.limits = limits or FLOOD_LIMITS
+        self.actions = {**FLOOD_ACTIONS, **(actions or {})}
+        self.notify = notify
+        self.redis = redis_conn
+        self._windows: OrderedDict[tuple[str, int], _Window] = OrderedDict()
+        self._dirty: set[tuple[str, int]] = set()  # счётчики с событиями, не отправленными в Redis
+        self.stats = {"warned": 0, "dropped": 0}
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: dict[str, Any]) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+        action = self.action_of(event)
+        limit = self.limits.get(action)
+        if limit is None:
+            return await handler(event, data)
+
+        now = time.time()
+        window = self._window(action, user.id, int(now // limit.window))
+        # Доля предыдущего окна, ещё попадающая в скользящее
+        overlap = 1 - (now / limit.window - window.index)
+        count = max(window.current, window.remote + window.pending) + window.previous * overlap
+
+        if count >= limit.hard:
+            self.stats["dropped"] += 1
+            if window.dropped != window.index:
+                window.dropped = window.index
+                logger.warning(f"Flood control: dropping {action} from user {user.id}")
+            return None
+        window.current += 1
+        if self.redis is not None:
+            window.pending += 1
+            self._dirty.add((action, user.id))
+        if count + 1 > limit.soft and window.warned != window.index:
+            window.warned = window.index
+            self.stats["warned"] += 1
+            if self.notify is not None:
+                self.notify(user.id, FLOOD_WARNING)
+        return await handler(event, data)
+
+    def action_of(self, event: TelegramObject) -> str:
+        if isinstance(event, Message):
+            text = (event.text or "").split(maxsplit=1)
+            key = text[0].split("@")[0] if text else ""
+            return self.actions.get(key) or self.actions.get(event.text or "") or RELAY
+        if isinstance(event, CallbackQuery):
+            return self.actions.get(event.data or "", RELAY)
+        return RELAY
+
+    async def sync(self, interval: float = SYNC_INTERVAL):
+        """Фоновая задача: отправляет накопленные события в Redis и забирает общие счётчики"""
+        while True:
+            await asyncio.sleep(interval)
+            keys, self._dirty = self._dirty, set()
+            dirty = [(key, window, window.index, window.pending)
+                     for key, window in ((key, self._windows.get(key)) for key in keys) if window and window.pending]
+            if not dirty:
+                continue
+            for _, window, _, _ in dirty:
+                window.pending = 0
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for (action, user_id), _, index, pending in dirty:
+                        name = f"{FLOOD_KEY_PREFIX}{action}:{user_id}:{index}"
+                        pipe.incrby(name, pending)
+                        pipe.expire(name, int(2 * self.limits[action].window) + 1)
+                    totals = await pipe.execute()
+                for (_, window, index, _), total in zip(dirty, totals[::2]):
+                    if window.index == index:
+                        window.remote = max(window.remote, total)
+            except Exception as e:
+                logger.error(e)
+
+    def _window(self, action: str, user_id: int, index: int) -> _Window:
+        key = (action, user_id)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window()
+            if len(self._windows) > MAX_KEYS:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+        if window.index != index:
+            window.roll(index)
+        return window
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from app2.utils.sharding import user_of
+
+
+class _UserQueue:
+    __slots__ = ("lock", "waiters")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiters = 0
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update: апдейты одного пользователя обрабатываются
+    строго по очереди (asyncio.Lock отдаёт блокировку в порядке прихода),
+    апдейты разных пользователей — параллельно. Очередь пользователя удаляется,
+    как только в ней никого не осталось.
+    """
+
+    def __init__(self):
+        self._queues: dict[int, _UserQueue] = {}
+
+    def __len__(self) -> int:
+        return len(self._queues)
+
+    async def __call__(self,
+                       handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+                       event: Update,
+                       data: dict[str, Any]) -> Any:
+        key = user_of(event)
+        if not key:
+            return await handler(event, data)
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _UserQueue()
+        queue.waiters += 1
+        try:
+            async with queue.lock:
+                return await handler(event, data)
+        finally:
+            queue.waiters -= 1
+            if not queue.waiters:
+                del self._queues[key]
@@ -0,0 +1,5 @@
+from .queue_sweeper import sweep_queue
+from .pair_reaper import reap_idle_pairs, reaper_stats
+from .admin_digest import AdminDigest
+from .media_archiver import MediaArchiver
+from .media_retention import MediaRetention
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import random
+import time
+
+import redis.asyncio as redis
+
+from app2.database import Lease
+from app2.logger import logger
+from app2.utils import SendScheduler, PRIORITY_ADMIN
+
+DIGEST_INTERVAL = 60  # как часто отправляем сводку, секунд
+DIGEST_MAX_EVENTS = 200  # после стольких событий сводка уходит раньше срока
+DIGEST_SAMPLE = 10  # сколько username показываем на событие
+DIGEST_KEY = "admin:digest"  # list: накопленное другими процессами, ждёт отправки держателем аренды
+
+EVENT_TITLES = {
+    "start": "подключились",
+    "search": "нажали поиск 🔎",
+}
+
+
+class AdminDigest:
+    """
+    Копит события пользователей и периодически отправляет администратору сводку.
+    record() только обновляет счётчики в памяти и не делает сетевых вызовов.
+
+    С redis_conn и lease процессов может быть несколько: каждый сбрасывает
+    накопленное в DIGEST_KEY, а сводку из всех частей отправляет только
+    держатель аренды — администратор получает одно сообщение, а не по одному
+    от каждого процесса.
+    """
+
+    def __init__(self, sender: SendScheduler, chat_id: int, interval: float = DIGEST_INTERVAL,
+                 max_events: int = DIGEST_MAX_EVENTS, sample_size: int = DIGEST_SAMPLE,
+                 redis_conn: redis.Redis | None = None, lease: Lease | None = None):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_events = max_events
+        self.sample_size = sample_size
+        self.redis = redis_conn
+        self.lease = lease
+        self._counts: dict[str, int] = {}
+        self._samples: dict[str, list[str]] = {}
+        self._total = 0
+        self._started = time.time()
+        self._full = asyncio.Event()
+
+    def record(self, event: str, user_id: int, username: str | None):
+        count = self._counts.get(event, 0) + 1
+        self._counts[event] = count
+        sample = self._samples.setdefault(event, [])
+        name = f"@{username}({user_id})" if username else str(user_id)
+        # Reservoir sampling: каждый пользователь попадает в выборку с равной вероятностью
+        if len(sample) < self.sample_size:
+            sample.append(name)
+        else:
+            index = random.randrange(count)
+            if index < self.sample_size:
+                sample[index] = name
+        self._total += 1
+        if self._total >= self.max_events:
+            self._full.set()
+
+    def _take(self) -> dict | None:
+        """Забирает накопленное с момента прошлой сводки"""
+        if not self._total:
+            return None
+        part = {"started": self._started, "counts": self._counts, "samples": self._samples}
+        self._counts = {}
+        self._samples = {}
+        self._total = 0
+        self._started = time.time()
+        self._full.clear()
+        return part
+
+    async def flush(self):
+        part = self._take()
+        if self.redis is None:
+            if part:
+                self._send([part])
+            return
+        if part:
+            await self.redis.rpush(DIGEST_KEY, json.dumps(part))
+        if self.lease is not None and not self.lease.held:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(DIGEST_KEY, 0, -1)
+            pipe.delete(DIGEST_KEY)
+            parts, _ = await pipe.execute()
+        if parts:
+            self._send([json.loads(part) for part in parts])
+
+    def _send(self, parts: list[dict]):
+        counts: dict[str, int] = {}
+        samples: dict[str, list[str]] = {}
+        for part in parts:
+            for event, count in part["counts"].items():
+                counts[event] = counts.get(event, 0) + count
+                samples.setdefault(event, []).extend(part["samples"][event])
+        period = int(time.time() - min(part["started"] for part in parts))
+        lines = [f"📊 Сводка за {period} с"]
+        for event, count in counts.items():
+            title = EVENT_TITLES.get(event, event)
+            sample = samples[event]
+            if len(sample) > self.sample_size:
+                sample = random.sample(sample, self.sample_size)
+            lines.append(f"• {title}: {count}\n  {', '.join(sample)}")
+        self.sender.send_message(self.chat_id, "\n".join(lines), priority=PRIORITY_ADMIN)
+
+    async def run(self):
+        """Фоновая задача: отправляет сводку раз в interval или при max_events событий"""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(e)
+        finally:
+            # При остановке бота не теряем накопленное
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(e)
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import time
+
+import aiofiles
+import aiofiles.os
+from aiogram import Bot
+
+from app2.database import MediaStore
+from app2.logger import logger
+
+ARCHIVE_WORKERS = 4  # одновременных загрузок
+ARCHIVE_QUEUE = 500  # заданий в памяти; остальные ждут в спуле на диске
+ARCHIVE_SPOOL_LIMIT = 100_000  # заданий в спуле, сверх этого новые отбрасываются
+ARCHIVE_RESCAN = 10  # как часто подбираем отложенные задания из спула, секунд
+ARCHIVE_ATTEMPTS = 3  # попыток загрузки одного файла
+ARCHIVE_CLAIM_TTL = 600  # захват задания упавшим процессом снимается через столько секунд
+CLAIM_SUFFIX = ".claim"  # задание в работе: <имя>.json.<pid>.claim
+
+
+class MediaArchiver:
+    """
+    Архивирование медиа вне пути пересылки.
+
+    Каждое задание сначала записывается в спул (JSON-файл на диске), поэтому
+    переживает перезапуск. В памяти держится ограниченная очередь: если она
+    заполнена, задание остаётся только в спуле и подбирается позже, а при
+    переполненном спуле — отбрасывается.
+
+    Спул общий для всех процессов бота: воркер забирает задание переименованием
+    (атомарно), поэтому одно задание выполняет только один процесс.
+    """
+
+    def __init__(self, bot: Bot, media_dir: str, workers: int = ARCHIVE_WORKERS,
+                 max_queue: int = ARCHIVE_QUEUE, spool_limit: int = ARCHIVE_SPOOL_LIMIT):
+        self.bot = bot
+        self.media_dir = media_dir
+        self.store = MediaStore(media_dir)
+        self.spool_dir = os.path.join(media_dir, ".spool")
+        self.workers = workers
+        self.spool_limit = spool_limit
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_queue)
+        self._known: set[str] = set()  # задания в очереди или в работе
+        self._inflight: dict[str, asyncio.Event] = {}  # file_unique_id, которые сейчас загружаются
+        self._spooled = 0
+        self._tasks: list[asyncio.Task] = []
+        self._started = time.monotonic()
+        self.counters = {"saved": 0, "deduplicated": 0, "failed": 0, "deferred": 0, "dropped": 0, "bytes": 0}
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def stats(self) -> dict:
+        elapsed = max(time.monotonic() - self._started, 1)
+        return {
+            **self.counters,
+            "queue_depth": self._queue.qsize(),
+            "spooled": self._spooled,
+            "bytes_per_sec": round(self.counters["bytes"] / elapsed),
+        }
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(loop.create_task(self._rescan_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job: dict) -> bool:
+        """
+        Ставит задание в архив: одно сообщение или альбом целиком.
+        job: user_id, partner, message_id (первого сообщения),
+        items — [{message_id, content_type, file_id, file_unique_id, folder}].
+        Возвращает False, если задание отброшено из-за переполнения.
+        """
+        if self._spooled >= self.spool_limit:
+            self.counters["dropped"] += 1
+            logger.warning(f"Media spool is full, dropped {job}")
+            return False
+        name = f"{job['user_id']}_{job['message_id']}.json"
+        await self._write(name, job)
+        self._spooled += 1
+        self._enqueue(name)
+        return True
+
+    def _enqueue(self, name: str) -> bool:
+        if name in self._known:
+            return True
+        try:
+            self._queue.put_nowait(name)
+        except asyncio.QueueFull:
+            self.counters["deferred"] += 1
+            return False
+        self._known.add(name)
+        return True
+
+    async def _write(self, name: str, job: dict):
+        path = os.path.join(self.spool_dir, name)
+        async with aiofiles.open(path + ".tmp", "w", encoding="utf-8") as f:
+            await f.write(json.dumps(job))
+        await aiofiles.os.replace(path + ".tmp", path)
+
+    async def _rescan_loop(self):
+        """Подбирает из спула задания, не поместившиеся в очередь (и оставшиеся после перезапуска)"""
+        while True:
+            try:
+                files = await aiofiles.os.listdir(self.spool_dir)
+                names = [name for name in files if name.endswith(".json")]
+                claims = [name for name in files if name.endswith(CLAIM_SUFFIX)]
+                await self._release_stale(claims)
+                # Заодно сверяем счётчик спула с диском
+                self._spooled = len(names) + len(claims)
+                for name in names:
+                    if self._queue.full():
+                        break
+                    self._enqueue(name)
+                logger.info(f"Media archiver: {self.stats()}")
+            except Exception as e:
+                logger.error(e)
+            await asyncio.sleep(ARCHIVE_RESCAN)
+
+    async def _worker(self):
+        while True:
+            name = await self._queue.get()
+            path = os.path.join(self.spool_dir, name)
+            claimed = f"{path}.{os.getpid()}{CLAIM_SUFFIX}"
+            try:
+                # Задание уже забрал другой процесс (или этот) — FileNotFoundError
+                await aiofiles.os.rename(path, claimed)
+                # Срок захвата отсчитывается от момента захвата
+                os.utime(claimed)
+                async with aiofiles.open(claimed, encoding="utf-8") as f:
+                    job = json.loads(await f.read())
+                # Повтор после сбоя безопасен: уже сохранённое найдётся в хранилище
+                for item in job.get("items", [job]):
+                    await self._download({**job, **item})
+                await aiofiles.os.remove(claimed)
+                self._spooled -= 1
+            except asyncio.CancelledError:
+                raise
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Media archive failed for {name}: {e}")
+                await self._retry_later(name, claimed)
+            finally:
+                self._known.discard(name)
+
+    async def _release_stale(self, claims: list[str]):
+        """Возвращает в спул задания, захваченные давно (процесс упал или был остановлен)"""
+        deadline = time.time() - ARCHIVE_CLAIM_TTL
+        for claim in claims:
+            path = os.path.join(self.spool_dir, claim)
+            try:
+                if (await aiofiles.os.stat(path)).st_mtime < deadline:
+                    await aiofiles.os.rename(path, os.path.join(self.spool_dir, claim.rsplit(".", 2)[0]))
+                    logger.warning(f"Media archiver released stale claim {claim}")
+            except FileNotFoundError:
+                pass
+
+    async def _retry_later(self, name: str, path: str):
+        self.counters["failed"] += 1
+        try:
+            async with aiofiles.open(path, encoding="utf-8") as f:
+                job = json.loads(await f.read())
+            job["attempts"] = job.get("attempts", 0) + 1
+            if job["attempts"] < ARCHIVE_ATTEMPTS:
+                # Задание вернётся в спул и будет подобрано при следующем обходе
+                await self._write(name, job)
+            else:
+                self._spooled -= 1
+            await aiofiles.os.remove(path)
+        except Exception as e:
+            logger.error(e)
+
+    async def _download(self, job: dict):
+        unique_id = job["file_unique_id"]
+        # Тот же файл уже загружается другим воркером — дождёмся его
+        while unique_id in self._inflight:
+            await self._inflight[unique_id].wait()
+
+        blob = await self.store.lookup(unique_id)
+        if blob:
+            self.counters["deduplicated"] += 1
+        else:
+            done = self._inflight[unique_id] = asyncio.Event()
+            try:
+                blob = await self._fetch(job)
+            finally:
+                del self._inflight[unique_id]
+                done.set()
+        await self.store.link(job["user_id"], job["message_id"], job["partner"], blob, job["content_type"])
+
+    async def _fetch(self, job: dict) -> str:
+        file = await self.bot.get_file(job["file_id"])
+        ext = os.path.splitext(file.file_path)[1]
+        blob = self.store.blob_path(job["folder"], job["file_unique_id"], ext)
+        save_path = self.store.abspath(blob)
+        await aiofiles.os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        # Пишем во временный файл, чтобы недокачанный блоб не считался сохранённым;
+        # свой у каждого процесса — тот же файл может качать и другой
+        part = f"{save_path}.{os.getpid()}.part"
+        await self.bot.download_file(file.file_path, part)
+        await aiofiles.os.replace(part, save_path)
+        size = await aiofiles.os.path.getsize(save_path)
+        await self.store.register(job["file_unique_id"], blob, size)
+        self.counters["saved"] += 1
+        self.counters["bytes"] += size
+        logger.info(f"Media saved: {save_path}")
+        return blob
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import re
+import time
+import zipfile
+
+from app2.database import (redis_conn, scripts, MediaStore, MEDIA_BLOBS_KEY, MEDIA_INDEX_KEY, MEDIA_USAGE_KEY,
+                           MEDIA_AGE_PREFIX, MEDIA_SEGMENT_OF_KEY, MEDIA_REFS_PREFIX)
+from app2.logger import logger
+
+DAY = 24 * 3600
+GB = 1024 ** 3
+
+# Политика по папкам: (квота на диске в байтах, срок хранения в секундах)
+MEDIA_RETENTION = {
+    "photos": (20 * GB, 90 * DAY),
+    "videos": (50 * GB, 30 * DAY),
+    "docs": (20 * GB, 90 * DAY),
+    "voice": (10 * GB, 90 * DAY),
+    "audio": (10 * GB, 60 * DAY),
+}
+RETENTION_INTERVAL = 600  # пауза между проходами, секунд
+PACK_AFTER = 7 * DAY  # файлы старше этого упаковываются в сегменты
+BOOTSTRAP_BATCH = 1000  # файлов за один вызов скрипта при первом обходе
+PACK_BATCH = 500  # файлов за один проход упаковки
+EXPIRE_BATCH = 500  # файлов или сегментов за один проход удаления
+SEGMENT_MAX_BYTES = 256 * 1024 ** 2  # после этого размера начинается новый сегмент
+SEGMENTS_DIR = ".segments"
+
+SEGMENTS_PREFIX = "media:segments:"  # zset на папку: сегмент -> время самого нового блоба в нём
+SEGMENT_SIZE_KEY = "media:segment_size"  # hash: сегмент -> байт на диске
+SEGMENT_OPEN_KEY = "media:segment_open"  # hash: папка -> сегмент, в который сейчас дописываем
+BOOTSTRAPPED_KEY = "media:bootstrapped"  # set: папки, обход которых завершён
+
+# Файлы, сохранённые до хранилища блобов: <папка>/<user_id>_<message_id>_<имя>
+LEGACY_NAME = re.compile(r"^(\d+)_(\d+)_")
+# Тип сообщения для записи индекса по папке старого файла
+LEGACY_TYPES = {"photos": "photo", "videos": "video", "docs": "document", "voice": "voice", "audio": "audio"}
+
+_bootstrap_blobs = redis_conn.register_script(scripts.BOOTSTRAP_BLOBS)
+_drop_blobs = redis_conn.register_script(scripts.DROP_BLOBS)
+
+
+class MediaRetention:
+    """
+    Хранение медиа в пределах фиксированного бюджета диска.
+
+    Размеры ведутся инкрементально в Redis (MediaStore.register и этот класс),
+    папки обходятся только один раз — при первом запуске. За проход по каждой
+    папке: удаляются файлы и сегменты старше срока хранения, старые файлы
+    пакуются в zip-сегменты, затем удаляется самое старое, пока папка не уложится
+    в квоту. Все шаги ограничены размером пачки, поэтому проход не блокирует бота.
+    """
+
+    def __init__(self, store: MediaStore, policies: dict = MEDIA_RETENTION, interval: float = RETENTION_INTERVAL):
+        self.store = store
+        self.policies = policies
+        self.interval = interval
+        os.makedirs(self.store.abspath(SEGMENTS_DIR), exist_ok=True)
+
+    async def run(self):
+        """Фоновая задача"""
+        try:
+            await self.bootstrap()
+        except Exception as e:
+            logger.error(e)
+        while True:
+            for folder, (quota, max_age) in self.policies.items():
+                try:
+                    await self.expire(folder, max_age)
+                    await self.pack(folder)
+                    await self.enforce_quota(folder, quota)
+                except Exception as e:
+                    logger.error(e)
+            logger.info(f"Media usage: {await redis_conn.hgetall(MEDIA_USAGE_KEY)}")
+            await asyncio.sleep(self.interval)
+
+    # ---------- учёт ----------
+
+    async def bootstrap(self):
+        """
+        Однократный обход папок. Папка отмечается в BOOTSTRAPPED_KEY только после
+        полного обхода; уже учтённые блобы не считаются повторно, поэтому обход,
+        прерванный падением, при следующем запуске просто повторяется.
+        """
+        done = await redis_conn.smembers(BOOTSTRAPPED_KEY)
+        for folder in self.policies:
+            if folder in done:
+                continue
+            files = await asyncio.to_thread(self._walk, folder)
+            added = 0
+            for start in range(0, len(files), BOOTSTRAP_BATCH):
+                chunk = files[start:start + BOOTSTRAP_BATCH]
+                added += await _bootstrap_blobs(keys=[MEDIA_USAGE_KEY, f"{MEDIA_AGE_PREFIX}{folder}"],
+                                                args=[folder, *(value for file in chunk for value in file)])
+            await self._index(folder, files)
+            await redis_conn.sadd(BOOTSTRAPPED_KEY, folder)
+            logger.info(f"Media usage bootstrapped for {folder}: {len(files)} files, {added} bytes")
+
+    async def _index(self, folder: str, files: list[tuple[str, int, float]]):
+        """
+        Делает найденные файлы доступными для MediaStore: блобы — по file_unique_id,
+        старые файлы — по (user_id, message_id) из имени. Существующие записи не трогает
+        """
+        for start in range(0, len(files), BOOTSTRAP_BATCH):
+            async with redis_conn.pipeline(transaction=False) as pipe:
+                for blob, _, _ in files[start:start + BOOTSTRAP_BATCH]:
+                    name = os.path.basename(blob)
+                    legacy = LEGACY_NAME.match(name)
+                    if os.path.dirname(blob) != folder:
+                        pipe.hsetnx(MEDIA_BLOBS_KEY, self._unique_id(blob), blob)
+                    elif legacy:
+                        key = f"{legacy[1]}:{legacy[2]}"
+                        entry = {"blob": blob, "dialog": None, "type": LEGACY_TYPES.get(folder, folder)}
+                        pipe.hsetnx(MEDIA_INDEX_KEY, key, json.dumps(entry))
+                        pipe.sadd(f"{MEDIA_REFS_PREFIX}{blob}", key)
+                await pipe.execute()
+
+    def _walk(self, folder: str) -> list[tuple[str, int, float]]:
+        files = []
+        for root, _, names in os.walk(self.store.abspath(folder)):
+            for name in names:
+                if name.endswith(".part"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                blob = os.path.relpath(os.path.join(root, name), self.store.media_dir)
+                files.append((blob, stat.st_size, stat.st_mtime))
+        return files
+
+    # ---------- удаление ----------
+
+    async def expire(self, folder: str, max_age: float):
+        cutoff = time.time() - max_age
+        segments = await redis_conn.zrangebyscore(f"{SEGMENTS_PREFIX}{folder}", "-inf", cutoff,
+                                                  start=0, num=EXPIRE_BATCH)
+        await self._drop_segments(folder, segments)
+        blobs = await redis_conn.zrangebyscore(f"{MEDIA_AGE_PREFIX}{folder}", "-inf", cutoff,
+                                               start=0, num=EXPIRE_BATCH)
+        await self._drop_blobs(folder, blobs)
+
+    async def enforce_quota(self, folder: str, quota: int):
+        """Удаляет самое старое (сначала сегменты), пока папка не уложится в квоту"""
+        while int(await redis_conn.hget(MEDIA_USAGE_KEY, folder) or 0) > quota:
+            segments = await redis_conn.zrange(f"{SEGMENTS_PREFIX}{folder}", 0, 0)
+            if segments:
+                await self._drop_segments(folder, segments)
+                continue
+            blobs = await redis_conn.zrange(f"{MEDIA_AGE_PREFIX}{folder}", 0, EXPIRE_BATCH - 1)
+            if not blobs:
+                break
+            await self._drop_blobs(folder, blobs)
+
+    async def _drop_blobs(self, folder: str, blobs: list[str]):
+        if not blobs:
+            return
+        freed = await asyncio.to_thread(self._remove_files, blobs)
+        await self._forget(folder, blobs, freed)
+        logger.info(f"Media retention removed {len(blobs)} files from {folder} ({freed} bytes)")
+
+    async def _drop_segments(self, folder: str, segments: list[str]):
+        for segment in segments:
+            members = await asyncio.to_thread(self._segment_members, segment)
+            size = int(await redis_conn.hget(SEGMENT_SIZE_KEY, segment) or 0)
+            await asyncio.to_thread(self._remove_files, [segment])
+            async with redis_conn.pipeline(transaction=True) as pipe:
+                pipe.zrem(f"{SEGMENTS_PREFIX}{folder}", segment)
+                pipe.hdel(SEGMENT_SIZE_KEY, segment)
+                await self._forget(folder, members, size, pipe)
+                await pipe.execute()
+            if await redis_conn.hget(SEGMENT_OPEN_KEY, folder) == segment:
+                await redis_conn.hdel(SEGMENT_OPEN_KEY, folder)
+            logger.info(f"Media retention removed segment {segment} ({size} bytes)")
+
+    async def _forget(self, folder: str, blobs: list[str], freed: int, client=None):
+        """Убирает удалённые блобы из учёта и их записи из индекса сообщений (атомарно, одним скриптом)"""
+        args = [folder, freed, MEDIA_REFS_PREFIX]
+        for blob in blobs:
+            args.extend((blob, self._unique_id(blob)))
+        await _drop_blobs(keys=[f"{MEDIA_AGE_PREFIX}{folder}", MEDIA_BLOBS_KEY, MEDIA_USAGE_KEY, MEDIA_INDEX_KEY,
+                                MEDIA_SEGMENT_OF_KEY],
+                          args=args, client=client)
+
+    def _remove_files(self, paths: list[str]) -> int:
+        freed = 0
+        for path in paths:
+            try:
+                freed += os.path.getsize(self.store.abspath(path))
+                os.remove(self.store.abspath(path))
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def _segment_members(self, segment: str) -> list[str]:
+        try:
+            with zipfile.ZipFile(self.store.abspath(segment)) as archive:
+                return archive.namelist()
+        except (FileNotFoundError, zipfile.BadZipFile):
+            return []
+
+    @staticmethod
+    def _unique_id(blob: str) -> str:
+        return os.path.splitext(os.path.basename(blob))[0]
+
+    # ---------- упаковка ----------
+
+    async def pack(self, folder: str):
+        """Пакует пачку самых старых файлов папки в текущий сегмент"""
+        age_key = f"{MEDIA_AGE_PREFIX}{folder}"
+        blobs = await redis_conn.zrangebyscore(age_key, "-inf", time.time() - PACK_AFTER,
+                                               start=0, num=PACK_BATCH, withscores=True)
+        if not blobs:
+            return
+        segment = await redis_conn.hget(SEGMENT_OPEN_KEY, folder)
+        old_size = int(await redis_conn.hget(SEGMENT_SIZE_KEY, segment) or 0) if segment else 0
+        if not segment or old_size >= SEGMENT_MAX_BYTES:
+            segment = os.path.join(SEGMENTS_DIR, f"{folder}-{int(time.time())}.zip")
+            old_size = 0
+
+        packed, loose_size, new_size = await asyncio.to_thread(self._pack, segment, [blob for blob, _ in blobs])
+        newest = max(score for _, score in blobs)
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            if packed:
+                pipe.hset(MEDIA_SEGMENT_OF_KEY, mapping={blob: segment for blob in packed})
+            pipe.zrem(age_key, *(blob for blob, _ in blobs))
+            pipe.hset(SEGMENT_OPEN_KEY, folder, segment)
+            pipe.hset(SEGMENT_SIZE_KEY, segment, new_size)
+            pipe.zadd(f"{SEGMENTS_PREFIX}{folder}", {segment: newest}, gt=True)
+            pipe.hincrby(MEDIA_USAGE_KEY, folder, new_size - old_size - loose_size)
+            await pipe.execute()
+        logger.info(f"Media retention packed {len(packed)} files into {segment}")
+
+    def _pack(self, segment: str, blobs: list[str]) -> tuple[list[str], int, int]:
+        """Дописывает файлы в zip-сегмент и удаляет оригиналы. Возвращает (упакованные, байт файлов, размер сегмента)"""
+        path = self.store.abspath(segment)
+        packed, loose_size = [], 0
+        with zipfile.ZipFile(path, "a", compression=zipfile.ZIP_DEFLATED) as archive:
+            for blob in blobs:
+                source = self.store.abspath(blob)
+                if not os.path.exists(source):
+                    continue
+                archive.write(source, arcname=blob)
+                packed.append(blob)
+        # Оригиналы удаляем только после того, как сегмент успешно записан
+        for blob in packed:
+            loose_size += os.path.getsize(self.store.abspath(blob))
+            os.remove(self.store.abspath(blob))
+        return packed, loose_size, os.path.getsize(path)
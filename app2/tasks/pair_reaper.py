@@ -0,0 +1,44 @@
+import asyncio
+
+from app2.database import scan_pairs, reap_pair
+from app2.logger import logger
+from app2.utils import SendScheduler
+
+REAP_INTERVAL = 60  # пауза между полными проходами по парам, секунд
+REAP_STEP_DELAY = 0.1  # пауза между шагами SCAN, чтобы не нагружать Redis
+REAP_SCAN_COUNT = 500  # подсказка COUNT для одного шага SCAN
+
+# Счётчики reaper'а за время работы процесса
+reaper_stats = {
+    "pairs_reclaimed": 0,
+    "bytes_reclaimed": 0,
+}
+
+
+async def reap_idle_pairs(sender: SendScheduler, interval: float = REAP_INTERVAL, count: int = REAP_SCAN_COUNT):
+    """Фоновая задача: инкрементально обходит пары и закрывает простаивающие диалоги"""
+    cursor = 0
+    while True:
+        try:
+            cursor, idle_users = await scan_pairs(cursor, count)
+            for user_id in idle_users:
+                reaped = await reap_pair(user_id)
+                if not reaped:
+                    # Пара уже закрыта (например, при обходе ключа собеседника)
+                    continue
+                partner, freed = reaped
+                reaper_stats["pairs_reclaimed"] += 1
+                reaper_stats["bytes_reclaimed"] += freed
+                logger.info(f"Idle chat closed: {user_id} <-> {partner}")
+                for chat_id in (user_id, partner):
+                    sender.send_message(chat_id, "💤 Диалог завершён из-за неактивности."
+                                                 "\n/search для поиска нового собеседника")
+        except Exception as e:
+            logger.error(e)
+            cursor = 0
+
+        if cursor == 0:
+            logger.info(f"Pair reaper pass done: {reaper_stats}")
+            await asyncio.sleep(interval)
+        else:
+            await asyncio.sleep(REAP_STEP_DELAY)
@@ -0,0 +1,36 @@
+import asyncio
+
+from app2.logger import logger
+from app2.matchmaking import MatchStore
+from app2.utils import SendScheduler
+
+SWEEP_INTERVAL = 5  # как часто проверяем очередь, секунд
+SWEEP_BATCH = 100  # сколько просроченных убираем за один вызов хранилища
+
+
+async def sweep_queue(store: MatchStore, sender: SendScheduler, interval: float = SWEEP_INTERVAL,
+                      batch: int = SWEEP_BATCH):
+    """
+    Фоновая задача: убирает из очереди тех, у кого истекло ожидание, и уведомляет их.
+    Заодно переводит долго ждущих в общий пул своего пола.
+    """
+    while True:
+        try:
+            widened = await store.apply_fallback(batch)
+            for user_id in widened:
+                sender.send_message(user_id, "🔄 Подходящих собеседников пока нет — ищем среди всех.")
+            if widened:
+                logger.info(f"Queue sweeper widened search for {len(widened)} users")
+            expired = await store.pop_expired(batch)
+            for user_id in expired:
+                sender.send_message(user_id, "⌛ Собеседник не найден, время ожидания истекло."
+                                             "\n/search для нового поиска")
+            if expired:
+                logger.info(f"Queue sweeper removed {len(expired)} expired users")
+            if len(expired) == batch:
+                # В очереди остались просроченные — следующую пачку берём сразу
+                await asyncio.sleep(0)
+                continue
+        except Exception as e:
+            logger.error(e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,3 @@
+from .sender import SendScheduler, PRIORITY_RELAY, PRIORITY_SYSTEM, PRIORITY_ADMIN
+from .albums import AlbumCollector
+from .failures import classify_failure, BLOCKED, DEACTIVATED, RATE_LIMITED, TRANSIENT
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from aiogram.types import Message
+# Модуль общий для приложений, логгер — общий loguru
+from loguru import logger
+
+ALBUM_WINDOW = 0.6  # сколько ждём остальные части альбома, секунд
+
+
+class AlbumCollector:
+    """
+    Собирает сообщения одного альбома (media_group_id) и отдаёт их одной пачкой.
+
+    Telegram присылает каждую часть альбома отдельным апдейтом. add() не ждёт
+    окна — хендлер сразу освобождается, — а пачка уходит в flush через
+    ALBUM_WINDOW после первой части. Следующее за альбомом сообщение чата
+    не должно его обогнать: перед его пересылкой вызывается flush_chat().
+    """
+
+    def __init__(self, flush: Callable[[list[Message], Any], Awaitable[None]], window: float = ALBUM_WINDOW):
+        self.flush = flush
+        self.window = window
+        # chat_id -> media_group_id -> (части, context, таймер)
+        self._albums: dict[int, dict[str, tuple[list[Message], Any, asyncio.Task]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, message: Message, context: Any = None):
+        """context — что нужно flush вместе с альбомом (берётся от первой части)"""
+        chat = self._albums.setdefault(message.chat.id, {})
+        album = chat.get(message.media_group_id)
+        if album is not None:
+            album[0].append(message)
+            return
+        task = asyncio.create_task(self._flush_later(message.chat.id, message.media_group_id))
+        chat[message.media_group_id] = ([message], context, task)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush_chat(self, chat_id: int):
+        """Сразу отдаёт незавершённые альбомы чата. Части альбома приходят раньше следующего сообщения"""
+        chat = self._albums.pop(chat_id, None)
+        if not chat:
+            return
+        for messages, context, task in chat.values():
+            task.cancel()
+            await self._flush(messages, context)
+
+    async def _flush_later(self, chat_id: int, group_id: str):
+        await asyncio.sleep(self.window)
+        chat = self._albums.get(chat_id)
+        if not chat or group_id not in chat:
+            return
+        messages, context, _ = chat.pop(group_id)
+        if not chat:
+            del self._albums[chat_id]
+        await self._flush(messages, context)
+
+    async def _flush(self, messages: list[Message], context: Any):
+        messages.sort(key=lambda m: m.message_id)
+        try:
+            await self.flush(messages, context)
+        except Exception as e:
+            logger.error(e)
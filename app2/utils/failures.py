@@ -0,0 +1,23 @@
+import asyncio
+
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+
+# Почему не удалось доставить сообщение пользователю
+BLOCKED = "blocked"  # пользователь заблокировал бота
+DEACTIVATED = "deactivated"  # аккаунт удалён или чата больше нет
+RATE_LIMITED = "rate_limited"  # Telegram просит подождать (429)
+TRANSIENT = "transient"  # сеть или сервер Telegram, пройдёт само
+
+
+def classify_failure(error: Exception) -> str | None:
+    """Причина недоставки по ошибке Bot API; None — ошибка не про доступность пользователя"""
+    if isinstance(error, TelegramForbiddenError):
+        return DEACTIVATED if "deactivated" in error.message else BLOCKED
+    if isinstance(error, TelegramBadRequest) and "chat not found" in error.message:
+        return DEACTIVATED
+    if isinstance(error, TelegramRetryAfter):
+        return RATE_LIMITED
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)):
+        return TRANSIENT
+    return None
@@ -0,0 +1,220 @@
+import asyncio
+import inspect
+import itertools
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+# Модуль используется и в app, поэтому берём общий логгер loguru без
+# повторного добавления файлов логов (их настраивает app.logger / app2.logger)
+from loguru import logger
+
+# Приоритетные полосы: меньше — раньше
+PRIORITY_RELAY = 0  # сообщения диалога
+PRIORITY_SYSTEM = 1  # системные уведомления пользователю
+PRIORITY_ADMIN = 2  # уведомления администратору
+
+GLOBAL_RATE = 30  # сообщений в секунду на бота (лимит Telegram)
+CHAT_RATE = 1  # сообщений в секунду в один чат
+CHAT_BURST = 3  # сколько сообщений в чат можно отправить подряд
+SEND_WORKERS = 8
+MAX_RETRIES = 3  # сколько раз повторяем отправку после 429
+MAX_IDLE_CHATS = 10_000  # сколько состояний простаивающих чатов держим в памяти
+
+
+class TokenBucket:
+    """Token bucket с резервированием: токен можно занять наперёд и подождать"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд нужно подождать до отправки"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+@dataclass
+class _Job:
+    priority: int
+    call: Callable[[], Awaitable[Any]]
+    on_error: Callable[[Exception], Any] | None = None
+    attempts: int = 0
+
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    jobs: deque = field(default_factory=deque)
+    scheduled: bool = False  # чат уже стоит в очереди готовых или отправляется
+
+
+class SendScheduler:
+    """
+    Центральная очередь исходящих вызовов Bot API.
+
+    Хендлеры ставят отправку в очередь и не ждут её. Общий token bucket держит
+    бота в пределах глобального лимита, bucket на чат — в пределах лимита чата.
+    Сообщения одного чата уходят строго по порядку, между чатами выбирается
+    наиболее приоритетная полоса. На 429 (retry_after) вся рассылка встаёт на
+    одну общую паузу, а сообщение возвращается в начало очереди своего чата.
+
+    skip(chat_id) — чаты, в которые не отправляем вовсе (например, бот заблокирован);
+    on_failure(chat_id, error) вызывается при каждой неудачной отправке, перед on_error задания.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, workers: int = SEND_WORKERS,
+                 skip: Callable[[int], bool] | None = None,
+                 on_failure: Callable[[int, Exception], Any] | None = None):
+        self.bot = bot
+        self.skip = skip
+        self.on_failure = on_failure
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[int, _Chat] = {}
+        self._idle: OrderedDict[int, None] = OrderedDict()
+        self._ready: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._tasks: list[asyncio.Task] = []
+        self._callbacks: set[asyncio.Future] = set()
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "skipped": 0}
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain: float = 0):
+        """Останавливает воркеры; drain — сколько секунд дать на отправку остатка очереди"""
+        deadline = time.monotonic() + drain
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def pending(self) -> int:
+        return sum(len(chat.jobs) for chat in self._chats.values())
+
+    # ---------- постановка в очередь ----------
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]], priority: int = PRIORITY_SYSTEM,
+               on_error: Callable[[Exception], Any] | None = None):
+        """Ставит вызов Bot API в очередь чата chat_id и сразу возвращает управление"""
+        chat_id = int(chat_id)
+        if self.skip is not None and self.skip(chat_id):
+            self.stats["skipped"] += 1
+            return
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst))
+        self._idle.pop(chat_id, None)
+        chat.jobs.append(_Job(priority, call, on_error))
+        if not chat.scheduled:
+            self._schedule(chat_id, chat)
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_SYSTEM,
+                     on_error: Callable[[Exception], Any] | None = None, **kwargs):
+        self.submit(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs), priority, on_error)
+
+    def copy_message(self, chat_id: int, from_chat_id: int, message_id: int, priority: int = PRIORITY_RELAY,
+                     on_error: Callable[[Exception], Any] | None = None, **kwargs):
+        self.submit(chat_id,
+                    lambda: self.bot.copy_message(chat_id=chat_id, from_chat_id=from_chat_id,
+                                                  message_id=message_id, **kwargs),
+                    priority, on_error)
+
+    # ---------- внутреннее ----------
+
+    def _schedule(self, chat_id: int, chat: _Chat, delay: float = 0.0):
+        chat.scheduled = True
+        delay = max(delay, chat.bucket.reserve())
+        entry = (chat.jobs[0].priority, next(self._seq), chat_id)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, entry)
+        else:
+            self._ready.put_nowait(entry)
+
+    def _release(self, chat_id: int, chat: _Chat):
+        chat.scheduled = False
+        if chat.jobs:
+            self._schedule(chat_id, chat)
+            return
+        self._idle[chat_id] = None
+        while len(self._idle) > MAX_IDLE_CHATS:
+            old_id, _ = self._idle.popitem(last=False)
+            self._chats.pop(old_id, None)
+
+    async def _worker(self):
+        while True:
+            _, _, chat_id = await self._ready.get()
+            chat = self._chats.get(chat_id)
+            if chat is None or not chat.jobs:
+                continue
+            job = chat.jobs.popleft()
+            retry_delay = 0.0
+            try:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                wait = self._global.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await job.call()
+                self.stats["sent"] += 1
+            except asyncio.CancelledError:
+                raise
+            except TelegramRetryAfter as e:
+                # Одна общая пауза вместо отдельного ожидания в каждом воркере
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                job.attempts += 1
+                if job.attempts <= MAX_RETRIES:
+                    self.stats["retried"] += 1
+                    chat.jobs.appendleft(job)
+                    retry_delay = e.retry_after
+                    logger.warning(f"Flood control, pause {e.retry_after}s (chat {chat_id})")
+                else:
+                    self._fail(chat_id, job, e)
+            except Exception as e:
+                self._fail(chat_id, job, e)
+            finally:
+                if retry_delay:
+                    chat.scheduled = False
+                    self._schedule(chat_id, chat, retry_delay)
+                else:
+                    self._release(chat_id, chat)
+
+    def _fail(self, chat_id: int, job: _Job, error: Exception):
+        self.stats["failed"] += 1
+        if self.on_failure is not None:
+            self._callback(self.on_failure, chat_id, error)
+        if job.on_error is None:
+            logger.error(error)
+            return
+        self._callback(job.on_error, error)
+
+    def _callback(self, callback: Callable[..., Any], *args):
+        try:
+            result = callback(*args)
+            if inspect.isawaitable(result):
+                future = asyncio.ensure_future(result)
+                self._callbacks.add(future)
+                future.add_done_callback(self._callbacks.discard)
+        except Exception as e:
+            logger.error(e)
@@ -0,0 +1,239 @@
+"""
+Горизонтальное масштабирование: один процесс принимает апдейты и раскладывает
+их по шардам (Redis Stream на шард, шард = user_id % N), N процессов-воркеров
+обрабатывают каждый свой шард.
+
+Все апдейты одного пользователя попадают в один шард и обрабатываются по
+порядку; апдейты разных пользователей идут параллельно и друг друга не ждут:
+каждый подтверждается (XACK) сразу после обработки. Общее
+состояние (очередь, пары, FSM) хранится в Redis, поэтому любой воркер может
+обслужить любого пользователя.
+"""
+import asyncio
+import multiprocessing
+import time
+from typing import Awaitable, Callable
+
+import redis.asyncio as redis
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from redis.exceptions import ResponseError
+# Модуль используется и в app, логгер — общий loguru
+from loguru import logger
+
+STREAM_PREFIX = "updates:shard:"
+CONSUMER_GROUP = "workers"
+STREAM_MAXLEN = 100_000  # длина потока шарда, после которой предупреждаем об отставании воркера
+TRIM_INTERVAL = 10  # как часто приём обрезает обработанное начало потоков, секунд
+READ_BATCH = 100  # апдейтов за одно чтение воркера
+MAX_INFLIGHT = 1000  # апдейтов шарда в обработке одновременно; больше воркер не читает
+POLL_TIMEOUT = 30  # long polling у Telegram, секунд
+RETRY_MAX_DELAY = 30  # предел паузы между повторами при ошибках Redis, секунд
+SUPERVISE_INTERVAL = 2  # как часто проверяем, живы ли процессы кластера, секунд
+
+
+def user_of(update: Update) -> int:
+    """Ключ упорядочивания апдейта — id пользователя (или чата)"""
+    try:
+        event = update.event
+    except Exception:
+        return 0
+    user = getattr(event, "from_user", None)
+    if user:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat else 0
+
+
+async def ingest(bot: Bot, conn: redis.Redis, shards: int, allowed_updates: list[str] | None = None):
+    """Получает апдейты через getUpdates и раскладывает их по потокам шардов"""
+    offset = None
+    trimmed = time.monotonic()
+    while True:
+        if time.monotonic() - trimmed >= TRIM_INTERVAL:
+            trimmed = time.monotonic()
+            await trim(conn, shards)
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(e)
+            await asyncio.sleep(1)
+            continue
+        if not updates:
+            continue
+        async with conn.pipeline(transaction=False) as pipe:
+            for update in updates:
+                pipe.xadd(f"{STREAM_PREFIX}{user_of(update) % shards}",
+                          {"update": update.model_dump_json(exclude_none=True)})
+            await pipe.execute()
+        # Сдвигаем offset только после записи в Redis — апдейты не теряются
+        offset = updates[-1].update_id + 1
+
+
+async def trim(conn: redis.Redis, shards: int):
+    """
+    Обрезает начало потоков шардов до самого старого апдейта, который группа ещё
+    не подтвердила (или до последнего выданного, если таких нет). Необработанные
+    апдейты не удаляются никогда; если воркер отстаёт, пишем предупреждение.
+    """
+    for shard in range(shards):
+        stream = f"{STREAM_PREFIX}{shard}"
+        try:
+            groups = await conn.xinfo_groups(stream)
+            group = next((group for group in groups if group["name"] == CONSUMER_GROUP), None)
+            if group is None:
+                continue  # воркер шарда ещё не запускался — всё в потоке не прочитано
+            keep = group["last-delivered-id"]
+            if group["pending"]:
+                keep = (await conn.xpending(stream, CONSUMER_GROUP))["min"] or keep
+            await conn.xtrim(stream, minid=keep, approximate=True)
+            length = await conn.xlen(stream)
+            if length > STREAM_MAXLEN:
+                logger.warning(f"Shard {shard} is lagging: {length} updates in the stream")
+        except ResponseError as e:
+            if "no such key" not in str(e):
+                logger.error(f"Shard {shard}: {e}")
+        except Exception as e:
+            logger.error(f"Shard {shard}: {e}")
+
+
+async def consume(dp: Dispatcher, bot: Bot, conn: redis.Redis, shard: int):
+    """
+    Обрабатывает поток одного шарда. На шард должен быть ровно один воркер.
+    Апдейты одного пользователя выстраиваются в цепочку, разных — идут
+    параллельно; каждый подтверждается отдельно сразу после обработки, поэтому
+    медленный апдейт задерживает только своего пользователя.
+    Ошибки Redis не останавливают воркер: чтение и подтверждение повторяются с паузой.
+    """
+    stream = f"{STREAM_PREFIX}{shard}"
+    consumer = f"shard-{shard}"
+    await _retry(lambda: _create_group(conn, stream))
+
+    inflight = asyncio.Semaphore(MAX_INFLIGHT)
+    # user_id -> последняя задача его цепочки
+    tails: dict[int, asyncio.Task] = {}
+
+    async def handle(entry_id: str, update: Update, previous: asyncio.Task | None):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await _feed(dp, bot, update)
+            await _retry(lambda: conn.xack(stream, CONSUMER_GROUP, entry_id))
+        finally:
+            inflight.release()
+
+    def done(user: int, task: asyncio.Task):
+        if tails.get(user) is task:
+            del tails[user]
+
+    # Сначала дочитываем неподтверждённое после прошлого запуска, потом новое
+    last_id = "0"
+    delay = 1
+    try:
+        while True:
+            try:
+                response = await conn.xreadgroup(CONSUMER_GROUP, consumer, {stream: last_id},
+                                                 count=READ_BATCH, block=5000)
+            except Exception as e:
+                logger.error(f"Shard {shard}: {e}")
+                if isinstance(e, ResponseError) and "NOGROUP" in str(e):
+                    # Поток пропал вместе с группой (например, Redis перезапущен без данных)
+                    await _retry(lambda: _create_group(conn, stream))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+                continue
+            delay = 1
+            entries = response[0][1] if response else []
+            if not entries:
+                last_id = ">"
+                continue
+            if last_id != ">":
+                # Неподтверждённые читаем дальше с последнего полученного, иначе получим их снова
+                last_id = entries[-1][0]
+
+            for entry_id, fields in entries:
+                await inflight.acquire()
+                update = Update.model_validate_json(fields["update"])
+                user = user_of(update)
+                task = asyncio.create_task(handle(entry_id, update, tails.get(user)))
+                tails[user] = task
+                task.add_done_callback(lambda task, user=user: done(user, task))
+    finally:
+        for task in list(tails.values()):
+            task.cancel()
+
+
+async def _create_group(conn: redis.Redis, stream: str):
+    try:
+        await conn.xgroup_create(stream, CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _retry(call: Callable[[], Awaitable]):
+    """Повторяет вызов Redis с растущей паузой, пока он не пройдёт"""
+    delay = 1
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            logger.error(e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+
+
+async def _feed(dp: Dispatcher, bot: Bot, update: Update):
+    try:
+        await dp.feed_update(bot, update)
+    except Exception as e:
+        logger.error(e)
+
+
+async def run_worker(dp: Dispatcher, bot: Bot, conn: redis.Redis, shard: int):
+    await dp.emit_startup(bot=bot)
+    logger.info(f"Shard worker {shard} started")
+    try:
+        await consume(dp, bot, conn, shard)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+
+def run_cluster(setup: Callable[[], tuple[Dispatcher, Bot, redis.Redis]], shards: int):
+    """
+    Запускает приём апдейтов и shards процессов-воркеров и следит за ними
+    (блокирующий вызов): упавший процесс перезапускается, иначе апдейты его
+    шарда копились бы в потоке без обработки. setup вызывается в каждом процессе.
+    """
+    def worker(shard: int):
+        dp, bot, conn = setup()
+        asyncio.run(run_worker(dp, bot, conn, shard))
+
+    def receiver():
+        dp, bot, conn = setup()
+        asyncio.run(ingest(bot, conn, shards, dp.resolve_used_update_types()))
+
+    # Текущий процесс только следит за остальными и не запускает event loop,
+    # поэтому fork из него безопасен
+    context = multiprocessing.get_context("fork")
+    targets = {f"shard {shard}": (worker, (shard,)) for shard in range(shards)}
+    targets["ingest"] = (receiver, ())
+
+    def start(name: str) -> multiprocessing.Process:
+        target, args = targets[name]
+        process = context.Process(target=target, args=args, name=name, daemon=True)
+        process.start()
+        return process
+
+    processes = {name: start(name) for name in targets}
+    try:
+        while True:
+            time.sleep(SUPERVISE_INTERVAL)
+            for name, process in processes.items():
+                if not process.is_alive():
+                    logger.error(f"Cluster process {name} exited with code {process.exitcode}, restarting")
+                    processes[name] = start(name)
+    finally:
+        for process in processes.values():
+            process.terminate()
@@ -0,0 +1,106 @@
+"""
+Приём апдейтов через webhook (aiohttp) вместо long polling.
+
+Telegram получает 200 сразу: апдейт обрабатывается в фоновой задаче
+(SimpleRequestHandler с handle_in_background). Несколько процессов слушают
+один порт через SO_REUSEPORT, ядро распределяет соединения между ними.
+
+Локальная проверка — отправить записанные апдейты (JSON по одному в строке):
+
+    python -m app2.utils.webhook http://localhost:8080/webhook SECRET updates.jsonl
+"""
+import asyncio
+import multiprocessing
+import secrets
+import sys
+from typing import Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import ClientSession, web
+# Модуль используется и в app, логгер — общий loguru
+from loguru import logger
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def ensure_secret(secret: str) -> str:
+    """
+    Секрет webhook. С пустым секретом SimpleRequestHandler не проверяет заголовок
+    и принимает поддельные апдейты от кого угодно, поэтому генерируем случайный.
+    Вызывать до запуска воркеров: секрет нужен и set_webhook, и им.
+    """
+    if secret:
+        return secret
+    logger.warning("WEBHOOK_SECRET is not set, using a random secret for this run")
+    return secrets.token_urlsafe(32)
+
+
+async def set_webhook(bot: Bot, url: str, secret: str, drop_pending_updates: bool = False):
+    """
+    Регистрирует webhook в Telegram (вызывается один раз, до запуска воркеров).
+    Накопившиеся апдейты по умолчанию сохраняются и придут после запуска
+    """
+    await bot.set_webhook(url, secret_token=secret, drop_pending_updates=drop_pending_updates)
+    await bot.session.close()
+
+
+async def serve(dp: Dispatcher, bot: Bot, path: str, secret: str, host: str, port: int,
+                reuse_port: bool = False):
+    if not secret:
+        raise ValueError("Webhook secret is required")
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret,
+                         handle_in_background=True).register(app, path=path)
+    # Запускает dp.startup / dp.shutdown вместе с приложением
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=reuse_port)
+    await site.start()
+    logger.info(f"Webhook server listening on {host}:{port}{path}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def run_webhook(setup: Callable[[], tuple[Dispatcher, Bot]], path: str, secret: str, host: str, port: int,
+                workers: int = 1):
+    """
+    Запускает webhook-сервер в workers процессах на одном порту (блокирующий вызов).
+    setup вызывается в каждом процессе и возвращает его Dispatcher и Bot.
+    """
+    def worker():
+        dp, bot = setup()
+        asyncio.run(serve(dp, bot, path, secret, host, port, reuse_port=workers > 1))
+
+    if workers <= 1:
+        worker()
+        return
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=worker, daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+async def post_updates(url: str, secret: str, path: str):
+    """Отправляет на webhook записанные апдейты из файла (по JSON-объекту в строке)"""
+    async with ClientSession() as session:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                async with session.post(url, data=line, headers={SECRET_HEADER: secret,
+                                                                  "Content-Type": "application/json"}) as resp:
+                    print(resp.status, line[:80].strip())
+
+
+if __name__ == "__main__":
+    asyncio.run(post_updates(*sys.argv[1:4]))
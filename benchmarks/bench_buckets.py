@@ -0,0 +1,88 @@
+"""
+Задержка поиска с учётом профиля в зависимости от размера очереди
+и числа занятых корзин.
+
+Очередь заполняется пользователями, которые не подходят ищущему
+(девушка ищет парня), в 1…5 несовместимых корзинах; в конце очереди ждёт
+один подходящий. Очередь заполняется напрямую, минуя поиск, чтобы
+заполняющие не разобрали друг друга. Одна общая очередь перебирала бы всех несовместимых,
+корзины смотрят только головы подходящих. Redis-бэкенд очищает ключи
+очереди, поэтому запускайте его на отдельной базе:
+
+    REDIS_URL=redis://localhost/15 python -m benchmarks.bench_buckets memory redis
+"""
+import asyncio
+import itertools
+import statistics
+import sys
+import time
+
+from app2.matchmaking import create_store, MatchStore, FEMALE, MALE, SEXES, WANTS, compatible_buckets
+
+SIZES = (1_000, 10_000, 50_000)
+BUCKETS = (1, 3, 5)
+ROUNDS = 200
+BASE_ID = 3 * 10 ** 13
+
+SEARCHER = (FEMALE, MALE)
+WAITING = (MALE, FEMALE)
+# Корзины, в которых не подходит никто ни ищущему, ни его собеседнику
+INCOMPATIBLE = [bucket for bucket in itertools.product(SEXES, WANTS)
+                if bucket not in compatible_buckets(*SEARCHER) + compatible_buckets(*WAITING)]
+
+
+async def fill(store: MatchStore, size: int, buckets: int) -> int:
+    """Ставит в очередь size несовместимых пользователей. Возвращает следующий свободный id"""
+    deadline = time.time() + 3600
+    if store.name == "memory":
+        for i in range(size):
+            store._enqueue(BASE_ID + i, INCOMPATIBLE[i % buckets], deadline)
+    else:
+        from app2.database import redis_conn, QUEUE_KEY
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            for i in range(size):
+                sex, want = INCOMPATIBLE[i % buckets]
+                pipe.zadd(f"{QUEUE_KEY}:{sex}:{want}", {BASE_ID + i: deadline})
+            await pipe.execute()
+    return BASE_ID + size
+
+
+async def measure(store: MatchStore, next_id: int) -> float:
+    """Медиана поиска, когда подходящий собеседник ждёт последним"""
+    samples = []
+    for _ in range(ROUNDS):
+        waiting, searcher = next_id, next_id + 1
+        next_id += 2
+        await store.set_profile(waiting, *WAITING)
+        await store.match(waiting)
+        await store.set_profile(searcher, *SEARCHER)
+        started = time.perf_counter()
+        status, partner, _ = await store.match(searcher)
+        samples.append(time.perf_counter() - started)
+        assert partner == waiting, status
+        await store.unpair(searcher)
+    return statistics.median(samples) * 1000
+
+
+async def clear(store: MatchStore, size: int):
+    for i in range(size):
+        await store.leave_queue(BASE_ID + i)
+
+
+async def main(backends: list[str]):
+    for backend in backends:
+        store = create_store(backend)
+        print(f"{backend}: median match, ms")
+        print(f"{'queue':>8} " + " ".join(f"{f'{b} buckets':>10}" for b in BUCKETS))
+        for size in SIZES:
+            row = []
+            for buckets in BUCKETS:
+                next_id = await fill(store, size, buckets)
+                row.append(await measure(store, next_id))
+                await clear(store, size)
+            print(f"{size:>8} " + " ".join(f"{ms:>10.3f}" for ms in row))
+        await store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:] or ["memory"]))
@@ -0,0 +1,47 @@
+"""
+Проверка соответствия и пропускная способность реализаций MatchStore.
+
+Для каждого доступного бэкенда сначала прогоняется общий набор проверок
+(app2.matchmaking.conformance), затем замеряется, сколько поисков в секунду
+выдерживает хранилище. Redis и SQL нужно указывать на тестовые базы:
+
+    REDIS_URL=redis://localhost/15 DB_PATH=sqlite+aiosqlite:///bench.db \\
+        python -m benchmarks.bench_match_store memory redis sql
+"""
+import asyncio
+import sys
+import time
+
+from app2.matchmaking import create_store, MatchStore
+from app2.matchmaking.conformance import check_store
+
+SEARCHES = 5000
+
+
+async def throughput(store: MatchStore, searches: int) -> float:
+    """Поисков в секунду: каждый второй поиск создаёт пару, затем пары разрываются"""
+    base = 2 * 10 ** 13
+    started = time.perf_counter()
+    for i in range(searches):
+        await store.match(base + i)
+    for i in range(0, searches, 2):
+        await store.unpair(base + i)
+    elapsed = time.perf_counter() - started
+    return (searches + searches // 2) / elapsed
+
+
+async def main(backends: list[str]):
+    if "sql" in backends:
+        from app.database import initialize_database, engine
+        await initialize_database(engine)
+    for backend in backends:
+        store = create_store(backend)
+        await check_store(store)
+        searches = SEARCHES if backend != "sql" else SEARCHES // 10
+        ops = await throughput(store, searches)
+        print(f"{backend:>7}: conformance ok, {ops:10.0f} ops/s")
+        await store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:] or ["memory"]))
@@ -0,0 +1,64 @@
+"""
+Создание и разрыв пары: последовательные команды против атомарных скриптов.
+
+По умолчанию нужен локальный Redis (REDIS_URL, лучше отдельная база).
+С BENCH_FAKEREDIS=1 используется fakeredis (pip install fakeredis lupa) —
+сравнение тогда показывает число команд, а не сетевые задержки.
+
+    REDIS_URL=redis://localhost/15 python -m benchmarks.bench_pair_ops
+"""
+import asyncio
+import os
+import statistics
+import time
+
+import redis.asyncio as redis
+
+from app2.database import scripts
+
+PREFIX = "bench:pair:"
+CHANNEL = "bench:invalidate"
+TTL = 3600
+ROUNDS = 2000
+
+
+def connect():
+    if os.environ.get("BENCH_FAKEREDIS") == "1":
+        from fakeredis import FakeAsyncRedis
+        return FakeAsyncRedis(decode_responses=True)
+    return redis.from_url(os.environ.get("REDIS_URL", "redis://localhost"), decode_responses=True)
+
+
+async def legacy_cycle(conn, user1: int, user2: int):
+    # set_pair: два SET
+    await conn.set(f"{PREFIX}{user1}", user2, ex=TTL)
+    await conn.set(f"{PREFIX}{user2}", user1, ex=TTL)
+    # remove_pair: GET + два DEL
+    partner = await conn.get(f"{PREFIX}{user1}")
+    if partner:
+        await conn.delete(f"{PREFIX}{partner}")
+    await conn.delete(f"{PREFIX}{user1}")
+
+
+async def main():
+    conn = connect()
+    set_pair = conn.register_script(scripts.SET_PAIR)
+    unpair = conn.register_script(scripts.UNPAIR)
+
+    async def atomic_cycle(user1: int, user2: int):
+        await set_pair(args=[user1, user2, PREFIX, TTL, CHANNEL])
+        await unpair(keys=[f"{PREFIX}{user1}"], args=[PREFIX, user1, CHANNEL])
+
+    for name, cycle in (("legacy", lambda a, b: legacy_cycle(conn, a, b)), ("atomic", atomic_cycle)):
+        samples = []
+        for i in range(ROUNDS):
+            started = time.perf_counter()
+            await cycle(2 * i, 2 * i + 1)
+            samples.append(time.perf_counter() - started)
+        print(f"{name:>7}: median {statistics.median(samples) * 1e6:8.1f} µs, "
+              f"p99 {sorted(samples)[int(ROUNDS * 0.99)] * 1e6:8.1f} µs per set+remove")
+    await conn.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
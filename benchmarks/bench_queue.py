@@ -0,0 +1,66 @@
+"""
+Задержка поиска в зависимости от размера очереди.
+
+Сравнивает старую проверку очереди (LRANGE всего списка) с sorted set
+(ZSCORE + атомарный match_user). Нужен локальный Redis; бенчмарк очищает
+ключи очереди, поэтому запускайте его на отдельной базе:
+
+    REDIS_URL=redis://localhost/15 python -m benchmarks.bench_queue
+"""
+import asyncio
+import statistics
+import time
+
+from app2.database import redis_conn, QUEUE_KEY, QUEUE_BUCKETS, QUEUE_TTL, is_in_queue, match_user
+
+LEGACY_QUEUE_KEY = "bench:legacy_queue"
+# Пользователи без профиля ждут в общей корзине
+BUCKET_KEY = f"{QUEUE_KEY}:u:any"
+SIZES = (0, 1_000, 10_000, 100_000)
+ROUNDS = 200
+BASE_ID = 10 ** 9
+
+
+async def fill(size: int):
+    await redis_conn.delete(*QUEUE_BUCKETS, LEGACY_QUEUE_KEY)
+    for start in range(0, size, 10_000):
+        ids = range(start, min(start + 10_000, size))
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.zadd(BUCKET_KEY, {i: time.time() + QUEUE_TTL for i in ids})
+            pipe.rpush(LEGACY_QUEUE_KEY, *ids)
+            await pipe.execute()
+
+
+async def legacy_search(user_id: int):
+    queue = await redis_conn.lrange(LEGACY_QUEUE_KEY, 0, -1)
+    return str(user_id) in queue
+
+
+async def new_search(user_id: int):
+    if not await is_in_queue(user_id):
+        await match_user(user_id)
+
+
+async def measure(func, size: int) -> float:
+    samples = []
+    for i in range(ROUNDS):
+        user_id = BASE_ID + size + i
+        started = time.perf_counter()
+        await func(user_id)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+async def main():
+    print(f"{'queue':>8} {'legacy, ms':>12} {'zset, ms':>10}")
+    for size in SIZES:
+        await fill(size)
+        legacy = await measure(legacy_search, size)
+        new = await measure(new_search, size)
+        print(f"{size:>8} {legacy:>12.3f} {new:>10.3f}")
+    await redis_conn.delete(*QUEUE_BUCKETS, LEGACY_QUEUE_KEY)
+    await redis_conn.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+UPSERT против add_user + set_user_state.
+
+Замеряет задержку «добавить/обновить пользователя и поставить в поиск»
+и число SQL-запросов на вызов, а также пакетную загрузку пользователей.
+Бенчмарк пишет в базу из DB_PATH, поэтому указывайте тестовую:
+
+    DB_PATH=sqlite+aiosqlite:///bench.db python -m benchmarks.bench_upsert
+"""
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy import event
+
+from app.database import AsyncSessionLocal, engine, initialize_database, crud
+
+ROUNDS = 500
+BATCH = 5000
+
+queries = 0
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def count_query(*args):
+    global queries
+    queries += 1
+
+
+async def legacy(user_id: int):
+    async with AsyncSessionLocal() as session:
+        await crud.add_user(session, user_id, f"user{user_id}")
+        await crud.set_user_state(session, user_id, "Searching")
+
+
+async def upsert(user_id: int):
+    async with AsyncSessionLocal() as session:
+        await crud.upsert_user(session, user_id, f"user{user_id}", state="Searching")
+
+
+async def measure(func, ids: list[int]) -> tuple[float, float]:
+    """Медиана, мс, и SQL-запросов на вызов"""
+    global queries
+    samples = []
+    queries = 0
+    for user_id in ids:
+        started = time.perf_counter()
+        await func(user_id)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, queries / len(ids)
+
+
+async def batch_legacy(ids: list[int]) -> float:
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as session:
+        for user_id in ids:
+            await crud.add_user(session, user_id, f"user{user_id}")
+    return time.perf_counter() - started
+
+
+async def batch_upsert(ids: list[int]) -> float:
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as session:
+        await crud.upsert_users(session, [(user_id, f"user{user_id}") for user_id in ids])
+    return time.perf_counter() - started
+
+
+async def main():
+    await initialize_database(engine)
+    base = random.randrange(10 ** 12, 10 ** 13)
+    new_legacy = [base + i for i in range(ROUNDS)]
+    new_upsert = [base + ROUNDS + i for i in range(ROUNDS)]
+
+    print(f"{'case':>22} {'median, ms':>11} {'queries':>8}")
+    for name, func, ids in (("new user, legacy", legacy, new_legacy),
+                            ("new user, upsert", upsert, new_upsert),
+                            ("existing user, legacy", legacy, new_legacy),
+                            ("existing user, upsert", upsert, new_upsert)):
+        ms, per_call = await measure(func, ids)
+        print(f"{name:>22} {ms:>11.3f} {per_call:>8.1f}")
+
+    base += 2 * ROUNDS
+    legacy_s = await batch_legacy([base + i for i in range(BATCH)])
+    upsert_s = await batch_upsert([base + BATCH + i for i in range(BATCH)])
+    print(f"batch of {BATCH}: legacy {legacy_s:.2f}s, upsert {upsert_s:.2f}s")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())